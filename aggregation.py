@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+
+# グループ集計で求める統計量
+GROUP_STAT_FUNCS = ['count', 'mean', 'std', 'min', 'max', 'median']
+
+
+def get_aggregate_value_cols(df):
+    """集計対象の列（総合の素点・得点率とカテゴリ別（能力・領域など）の得点率）"""
+    candidates = ['total_score', 'total_rate']
+    candidates += [c for c in df.columns if c.endswith('_rate') and c not in candidates]
+    return [c for c in candidates if c in df.columns]
+
+
+def compute_group_aggregates(df, by='subject'):
+    """グループごとの統計量を1回のグループ集計で計算
+
+    戻り値の列は (対象列, 統計量) のMultiIndexで、('_size', 'size') に行数を持つ。
+    グループの並びはデータ中の出現順。
+    """
+    value_cols = get_aggregate_value_cols(df)
+    if by not in df.columns or not value_cols:
+        return pd.DataFrame()
+
+    # カテゴリ型のコードでグループ化し、全列の統計量をまとめて求める
+    keys = df[by]
+    if not isinstance(keys.dtype, pd.CategoricalDtype):
+        keys = keys.astype('category')
+    grouped = df[value_cols].groupby(keys, sort=False, observed=True)
+    aggregates = grouped.agg(GROUP_STAT_FUNCS)
+    aggregates[('_size', 'size')] = grouped.size()
+    aggregates.index = pd.Index(list(aggregates.index), name=by)
+    return aggregates
+
+
+def get_group_category_means(aggregates, param_dict, labels):
+    """グループ×カテゴリの平均得点率の表（行: カテゴリ名, 列: グループ）"""
+    rows = {}
+    for category, label in labels.items():
+        rate_col = f'{category}_rate'
+        if category in param_dict and (rate_col, 'mean') in aggregates.columns:
+            rows[label] = aggregates[(rate_col, 'mean')]
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame(rows).T.sort_index().sort_index(axis=1)
+
+
+# 集計キューブの次元
+CUBE_DIMS = ['grade', 'class', 'subject']
+
+
+def get_score_columns(df):
+    """素点・得点率の列（*_score, *_rate）"""
+    return [c for c in df.columns if c.endswith('_score') or c.endswith('_rate')]
+
+
+def _plain_multiindex(index, names):
+    """カテゴリ型の水準を通常の値に戻したMultiIndexを作成"""
+    if not isinstance(index, pd.MultiIndex):
+        return pd.MultiIndex.from_arrays([pd.Index(list(index))], names=names)
+    levels = [pd.Index(list(index.get_level_values(i))) for i in range(index.nlevels)]
+    return pd.MultiIndex.from_arrays(levels, names=names)
+
+
+class AggregateCube:
+    """学年×クラス×教科のセルごとに十分統計量を保持する集計キューブ
+
+    各セル・各列について 件数(n)・合計・二乗和・最小・最大 を持ち、
+    任意の次元の組み合わせへの集約は生徒の行を参照せずセル単位の計算で求める。
+    """
+
+    STATS = ['n', 'sum', 'sumsq', 'min', 'max']
+
+    def __init__(self, dims, value_cols, cells):
+        self.dims = list(dims)
+        self.value_cols = list(value_cols)
+        # 統計量ごとの (セル×列) の表
+        self.cells = cells
+
+    @classmethod
+    def from_frame(cls, df, dims=None, value_cols=None):
+        """得点計算済みのDataFrameから作成"""
+        dims = [d for d in (dims or CUBE_DIMS) if d in df.columns]
+        value_cols = value_cols or get_score_columns(df)
+        values = df[value_cols].astype(np.float64)
+
+        if dims:
+            keys = [df[d] if isinstance(df[d].dtype, pd.CategoricalDtype) else df[d].astype('category')
+                    for d in dims]
+            grouped = values.groupby(keys, sort=True, observed=True, dropna=False)
+            squared = (values ** 2).groupby(keys, sort=True, observed=True, dropna=False)
+            cells = {
+                'n': grouped.count(),
+                'sum': grouped.sum(),
+                'sumsq': squared.sum(),
+                'min': grouped.min(),
+                'max': grouped.max(),
+            }
+            index = _plain_multiindex(cells['n'].index, dims)
+            cells = {stat: table.set_axis(index) for stat, table in cells.items()}
+        else:
+            # 次元の列がない場合は全体を1セルとする
+            cells = {
+                'n': values.count().to_frame().T,
+                'sum': values.sum().to_frame().T,
+                'sumsq': (values ** 2).sum().to_frame().T,
+                'min': values.min().to_frame().T,
+                'max': values.max().to_frame().T,
+            }
+        return cls(dims, value_cols, cells)
+
+    @property
+    def n_cells(self):
+        return len(self.cells['n'])
+
+    def _select(self, where):
+        """where（{次元: 値 または 値のリスト}）に該当するセルの位置"""
+        selected = np.ones(self.n_cells, dtype=bool)
+        index = self.cells['n'].index
+        for dim, value in (where or {}).items():
+            if dim not in self.dims:
+                raise KeyError(f'集計キューブに次元 {dim} がありません')
+            level = index.get_level_values(dim)
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            selected &= level.isin(values)
+        return selected
+
+    def subset(self, where=None):
+        """条件に該当するセルだけを持つ集計キューブ"""
+        selected = self._select(where)
+        return AggregateCube(self.dims, self.value_cols,
+                             {stat: table[selected] for stat, table in self.cells.items()})
+
+    def merge(self, other):
+        """別の集計キューブ（同じ次元を持つもの）と合算した集計キューブ
+
+        同じセルの統計量は 件数・合計・二乗和 を足し合わせ、最小・最大を取り直す。
+        チャンクごとに作ったキューブを順に合算すれば、全行から作ったものと同じ結果になる。
+        """
+        if self.dims != other.dims:
+            raise ValueError('次元が異なる集計キューブは結合できません')
+        value_cols = self.value_cols + [c for c in other.value_cols if c not in self.value_cols]
+        cells = {}
+        for stat in self.STATS:
+            combined = pd.concat([self.cells[stat], other.cells[stat]]).reindex(columns=value_cols)
+            grouped = combined.groupby(level=list(range(combined.index.nlevels)), sort=True, dropna=False)
+            cells[stat] = grouped.min() if stat == 'min' else grouped.max() if stat == 'max' else grouped.sum()
+        return AggregateCube(self.dims, value_cols, cells)
+
+    def rollup(self, by=(), where=None):
+        """指定した次元ごとに集約した統計量
+
+        戻り値の列は (対象列, 統計量) のMultiIndexで、統計量は n・sum・mean・std・min・max。
+        by を省略すると全体を1行（インデックス 'all'）に集約する。
+        """
+        by = list(by)
+        selected = self._select(where)
+        tables = {stat: table[selected] for stat, table in self.cells.items()}
+
+        if by:
+            reduced = {}
+            for stat, table in tables.items():
+                grouped = table.groupby(level=by, sort=True, dropna=False)
+                reduced[stat] = grouped.min() if stat == 'min' else grouped.max() if stat == 'max' else grouped.sum()
+        else:
+            reduced = {
+                'n': tables['n'].sum().to_frame('all').T,
+                'sum': tables['sum'].sum().to_frame('all').T,
+                'sumsq': tables['sumsq'].sum().to_frame('all').T,
+                'min': tables['min'].min().to_frame('all').T,
+                'max': tables['max'].max().to_frame('all').T,
+            }
+
+        n = reduced['n']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = reduced['sum'] / n.where(n > 0)
+            var = (reduced['sumsq'] - reduced['sum'] * mean) / (n - 1).where(n > 1)
+        std = np.sqrt(var.clip(lower=0))
+
+        result = pd.concat({
+            'n': n.astype(np.int64),
+            'sum': reduced['sum'],
+            'mean': mean,
+            'std': std,
+            'min': reduced['min'],
+            'max': reduced['max'],
+        }, axis=1)
+        # (対象列, 統計量) の順に並べ替え
+        result = result.swaplevel(axis=1)
+        stat_order = ['n', 'sum', 'mean', 'std', 'min', 'max']
+        result = result.reindex(columns=pd.MultiIndex.from_product([self.value_cols, stat_order]))
+        return result
+
+    def summary(self, where=None):
+        """条件に該当するセル全体の統計量（行: 対象列, 列: 統計量）"""
+        return self.rollup((), where).iloc[0].unstack()
+
+
+def rollup_group_aggregates(cube, sketches, by='subject', where=None, median_cols=None):
+    """集計キューブと分位点スケッチから compute_group_aggregates と同じ形式の統計量を作成
+
+    件数・平均・標準偏差・最小・最大はキューブのセルを合算し、中央値はグループ内の
+    セルのスケッチ（GroupSketches）を合算して求める。グループの並びは値の昇順。
+    median_cols を指定すると、中央値はその列だけ求める（他の列は欠損）。
+    """
+    if by not in cube.dims:
+        return pd.DataFrame()
+    value_cols = get_aggregate_value_cols(pd.DataFrame(columns=cube.value_cols))
+    rolled = cube.rollup([by], where)
+    groups = list(rolled.index)
+    columns = {}
+    for col in value_cols:
+        if median_cols is None or col in median_cols:
+            medians = [sketches.sketch(col, {**(where or {}), by: [group]}).quantile(0.5) for group in groups]
+        else:
+            medians = [np.nan] * len(groups)
+        stats = {
+            'count': rolled[(col, 'n')].to_numpy(),
+            'mean': rolled[(col, 'mean')].to_numpy(),
+            'std': rolled[(col, 'std')].to_numpy(),
+            'min': rolled[(col, 'min')].to_numpy(),
+            'max': rolled[(col, 'max')].to_numpy(),
+            'median': np.asarray(medians, dtype=np.float64),
+        }
+        for stat in GROUP_STAT_FUNCS:
+            columns[(col, stat)] = stats[stat]
+    columns[('_size', 'size')] = rolled[('total_score', 'n')].to_numpy()
+    return pd.DataFrame(columns, index=pd.Index(groups, name=by))
@@ -0,0 +1,354 @@
+import numpy as np
+import pandas as pd
+
+from aggregation import compute_group_aggregates
+from irt import fit_irt
+from item_analysis import compute_item_analysis, compute_item_moments
+from resampling import DEFAULT_CONFIDENCE
+from scoring import (ABILITY_LABELS, ABILITY_PARAMS, DEFAULT_BLUEPRINT, DOMAIN_LABELS, DOMAIN_PARAMS, QUESTION_COLS,
+                     extract_item_block)
+from stats_utils import compute_correlation_matrix
+
+
+def add_mean_cis(stats, cis, keys, confidence=DEFAULT_CONFIDENCE):
+    """平均得点率の右に信頼区間の列を追加
+
+    cis は resampling.bootstrap_mean_cis の結果、keys は stats の行ごとの cis の行のキー。
+    """
+    position = stats.columns.get_loc('平均得点率(%)') + 1
+    stats.insert(position, f'{confidence:.0%}CI下限(%)', cis['low'].reindex(keys).to_numpy())
+    stats.insert(position + 1, f'{confidence:.0%}CI上限(%)', cis['high'].reindex(keys).to_numpy())
+    return stats
+
+
+def get_category_stats(df, labels, category_name, summary=None, cis=None):
+    """カテゴリ別の統計量を取得（summary があれば集計キューブの結果を使う）
+
+    cis に得点率の列ごとの信頼区間を渡すと、平均得点率の信頼区間の列を追加する。
+    """
+    stats = []
+    rate_cols = []
+    for category, label in labels.items():
+        score_col = f'{category}_score'
+        rate_col = f'{category}_rate'
+        if summary is not None:
+            if score_col in summary.index and rate_col in summary.index:
+                stats.append({
+                    category_name: label,
+                    '平均素点': summary.at[score_col, 'mean'],
+                    '平均得点率(%)': summary.at[rate_col, 'mean'],
+                    '標準偏差': summary.at[rate_col, 'std'],
+                    '最高得点率(%)': summary.at[rate_col, 'max'],
+                    '最低得点率(%)': summary.at[rate_col, 'min']
+                })
+                rate_cols.append(rate_col)
+        elif score_col in df.columns and rate_col in df.columns:
+            stats.append({
+                category_name: label,
+                '平均素点': df[score_col].mean(),
+                '平均得点率(%)': df[rate_col].mean(),
+                '標準偏差': df[rate_col].std(),
+                '最高得点率(%)': df[rate_col].max(),
+                '最低得点率(%)': df[rate_col].min()
+            })
+            rate_cols.append(rate_col)
+    stats = pd.DataFrame(stats)
+    if cis is not None and len(stats):
+        add_mean_cis(stats, cis, rate_cols)
+    return stats
+
+
+def get_ability_stats(df, summary=None, cis=None):
+    """能力別の統計量を取得
+    
+    summary には AggregateCube.summary() の結果を渡せる（省略時は df から計算）。
+    """
+    return get_category_stats(df, ABILITY_LABELS, '能力', summary, cis)
+
+
+def get_domain_stats(df, summary=None, cis=None):
+    """領域別の統計量を取得
+    
+    summary には AggregateCube.summary() の結果を渡せる（省略時は df から計算）。
+    """
+    return get_category_stats(df, DOMAIN_LABELS, '領域', summary, cis)
+
+
+def get_axis_stats(df, blueprint, axis, summary=None, cis=None):
+    """テスト設計の軸（能力・領域など）のカテゴリ別の統計量を取得"""
+    return get_category_stats(df, blueprint.labels(axis), blueprint.axes[axis], summary, cis)
+
+
+def get_subject_stats(df, aggregates=None, cis=None):
+    """教科別の統計量を取得
+    
+    aggregates には compute_group_aggregates(df) の結果を渡せる（省略時はその場で集計）。
+    cis に教科ごとの総合得点率の信頼区間（行は (教科, 'total_rate')）を渡すと、信頼区間の列を追加する。
+    """
+    if aggregates is None:
+        if 'subject' not in df.columns:
+            return pd.DataFrame()
+        aggregates = compute_group_aggregates(df, 'subject')
+    if ('total_rate', 'mean') not in aggregates.columns or ('total_score', 'mean') not in aggregates.columns:
+        return pd.DataFrame()
+    
+    stats = pd.DataFrame({
+        '教科': aggregates.index,
+        '受験者数': aggregates[('_size', 'size')].to_numpy(),
+        '平均素点': aggregates[('total_score', 'mean')].to_numpy(),
+        '平均得点率(%)': aggregates[('total_rate', 'mean')].to_numpy(),
+        '標準偏差': aggregates[('total_rate', 'std')].to_numpy(),
+        '最高得点率(%)': aggregates[('total_rate', 'max')].to_numpy(),
+        '最低得点率(%)': aggregates[('total_rate', 'min')].to_numpy(),
+        '中央値(%)': aggregates[('total_rate', 'median')].to_numpy()
+    })
+    if cis is not None:
+        add_mean_cis(stats, cis, [(subject, 'total_rate') for subject in aggregates.index])
+    return stats
+
+
+def _get_subject_category_stats(df, labels, category_name, aggregates):
+    """教科×カテゴリのクロス集計（縦持ち）"""
+    if aggregates is None:
+        if 'subject' not in df.columns:
+            return pd.DataFrame()
+        aggregates = compute_group_aggregates(df, 'subject')
+    
+    stats = []
+    for subject in aggregates.index:
+        for category, label in labels.items():
+            rate_col = f'{category}_rate'
+            if (rate_col, 'mean') in aggregates.columns:
+                stats.append({
+                    '教科': subject,
+                    category_name: label,
+                    '平均得点率(%)': aggregates.at[subject, (rate_col, 'mean')]
+                })
+    return pd.DataFrame(stats)
+
+
+def get_subject_axis_stats(df, blueprint, axis, aggregates=None):
+    """教科×テスト設計の軸のカテゴリのクロス集計"""
+    return _get_subject_category_stats(df, blueprint.labels(axis), blueprint.axes[axis], aggregates)
+
+
+def get_subject_ability_stats(df, aggregates=None):
+    """教科×能力のクロス集計"""
+    return _get_subject_category_stats(df, ABILITY_LABELS, '能力', aggregates)
+
+
+def get_subject_domain_stats(df, aggregates=None):
+    """教科×領域のクロス集計"""
+    return _get_subject_category_stats(df, DOMAIN_LABELS, '領域', aggregates)
+
+
+def get_question_correct_rate(df, param_dict, responses=None, points=None):
+    """小問別正答率を取得
+
+    responses（ResponseStore）を渡した場合は、ビット列から正答者数を数える。
+    points（{小問: 満点}）を渡すと、部分点のある小問の正答率は「得点の合計 ÷（受験者数×満点）」になる
+    （正答者数の列は得点の合計）。無回答は誤答と同じく0点として数え、無回答数の列に別に示す。
+    """
+    if responses is not None:
+        correct_counts = responses.item_correct_counts()
+        response_counts = responses.item_response_counts()
+    else:
+        correct_counts = None
+    points = points or {}
+    
+    rates = []
+    for category, questions in param_dict.items():
+        for q in questions:
+            max_points = points.get(q, 1)
+            if correct_counts is not None and q in correct_counts.index:
+                n_correct = correct_counts[q]
+                rates.append({
+                    '問題': q,
+                    'カテゴリ': category,
+                    '正答率(%)': n_correct / (responses.n_rows * max_points) * 100,
+                    '正答者数': n_correct,
+                    '受験者数': responses.n_rows,
+                    '無回答数': responses.n_rows - response_counts[q]
+                })
+            elif q in df.columns:
+                rates.append({
+                    '問題': q,
+                    'カテゴリ': category,
+                    '正答率(%)': df[q].fillna(0).mean() / max_points * 100,
+                    '正答者数': df[q].sum(),
+                    '受験者数': len(df),
+                    '無回答数': df[q].isna().sum()
+                })
+    return pd.DataFrame(rates)
+
+
+def _get_item_block(df, responses=None, param_dict=None):
+    """正誤の配列（行×小問）と小問の列名（responses がある場合はビット列を展開）
+
+    param_dict を渡した場合はそのカテゴリに含まれる小問、省略時は x1〜x32 の列を使う。
+    """
+    if responses is not None:
+        return responses.to_block(), responses.item_cols
+    if param_dict is None:
+        item_cols = [q for q in QUESTION_COLS if q in df.columns]
+    else:
+        item_cols = [q for q in dict.fromkeys(q for questions in param_dict.values() for q in questions)
+                     if q in df.columns]
+    return extract_item_block(df, item_cols), item_cols
+
+
+def get_correlation_matrix(df, columns):
+    """列間の相関行列（列の組ごとに欠損を含む行は除く、行・列は列名）"""
+    columns = [col for col in columns if col in df.columns]
+    corr = compute_correlation_matrix(df[columns].to_numpy(dtype=np.float64))
+    return pd.DataFrame(corr, index=columns, columns=columns)
+
+
+def get_item_correlation_matrix(df, responses=None, param_dict=None):
+    """小問間の相関行列（ファイ係数）
+
+    正誤の配列の共分散行列（compute_item_moments）から1回で求める。
+    """
+    block, item_cols = _get_item_block(df, responses, param_dict)
+    _, cov, _ = compute_item_moments(block)
+    sd = np.sqrt(np.diag(cov))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = np.clip(cov / np.outer(sd, sd), -1, 1)
+    return pd.DataFrame(corr, index=item_cols, columns=item_cols)
+
+
+def get_item_analysis(df, param_dict, responses=None, weights=None, points=None):
+    """小問の項目分析（通過率・修正済み点双列相関・識別指数・α係数）
+
+    responses（ResponseStore）を渡した場合は、ビット列を展開した得点の配列を使う。
+    weights（{カテゴリ: {小問: 重み}}、Blueprint.category_weights）を渡すと、カテゴリの合計点を
+    テスト設計の重み付きのカテゴリ得点とする（省略時は重み1）。
+    points（{小問: 満点}、Blueprint.max_points）を渡すと、通過率・識別指数を満点に対する割合にする。
+    戻り値は compute_item_analysis と同じ (小問別の表, カテゴリ別の表)。
+    """
+    block, item_cols = _get_item_block(df, responses, param_dict)
+    return compute_item_analysis(block, item_cols, param_dict, weights=weights, max_points=points)
+
+
+def get_irt_thetas(df, model='rasch', responses=None, init=None, param_dict=None):
+    """能力別・領域別の能力θ（項目反応理論のEAP推定値）
+
+    小問の内容は教科ごとに異なるため、教科×カテゴリごとに項目パラメータを推定する。
+    init に前回の項目パラメータの表を渡すと、その値から推定を始める。
+    param_dict にカテゴリごとの小問を渡すとそのカテゴリについて推定する（省略時は能力・領域）。
+    戻り値は (θの表（列: '{カテゴリ}_theta'、行: df と同じ）, 項目パラメータの表)。
+    """
+    if param_dict is None:
+        param_dict = {**ABILITY_PARAMS, **DOMAIN_PARAMS}
+    block, item_cols = _get_item_block(df, responses, param_dict)
+    groups = df['subject'] if 'subject' in df.columns else None
+    thetas, categories, item_params, _ = fit_irt(block, item_cols, param_dict, model, groups, init)
+    theta_df = pd.DataFrame(thetas, columns=[f'{category}_theta' for category in categories], index=df.index)
+    return theta_df, item_params
+
+
+def get_comparison_means(cube, where=None):
+    """個別診断の比較用の平均（行: '全教科' と各教科, 列: 得点・得点率の列）"""
+    overall = cube.rollup((), where).xs('mean', axis=1, level=1)
+    overall.index = ['全教科']
+    if 'subject' not in cube.dims:
+        return overall
+    by_subject = cube.rollup(['subject'], where).xs('mean', axis=1, level=1)
+    return pd.concat([overall, by_subject])
+
+
+def _get_rate_categories(columns, blueprint=DEFAULT_BLUEPRINT):
+    """得点率の列と区分・カテゴリ名の組（テスト設計の軸の順）"""
+    categories = []
+    for axis, kind in blueprint.axes.items():
+        for category, label in blueprint.labels(axis).items():
+            if f'{category}_rate' in columns:
+                categories.append((f'{category}_rate', kind, label))
+    return categories
+
+
+def get_category_comparison(student_data, comparison, labels):
+    """生徒の得点率と比較用平均のカテゴリ別の差（差の大きい順）
+
+    student_data・comparison は得点率の列を持つSeries。
+    """
+    rows = []
+    for category, label in labels.items():
+        rate_col = f'{category}_rate'
+        if rate_col in student_data.index and rate_col in comparison.index:
+            student_rate = student_data[rate_col]
+            class_avg = comparison[rate_col]
+            rows.append({
+                'カテゴリ': label,
+                '生徒得点率(%)': student_rate,
+                'クラス平均(%)': class_avg,
+                '差分': student_rate - class_avg
+            })
+    return pd.DataFrame(rows).sort_values('差分', ascending=False)
+
+
+def get_student_strengths(df, comparison_means, blueprint=DEFAULT_BLUEPRINT):
+    """全生徒の能力・領域別（テスト設計の軸のカテゴリ別）の得点率と比較用平均との差（縦持ち）
+
+    教科ごとの行は同じ教科の平均と、全教科（生徒ごとの教科平均）は全体の平均と比べる。
+    列は ID・教科・区分・カテゴリ・生徒得点率(%)・比較平均(%)・差分。
+    """
+    categories = _get_rate_categories(df.columns, blueprint)
+    rate_cols = [col for col, _, _ in categories]
+    if not rate_cols:
+        return pd.DataFrame()
+
+    groups = [('全教科', df[['ID'] + rate_cols].groupby('ID', sort=True).mean())]
+    if 'subject' in df.columns and df['subject'].nunique() > 1:
+        for subject, rows in df.groupby('subject', sort=True, observed=True):
+            if subject in comparison_means.index:
+                groups.append((subject, rows.set_index('ID')[rate_cols].sort_index()))
+
+    frames = []
+    for subject, rates in groups:
+        student = rates.to_numpy(dtype=np.float64)
+        means = comparison_means.loc[subject, rate_cols].to_numpy(dtype=np.float64)
+        n = len(rates)
+        frames.append(pd.DataFrame({
+            'ID': np.repeat(rates.index.to_numpy(), len(rate_cols)),
+            '教科': subject,
+            '区分': np.tile([kind for _, kind, _ in categories], n),
+            'カテゴリ': np.tile([label for _, _, label in categories], n),
+            '生徒得点率(%)': student.ravel(),
+            '比較平均(%)': np.tile(means, n),
+            '差分': (student - means).ravel(),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def get_category_profile(student_data, comparison, labels):
+    """レーダーチャート用のカテゴリ名・生徒の得点率・比較用平均の得点率のリスト"""
+    names = []
+    student_scores = []
+    comparison_scores = []
+    for category, label in labels.items():
+        rate_col = f'{category}_rate'
+        if rate_col in student_data.index:
+            names.append(label)
+            student_scores.append(student_data[rate_col])
+            comparison_scores.append(comparison[rate_col])
+    return names, student_scores, comparison_scores
+
+
+def get_subject_performance(student_rows, comparison_means):
+    """生徒の教科ごとの総合得点率と教科平均との差（差の大きい順）
+
+    student_rows は1人の生徒の行（教科ごと）。同じ教科の行が複数ある場合は先頭の行を使う。
+    """
+    rows = student_rows.drop_duplicates('subject').sort_values('subject')
+    rows = rows[rows['subject'].isin(comparison_means.index)]
+    subjects = rows['subject'].tolist()
+    student_rates = rows['total_rate'].to_numpy()
+    class_avgs = comparison_means.loc[subjects, 'total_rate'].to_numpy()
+    performance = pd.DataFrame({
+        '教科': subjects,
+        '生徒得点率(%)': student_rates,
+        'クラス平均(%)': class_avgs,
+        '差分': student_rates - class_avgs,
+    })
+    return performance.sort_values('差分', ascending=False)
@@ -0,0 +1,131 @@
+"""集計レポートの一括作成
+
+ディレクトリ内の成績ファイル（CSV・Parquet・Arrow IPC）をプロセスプールで並列に処理し、
+ファイルごとに能力別・領域別・教科別の統計量、小問別正答率、項目分析、生徒別の強み・弱みをCSVで書き出す。
+--blueprint でテスト設計ファイルを指定すると、その軸ごと（能力・領域の代わり）に集計する。
+
+    python batch_report.py data/ --output reports/ --workers 8
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from aggregation import AggregateCube
+from analysis import (get_axis_stats, get_comparison_means, get_item_analysis, get_question_correct_rate,
+                      get_student_strengths, get_subject_axis_stats, get_subject_stats)
+from blueprint import load_blueprint
+from ingest import read_score_file
+from scoring import DEFAULT_BLUEPRINT, calculate_scores
+
+# 既定で処理するファイル
+DEFAULT_PATTERNS = ['*.csv']
+# 書き出すCSVの文字コード（Excelで開けるようにBOM付き）
+REPORT_ENCODING = 'utf-8-sig'
+
+
+def build_reports(df, blueprint=DEFAULT_BLUEPRINT):
+    """得点計算済みのDataFrameから全レポートを作成（{レポート名: DataFrame}）
+
+    軸ごとのレポートの名前は軸名を含む（既定のテスト設計では ability_stats・domain_stats など）。
+    """
+    cube = AggregateCube.from_frame(df)
+    summary = cube.summary()
+    reports = {f'{axis}_stats': get_axis_stats(df, blueprint, axis, summary) for axis in blueprint.axes}
+    reports['subject_stats'] = get_subject_stats(df)
+    for axis in blueprint.axes:
+        reports[f'subject_{axis}_stats'] = get_subject_axis_stats(df, blueprint, axis)
+    for axis in blueprint.axes:
+        reports[f'question_correct_rate_{axis}'] = get_question_correct_rate(df, blueprint.param_dict(axis),
+                                                                             points=blueprint.max_points())
+    item_analyses = {axis: get_item_analysis(df, blueprint.param_dict(axis), weights=blueprint.category_weights(axis),
+                                             points=blueprint.max_points())
+                     for axis in blueprint.axes}
+    for axis, (item_analysis, _) in item_analyses.items():
+        reports[f'item_analysis_{axis}'] = item_analysis
+    for axis, (_, reliability) in item_analyses.items():
+        reports[f'reliability_{axis}'] = reliability
+    reports['student_strengths'] = get_student_strengths(df, get_comparison_means(cube), blueprint)
+    return reports
+
+
+def process_file(path, output_dir, blueprint=DEFAULT_BLUEPRINT):
+    """1ファイルを読み込み・採点し、レポートを output_dir/<ファイル名>/ に書き出す
+
+    戻り値は処理した行数。
+    """
+    path = Path(path)
+    df = calculate_scores(read_score_file(path.read_bytes(), blueprint.items), blueprint=blueprint)
+    report_dir = Path(output_dir) / path.stem
+    report_dir.mkdir(parents=True, exist_ok=True)
+    for name, report in build_reports(df, blueprint).items():
+        report.to_csv(report_dir / f'{name}.csv', index=False, encoding=REPORT_ENCODING)
+    return len(df)
+
+
+def find_input_files(input_dir, patterns=DEFAULT_PATTERNS):
+    """入力ディレクトリから対象ファイルを探す（名前順）"""
+    files = set()
+    for pattern in patterns:
+        files.update(Path(input_dir).glob(pattern))
+    return sorted(files)
+
+
+def run_batch(files, output_dir, workers, blueprint=DEFAULT_BLUEPRINT):
+    """ファイルを並列に処理し、(成功したファイル数, 合計行数, 失敗したファイルのリスト) を返す"""
+    n_done = 0
+    n_rows = 0
+    failed = []
+    if workers == 1:
+        # 1プロセスの場合はプールを作らずに順に処理
+        for path in files:
+            try:
+                n_rows += process_file(path, output_dir, blueprint)
+                n_done += 1
+            except Exception as e:
+                failed.append((path, e))
+        return n_done, n_rows, failed
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_file, path, output_dir, blueprint): path for path in files}
+        for future in as_completed(futures):
+            try:
+                n_rows += future.result()
+                n_done += 1
+            except Exception as e:
+                failed.append((futures[future], e))
+    return n_done, n_rows, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='成績ファイルの集計レポートを一括作成')
+    parser.add_argument('input_dir', help='成績ファイルのあるディレクトリ')
+    parser.add_argument('--output', default='reports', help='レポートの出力先（既定: reports）')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='並列に処理するプロセス数（既定: CPUコア数）')
+    parser.add_argument('--pattern', action='append',
+                        help='対象ファイルのパターン（複数指定可、既定: *.csv）')
+    parser.add_argument('--blueprint', help='テスト設計ファイル（YAML・JSON・CSV、既定: 能力・領域パラメータ）')
+    args = parser.parse_args(argv)
+
+    blueprint = load_blueprint(args.blueprint) if args.blueprint else DEFAULT_BLUEPRINT
+
+    files = find_input_files(args.input_dir, args.pattern or DEFAULT_PATTERNS)
+    if not files:
+        print(f'対象ファイルが見つかりません: {args.input_dir}')
+        return 1
+
+    start = time.perf_counter()
+    n_done, n_rows, failed = run_batch(files, args.output, max(args.workers, 1), blueprint)
+    elapsed = time.perf_counter() - start
+
+    for path, error in failed:
+        print(f'失敗: {path}: {error}')
+    print(f'{n_done}/{len(files)}ファイル・{n_rows:,}行を{elapsed:.2f}秒で処理 '
+          f'（{n_done / elapsed:.2f} ファイル/秒、{n_rows / elapsed:,.0f} 行/秒、{args.workers}プロセス）')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,100 @@
+"""fit_irt のベンチマーク
+
+既知の項目パラメータから教科ごとに解答データを生成し、推定値がそのパラメータを再現するかを確認する。
+推定誤差は行数の平方根に反比例して小さくなるため、許容値は ERROR_SCALES[モデル] / √行数 とし、
+すべての行数で確認する（1万〜60万行・乱数の種4通りで観測した誤差の最大値の約1.3倍）。
+前回の推定結果から始めた場合（ウォームスタート）の時間も計測する。
+
+    python -m benchmarks.bench_irt
+    python -m benchmarks.bench_irt --rows 10000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from irt import fit_irt
+from scoring import ABILITY_PARAMS, QUESTION_COLS
+
+SUBJECTS = ['国語', '数学', '英語']
+# 識別力・困難度の誤差の許容値の係数（許容値 = 係数 / √行数、60万行で Rasch 0.032・2PL 0.065）
+ERROR_SCALES = {
+    'rasch': 25.0,
+    '2pl': 50.0
+}
+
+
+def make_data(n_rows, model, seed=0):
+    """教科ごとに異なる項目パラメータで解答データを作成
+
+    戻り値は (正誤の配列（行×小問）, 行ごとの教科, 真の項目パラメータの表)。
+    """
+    rng = np.random.default_rng(seed)
+    subjects = rng.choice(SUBJECTS, n_rows)
+    theta = rng.normal(size=n_rows)
+    block = np.empty((n_rows, len(QUESTION_COLS)), dtype=np.int8)
+    param_rows = []
+    for subject in SUBJECTS:
+        rows = subjects == subject
+        if model == 'rasch':
+            slopes = np.full(len(QUESTION_COLS), rng.uniform(0.8, 1.5))
+        else:
+            slopes = rng.uniform(0.6, 2.0, len(QUESTION_COLS))
+        difficulty = rng.uniform(-1.5, 1.5, len(QUESTION_COLS))
+        p = 1 / (1 + np.exp(-slopes * (theta[rows, np.newaxis] - difficulty)))
+        block[rows] = rng.random(p.shape) < p
+        param_rows += [{'グループ': subject, '問題': q, '真の識別力': a, '真の困難度': b}
+                       for q, a, b in zip(QUESTION_COLS, slopes, difficulty)]
+    return block, subjects, pd.DataFrame(param_rows)
+
+
+def max_errors(item_params, truth):
+    """識別力・困難度の真の値との差の最大値"""
+    merged = item_params.merge(truth, on=['グループ', '問題'])
+    return (np.abs(merged['識別力'] - merged['真の識別力']).max(),
+            np.abs(merged['困難度'] - merged['真の困難度']).max())
+
+
+def check_partial_credit_rejected(block, subjects):
+    """部分点（0/1 以外）の小問を含むデータは推定せずに ValueError とすることを確認"""
+    partial = block.copy()
+    partial[:, 0] *= 3
+    try:
+        fit_irt(partial, QUESTION_COLS, ABILITY_PARAMS, groups=subjects)
+    except ValueError:
+        return
+    raise AssertionError('部分点の小問を含むデータで推定が行われました')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fit_irt のベンチマーク')
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 600_000])
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='識別力・困難度の誤差の許容値（ERROR_SCALES / √行数）に掛ける倍率')
+    args = parser.parse_args()
+
+    print(f"{'モデル':>6} {'行数':>10} {'初回(秒)':>10} {'反復':>6} {'再推定(秒)':>10} {'反復':>6}"
+          f" {'識別力の誤差':>12} {'困難度の誤差':>12} {'許容値':>8}")
+    for model in ('rasch', '2pl'):
+        for n_rows in args.rows:
+            block, subjects, truth = make_data(n_rows, model)
+            start = time.perf_counter()
+            _, _, item_params, cold_iter = fit_irt(block, QUESTION_COLS, ABILITY_PARAMS, model, subjects)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            _, _, _, warm_iter = fit_irt(block, QUESTION_COLS, ABILITY_PARAMS, model, subjects, item_params)
+            warm = time.perf_counter() - start
+
+            slope_error, difficulty_error = max_errors(item_params, truth)
+            tolerance = args.scale * ERROR_SCALES[model] / np.sqrt(n_rows)
+            print(f'{model:>6} {n_rows:>10,} {cold:>10.4f} {cold_iter:>6} {warm:>10.4f} {warm_iter:>6}'
+                  f' {slope_error:>12.4f} {difficulty_error:>12.4f} {tolerance:>8.4f}')
+            # 真の値を行数に応じた誤差の範囲で再現していることを確認
+            assert max(slope_error, difficulty_error) < tolerance, (model, n_rows, slope_error, difficulty_error)
+
+    check_partial_credit_rejected(*make_data(1000, 'rasch')[:2])
+
+
+if __name__ == '__main__':
+    main()
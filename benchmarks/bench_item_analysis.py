@@ -0,0 +1,158 @@
+"""compute_item_analysis のベンチマーク
+
+小問ごとに合計点・相関・上位下位群を求める素朴な実装と、共分散行列による実装を比較する。
+
+    python -m benchmarks.bench_item_analysis
+    python -m benchmarks.bench_item_analysis --rows 10000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from item_analysis import DEFAULT_GROUP_FRACTION, compute_item_analysis
+from scoring import ABILITY_PARAMS, DOMAIN_PARAMS, QUESTION_COLS
+
+PARAM_DICT = {**ABILITY_PARAMS, **DOMAIN_PARAMS}
+# 重み付きのカテゴリ得点の確認に使う重み（小問ごとに1〜3）
+WEIGHTS = {category: {q: 1 + i % 3 for i, q in enumerate(questions)} for category, questions in PARAM_DICT.items()}
+# 部分点の確認に使う満点（x1 を0〜3点の小問にする）
+PARTIAL_POINTS = {'x1': 3}
+
+
+def _group_mean(values, totals, fraction, upper):
+    """合計点の上位（下位）fraction の群の平均（境界の同点の行は端数の重みで数える）"""
+    group_size = len(totals) * fraction
+    k = min(max(int(np.ceil(group_size)), 1), len(totals))
+    ordered = np.sort(totals)
+    cut = ordered[len(totals) - k] if upper else ordered[k - 1]
+    beyond = totals > cut if upper else totals < cut
+    tied = totals == cut
+    weights = beyond + tied * (group_size - beyond.sum()) / tied.sum()
+    return (weights * values).sum() / group_size
+
+
+def _alpha(items):
+    """クロンバックのα係数"""
+    n_items = items.shape[1]
+    if n_items < 2:
+        return np.nan
+    return n_items / (n_items - 1) * (1 - items.var(ddof=0).sum() / items.sum(axis=1).var(ddof=0))
+
+
+def naive_item_analysis(df, param_dict, fraction=DEFAULT_GROUP_FRACTION, weights=None, points=None):
+    """素朴な実装（カテゴリ・小問ごとに合計点を作り直して計算）
+
+    重み付きの合計点のα係数は、小問の得点に重みを掛けた列のα係数として求める。
+    通過率・識別指数は小問の満点（points、省略時は1）で割る。
+    """
+    item_rows = []
+    category_rows = []
+    for category, questions in param_dict.items():
+        w = pd.Series((weights or {}).get(category, dict.fromkeys(questions, 1)), dtype=np.float64)[questions]
+        items = df[questions].astype(np.float64)
+        weighted = items * w
+        totals = weighted.sum(axis=1).to_numpy()
+        for q in questions:
+            values = items[q].to_numpy()
+            rest = totals - weighted[q].to_numpy()
+            max_points = (points or {}).get(q, 1)
+            item_rows.append({
+                '問題': q,
+                'カテゴリ': category,
+                '通過率': values.mean() / max_points,
+                '修正済み点双列相関': np.corrcoef(values, rest)[0, 1],
+                f'識別指数(上位-下位{fraction:.0%})': (_group_mean(values, totals, fraction, True)
+                                                   - _group_mean(values, totals, fraction, False)) / max_points,
+                '項目削除時のα': _alpha(weighted.drop(columns=q)) if len(questions) > 2 else np.nan,
+            })
+        category_rows.append({
+            'カテゴリ': category,
+            '問題数': len(questions),
+            '平均点': totals.mean(),
+            '標準偏差': totals.std(),
+            'α係数': _alpha(weighted),
+        })
+    return pd.DataFrame(item_rows), pd.DataFrame(category_rows)
+
+
+def matrix_item_analysis(df, param_dict, weights=None, points=None):
+    """共分散行列による実装"""
+    return compute_item_analysis(df[QUESTION_COLS].to_numpy(dtype=np.int8), QUESTION_COLS, param_dict,
+                                 weights=weights, max_points=points)
+
+
+def make_data(n_rows, seed=0):
+    """ベンチマーク用の解答データを作成（能力と困難度から正答確率を決める）"""
+    rng = np.random.default_rng(seed)
+    theta = rng.normal(size=(n_rows, 1))
+    difficulty = rng.normal(size=len(QUESTION_COLS))
+    p = 1 / (1 + np.exp(-(theta - difficulty)))
+    items = (rng.random(p.shape) < p).astype(np.int64)
+    return pd.DataFrame(items, columns=QUESTION_COLS)
+
+
+def make_partial_data(n_rows, seed=0):
+    """x1 を部分点（0〜PARTIAL_POINTS 点、能力が高いほど高い）の小問にした解答データを作成"""
+    df = make_data(n_rows, seed)
+    rng = np.random.default_rng(seed + 1)
+    p = 1 / (1 + np.exp(-(df[QUESTION_COLS].mean(axis=1) * 4 - 2)))
+    df['x1'] = rng.binomial(PARTIAL_POINTS['x1'], p)
+    return df
+
+
+def check_partial_credit(n_rows):
+    """満点1の指定で正誤の結果が変わらず、部分点の小問の通過率・識別指数が0〜1の割合になることを確認"""
+    df = make_data(n_rows)
+    assert_results_equal(matrix_item_analysis(df, PARAM_DICT, points=dict.fromkeys(QUESTION_COLS, 1)),
+                         matrix_item_analysis(df, PARAM_DICT))
+
+    df = make_partial_data(n_rows)
+    actual = matrix_item_analysis(df, PARAM_DICT, WEIGHTS, PARTIAL_POINTS)
+    assert_results_equal(actual, naive_item_analysis(df, PARAM_DICT, weights=WEIGHTS, points=PARTIAL_POINTS))
+    item_stats = actual[0]
+    discrimination = item_stats.filter(like='識別指数').iloc[:, 0]
+    assert item_stats['通過率'].between(0, 1).all(), item_stats['通過率'].max()
+    assert discrimination.between(-1, 1).all(), discrimination.abs().max()
+
+
+def assert_results_equal(actual, expected):
+    """小問別・カテゴリ別の表が一致することを確認（群の重みは float32 で掛けるため誤差 1e-5 まで許す）"""
+    for actual_df, expected_df in zip(actual, expected):
+        pd.testing.assert_frame_equal(actual_df, expected_df, check_dtype=False, rtol=1e-5, atol=1e-5)
+
+
+def best_time(func, df, repeat):
+    """repeat回実行した最短時間を返す"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(df, PARAM_DICT)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compute_item_analysis のベンチマーク')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'行数':>10} {'素朴(秒)':>10} {'行列積(秒)':>10} {'高速化':>8}")
+    for n_rows in args.rows:
+        df = make_data(n_rows)
+
+        # 出力が素朴な実装と一致することを確認
+        assert_results_equal(matrix_item_analysis(df, PARAM_DICT), naive_item_analysis(df, PARAM_DICT))
+        assert_results_equal(matrix_item_analysis(df, PARAM_DICT, WEIGHTS),
+                             naive_item_analysis(df, PARAM_DICT, weights=WEIGHTS))
+        check_partial_credit(n_rows)
+
+        naive = best_time(naive_item_analysis, df, args.repeat)
+        matrix = best_time(matrix_item_analysis, df, args.repeat)
+        print(f'{n_rows:>10,} {naive:>10.4f} {matrix:>10.4f} {naive / matrix:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
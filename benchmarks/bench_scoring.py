@@ -0,0 +1,78 @@
+"""calculate_scores のベンチマーク
+
+従来の列ごとのループ実装と、対応行列による行列積の実装を比較する。
+
+    python -m benchmarks.bench_scoring
+    python -m benchmarks.bench_scoring --rows 10000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from scoring import ABILITY_PARAMS, DOMAIN_PARAMS, QUESTION_COLS, calculate_scores
+
+
+def legacy_calculate_scores(df):
+    """従来実装（カテゴリごとに列を合計）"""
+    for param_dict in (ABILITY_PARAMS, DOMAIN_PARAMS):
+        for category, questions in param_dict.items():
+            available_questions = [q for q in questions if q in df.columns]
+            if available_questions:
+                df[f'{category}_score'] = df[available_questions].sum(axis=1)
+                df[f'{category}_rate'] = (df[f'{category}_score'] / len(available_questions) * 100).round(1)
+
+    available_all = [q for q in QUESTION_COLS if q in df.columns]
+    if available_all:
+        df['total_score'] = df[available_all].sum(axis=1)
+        df['total_rate'] = (df['total_score'] / len(available_all) * 100).round(1)
+    return df
+
+
+def make_data(n_rows, seed=0):
+    """ベンチマーク用のランダムな解答データを作成"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'ID': np.arange(n_rows),
+        'grade': rng.integers(1, 4, n_rows),
+        'class': rng.choice(['A', 'B', 'C', 'D'], n_rows),
+        'subject': rng.choice(['国語', '数学', '英語'], n_rows),
+    })
+    items = (rng.random((n_rows, len(QUESTION_COLS))) < 0.6).astype(np.int64)
+    return pd.concat([df, pd.DataFrame(items, columns=QUESTION_COLS)], axis=1)
+
+
+def best_time(func, df, repeat):
+    """repeat回実行した最短時間を返す"""
+    times = []
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        func(data)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='calculate_scores のベンチマーク')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'行数':>10} {'従来(秒)':>10} {'行列積(秒)':>10} {'高速化':>8}")
+    for n_rows in args.rows:
+        df = make_data(n_rows)
+
+        # 出力が従来実装と一致することを確認
+        expected = legacy_calculate_scores(df.copy())
+        actual = calculate_scores(df.copy())
+        pd.testing.assert_frame_equal(actual, expected)
+
+        legacy = best_time(legacy_calculate_scores, df, args.repeat)
+        matrix = best_time(calculate_scores, df, args.repeat)
+        print(f'{n_rows:>10,} {legacy:>10.4f} {matrix:>10.4f} {legacy / matrix:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+import csv
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# 小問の満点の既定値（正誤の小問）
+DEFAULT_POINTS = 1
+# 総合得点での小問の重みの既定値
+DEFAULT_ITEM_WEIGHT = 1
+# 総合得点のカテゴリ名（テスト設計のカテゴリ名には使えない）
+TOTAL_CATEGORY = 'total'
+# ファイルの拡張子と形式
+BLUEPRINT_FORMATS = {
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.json': 'json',
+    '.csv': 'csv'
+}
+
+
+class Blueprint:
+    """テスト設計（小問・カテゴリの軸・配点）
+
+    小問ごとの満点・総合得点での重みと、(小問, カテゴリ, 重み) の組を並べた疎な対応表（COO形式）を持つ。
+    カテゴリの得点は「重み×小問の得点」の合計、満点は「重み×小問の満点」の合計（総合も同様）。
+    カテゴリは軸（能力・領域・学習指導要領の項目など）に属し、カテゴリ名は軸をまたいで重複しない。
+    1つの小問を同じ軸・別の軸の複数のカテゴリに対応させられる。
+    """
+
+    def __init__(self, items, axes, entries, points=None, weights=None):
+        """items は小問の列名のリスト、axes は {軸: (軸の表示名, {カテゴリ: 表示名})}、
+        entries は (小問, カテゴリ, 重み) の組の並び、points は {小問: 満点}、weights は {小問: 総合得点での重み}"""
+        self.items = [str(q) for q in items]
+        if len(set(self.items)) != len(self.items):
+            raise ValueError('テスト設計の小問の列名が重複しています')
+
+        self.axes = {}
+        self.category_labels = {}
+        self.category_axis = {}
+        for axis, (axis_label, categories) in axes.items():
+            self.axes[axis] = axis_label
+            for category, label in categories.items():
+                if category == TOTAL_CATEGORY or category in self.category_axis:
+                    raise ValueError(f'カテゴリ名 {category} は使えません（予約語または他の軸と重複）')
+                self.category_labels[category] = label
+                self.category_axis[category] = axis
+        self.categories = list(self.category_labels)
+
+        item_pos = {q: i for i, q in enumerate(self.items)}
+        category_pos = {category: j for j, category in enumerate(self.categories)}
+        # (小問, カテゴリ) の組ごとの重み（小問側と軸側の両方に書かれた同じ対応は1つにまとめる）
+        pairs = {}
+        for item, category, weight in entries:
+            if item not in item_pos:
+                raise ValueError(f'小問 {item} がテスト設計の小問の一覧にありません')
+            if category not in category_pos:
+                raise ValueError(f'カテゴリ {category} がテスト設計の軸に定義されていません')
+            key = (item_pos[item], category_pos[category])
+            weight = float(weight)
+            if pairs.setdefault(key, weight) != weight:
+                raise ValueError(f'小問 {item} とカテゴリ {category} の対応に異なる重みが指定されています')
+        self.entry_items = np.array([i for i, _ in pairs], dtype=np.int64)
+        self.entry_categories = np.array([j for _, j in pairs], dtype=np.int64)
+        self.entry_weights = np.array(list(pairs.values()), dtype=np.float64)
+
+        points = points or {}
+        self.points = np.array([float(points.get(q, DEFAULT_POINTS)) for q in self.items])
+        if (self.points <= 0).any():
+            raise ValueError('小問の満点は正の値にしてください')
+        weights = weights or {}
+        self.weights = np.array([float(weights.get(q, DEFAULT_ITEM_WEIGHT)) for q in self.items])
+        if (self.weights < 0).any():
+            raise ValueError('小問の重みは0以上の値にしてください')
+
+    @classmethod
+    def from_params(cls, items, axes):
+        """{軸: (軸の表示名, {カテゴリ: 小問のリスト}, {カテゴリ: 表示名})} から作成（重み・満点はすべて1）"""
+        axis_specs = {}
+        entries = []
+        for axis, (axis_label, param_dict, labels) in axes.items():
+            axis_specs[axis] = (axis_label, {category: labels.get(category, category) for category in param_dict})
+            for category, questions in param_dict.items():
+                entries += [(q, category, 1) for q in questions]
+        return cls(items, axis_specs, entries)
+
+    @property
+    def n_items(self):
+        return len(self.items)
+
+    def labels(self, axis):
+        """軸のカテゴリと表示名の辞書"""
+        return {category: label for category, label in self.category_labels.items()
+                if self.category_axis[category] == axis}
+
+    def param_dict(self, axis=None):
+        """カテゴリごとの小問のリスト（axis を省略した場合は全軸のカテゴリ）"""
+        members = {category: [] for category in self.categories
+                   if axis is None or self.category_axis[category] == axis}
+        for i, j in sorted(zip(self.entry_items.tolist(), self.entry_categories.tolist())):
+            category = self.categories[j]
+            if category in members and self.items[i] not in members[category]:
+                members[category].append(self.items[i])
+        return members
+
+    def category_weights(self, axis=None):
+        """カテゴリごとの {小問: 重み}（axis を省略した場合は全軸のカテゴリ、並びは param_dict と同じ）"""
+        weights = {category: {} for category in self.categories
+                   if axis is None or self.category_axis[category] == axis}
+        for i, j, weight in sorted(zip(self.entry_items.tolist(), self.entry_categories.tolist(),
+                                       self.entry_weights.tolist())):
+            category = self.categories[j]
+            if category in weights:
+                weights[category][self.items[i]] = weight
+        return weights
+
+    def max_points(self):
+        """小問ごとの満点の辞書"""
+        return dict(zip(self.items, self.points.tolist()))
+
+    def compile(self, columns):
+        """データの列に含まれる小問について、問題×カテゴリの対応行列を作成
+
+        疎な対応表を密な行列に展開する（行列積はBLASで行うため。小問が数百・カテゴリが数十でも
+        行列そのものは小さい）。戻り値は (使用する問題列, カテゴリ名, 対応行列, カテゴリごとの満点)。
+        カテゴリはテスト設計の順に総合（'total'、全小問の「重み×得点」の合計）を加えたもので、
+        データに問題が1つもないカテゴリは含めない。重み・満点がすべて整数なら行列は int8、満点は int64。
+        """
+        column_set = set(columns)
+        available = np.array([q in column_set for q in self.items], dtype=bool)
+        item_cols = [q for q, flag in zip(self.items, available) if flag]
+        positions = np.cumsum(available) - 1
+
+        keep = available[self.entry_items] & (self.entry_weights != 0)
+        weights = np.zeros((len(item_cols), len(self.categories)))
+        np.add.at(weights, (positions[self.entry_items[keep]], self.entry_categories[keep]),
+                  self.entry_weights[keep])
+        used = np.flatnonzero((weights != 0).any(axis=0))
+        categories = [self.categories[j] for j in used]
+        matrix = weights[:, used]
+        if item_cols:
+            categories.append(TOTAL_CATEGORY)
+            matrix = np.column_stack([matrix, self.weights[available]])
+
+        points = self.points[available]
+        max_points = points @ matrix if item_cols else np.zeros(0)
+        if np.array_equal(matrix, np.round(matrix)) and (matrix.size == 0 or np.abs(matrix).max() <= 127):
+            matrix = matrix.astype(np.int8)
+            if np.array_equal(points, np.round(points)):
+                max_points = np.round(max_points).astype(np.int64)
+        return item_cols, categories, matrix, max_points
+
+    def to_frame(self):
+        """対応表（小問・軸・カテゴリ・重み・満点・小問の重みの縦持ち）"""
+        return pd.DataFrame({
+            '問題': [self.items[i] for i in self.entry_items],
+            '軸': [self.axes[self.category_axis[self.categories[j]]] for j in self.entry_categories],
+            'カテゴリ': [self.category_labels[self.categories[j]] for j in self.entry_categories],
+            '重み': self.entry_weights,
+            '満点': self.points[self.entry_items],
+            '小問の重み': self.weights[self.entry_items],
+        })
+
+
+def _category_entries(category, value):
+    """軸のカテゴリの定義（表示名または {label, items}）から表示名と (小問, 重み) の組を取り出す"""
+    if not isinstance(value, dict):
+        return str(value) if value is not None else category, []
+    items = value.get('items') or []
+    if isinstance(items, dict):
+        pairs = list(items.items())
+    else:
+        pairs = [(q, 1) for q in items]
+    return str(value.get('label', category)), pairs
+
+
+def _item_pairs(value):
+    """小問の定義の categories の値（カテゴリ名・リスト・{カテゴリ: 重み}）を (カテゴリ, 重み) の組にする"""
+    if isinstance(value, dict):
+        return list(value.items())
+    if isinstance(value, (list, tuple)):
+        return [(category, 1) for category in value]
+    return [(value, 1)]
+
+
+def blueprint_from_dict(spec):
+    """辞書（JSON・YAMLの内容）からテスト設計を作成
+
+    {'axes': {軸: {'label': 表示名, 'categories': {カテゴリ: 表示名 または {'label', 'items'}}}},
+     'items': [{'id': 列名, 'points': 満点, 'weight': 総合得点での重み,
+                'categories': {軸: カテゴリ・リスト・{カテゴリ: 重み}}}]}
+    の形式。小問とカテゴリの対応は、小問側（items の categories）と軸側（categories の items）の
+    どちらに書いてもよい（両方に書いた同じ対応は1つとみなし、重みが異なる場合はエラー）。
+    items の要素は列名の文字列だけでもよい。
+    """
+    if not isinstance(spec, dict):
+        raise ValueError('テスト設計の形式が正しくありません')
+    axes = {}
+    entries = []
+    for axis, axis_spec in (spec.get('axes') or {}).items():
+        if isinstance(axis_spec, dict):
+            axis_label = str(axis_spec.get('label', axis))
+            categories = axis_spec.get('categories') or {}
+        else:
+            axis_label = str(axis)
+            categories = axis_spec or []
+        if isinstance(categories, (list, tuple)):
+            categories = {category: category for category in categories}
+        labels = {}
+        for category, value in categories.items():
+            category = str(category)
+            labels[category], pairs = _category_entries(category, value)
+            entries += [(str(q), category, weight) for q, weight in pairs]
+        axes[str(axis)] = (axis_label, labels)
+
+    items = []
+    points = {}
+    weights = {}
+    for item_spec in spec.get('items') or []:
+        if not isinstance(item_spec, dict):
+            item_spec = {'id': item_spec}
+        if 'id' not in item_spec:
+            raise ValueError('テスト設計の小問に id がありません')
+        item = str(item_spec['id'])
+        items.append(item)
+        if item_spec.get('points') is not None:
+            points[item] = float(item_spec['points'])
+        if item_spec.get('weight') is not None:
+            weights[item] = float(item_spec['weight'])
+        for axis, value in (item_spec.get('categories') or {}).items():
+            _, labels = axes.setdefault(str(axis), (str(axis), {}))
+            for category, weight in _item_pairs(value):
+                category = str(category)
+                labels.setdefault(category, category)
+                entries.append((item, category, weight))
+
+    if not items:
+        # 小問の一覧がない場合は軸側の対応に現れる順
+        items = list(dict.fromkeys(q for q, _, _ in entries))
+    if not items:
+        raise ValueError('テスト設計に小問（items）がありません')
+    return Blueprint(items, axes, entries, points, weights)
+
+
+def blueprint_from_csv(text):
+    """縦持ちのCSV（1行が小問とカテゴリの1つの対応）からテスト設計を作成
+
+    列は item, axis, category（必須）と weight, points, item_weight, axis_label, category_label（任意）。
+    weight はカテゴリでの重み、item_weight は総合得点での小問の重み。
+    小問は最初に現れた順に並べる。axis・category が空の行は総合得点だけに含める小問。
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    missing = {'item', 'axis', 'category'} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f'テスト設計のCSVに列がありません: {", ".join(sorted(missing))}')
+
+    items = []
+    points = {}
+    weights = {}
+    axes = {}
+    entries = []
+    for row in reader:
+        item = (row.get('item') or '').strip()
+        if not item:
+            continue
+        if item not in points:
+            items.append(item)
+            points[item] = DEFAULT_POINTS
+        if (row.get('points') or '').strip():
+            points[item] = float(row['points'])
+        if (row.get('item_weight') or '').strip():
+            weights[item] = float(row['item_weight'])
+        axis = (row.get('axis') or '').strip()
+        category = (row.get('category') or '').strip()
+        if not axis or not category:
+            continue
+        axis_label, labels = axes.setdefault(axis, [(row.get('axis_label') or '').strip() or axis, {}])
+        labels.setdefault(category, (row.get('category_label') or '').strip() or category)
+        weight = (row.get('weight') or '').strip()
+        entries.append((item, category, float(weight) if weight else 1.0))
+    if not items:
+        raise ValueError('テスト設計に小問（items）がありません')
+    return Blueprint(items, {axis: tuple(spec) for axis, spec in axes.items()}, entries, points, weights)
+
+
+def load_blueprint(source, file_name=None):
+    """ファイル（パス・バイト列）からテスト設計を読み込む
+
+    形式は file_name（省略時はパス）の拡張子で判定する（.yaml・.yml・.json・.csv）。
+    YAMLの読み込みには PyYAML が必要。
+    """
+    if isinstance(source, (str, os.PathLike)):
+        file_name = file_name or os.fspath(source)
+        with open(source, 'rb') as f:
+            source = f.read()
+    file_format = BLUEPRINT_FORMATS.get(os.path.splitext(file_name or '')[1].lower())
+    if file_format is None:
+        raise ValueError('テスト設計はYAML・JSON・CSVファイルで指定してください')
+
+    text = bytes(source).decode('utf-8-sig')
+    if file_format == 'csv':
+        return blueprint_from_csv(text)
+    if file_format == 'json':
+        return blueprint_from_dict(json.loads(text))
+    try:
+        import yaml
+    except ImportError:
+        raise ValueError('YAML形式のテスト設計の読み込みには PyYAML が必要です（pip install pyyaml）')
+    return blueprint_from_dict(yaml.safe_load(text))
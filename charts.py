@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+# 散布図で点を描く最大件数（超える場合は2次元の度数分布で描画）
+SCATTER_POINT_LIMIT = 20000
+# 度数分布で描く場合の各軸の階級数
+SCATTER_DENSITY_BINS = 50
+# ヒートマップの横方向に並べる最大列数（超える場合は隣接する生徒を平均してまとめる）
+HEATMAP_MAX_COLUMNS = 300
+# 類似度順の並べ替えに使うクラスタ数
+HEATMAP_CLUSTERS = 8
+
+
+def _category_colors(labels):
+    """カテゴリごとの色（plotly express の既定の配色）"""
+    palette = px.colors.qualitative.Plotly
+    return {label: palette[i % len(palette)] for i, label in enumerate(labels)}
+
+
+def make_summary_box_figure(summaries, category_name, value_name, title):
+    """要約統計量（{カテゴリ名: summarize_distribution の結果}）から箱ひげ図を作成"""
+    colors = _category_colors(summaries.keys())
+    fig = go.Figure()
+    for label, summary in summaries.items():
+        if summary['n'] == 0:
+            continue
+        fig.add_trace(go.Box(
+            x=[label],
+            q1=[summary['q1']],
+            median=[summary['median']],
+            q3=[summary['q3']],
+            lowerfence=[summary['lowerfence']],
+            upperfence=[summary['upperfence']],
+            mean=[summary['mean']],
+            name=str(label),
+            legendgroup=str(label),
+            marker_color=colors[label],
+            boxpoints=False
+        ))
+        if len(summary['outliers']):
+            fig.add_trace(go.Scatter(
+                x=[label] * len(summary['outliers']),
+                y=summary['outliers'],
+                mode='markers',
+                name=str(label),
+                legendgroup=str(label),
+                showlegend=False,
+                marker=dict(color=colors[label], size=4),
+                hovertemplate=f'{category_name}=%{{x}}<br>{value_name}=%{{y}}<extra></extra>'
+            ))
+    fig.update_layout(
+        title=title,
+        xaxis_title=category_name,
+        yaxis_title=value_name,
+        legend_title_text=category_name
+    )
+    return fig
+
+
+def make_summary_histogram_figure(summaries, category_name, value_name, title, opacity=0.7):
+    """要約統計量の度数から重ね合わせのヒストグラムを作成"""
+    colors = _category_colors(summaries.keys())
+    fig = go.Figure()
+    for label, summary in summaries.items():
+        edges = summary['hist_edges']
+        fig.add_trace(go.Bar(
+            x=(edges[:-1] + edges[1:]) / 2,
+            y=summary['hist_counts'],
+            width=np.diff(edges),
+            name=str(label),
+            marker_color=colors[label],
+            opacity=opacity,
+            hovertemplate=f'{category_name}={label}<br>{value_name}=%{{x}}<br>人数=%{{y}}<extra></extra>'
+        ))
+    fig.update_layout(
+        title=title,
+        barmode='overlay',
+        bargap=0,
+        xaxis_title=value_name,
+        yaxis_title='count',
+        legend_title_text=category_name
+    )
+    return fig
+
+
+def make_profile_radar_figure(labels, student_scores, comparison_scores, student_name, comparison_name,
+                              color, title=None):
+    """生徒と比較用平均の得点率のレーダーチャートを作成"""
+    fig = go.Figure()
+    fig.add_trace(go.Scatterpolar(
+        r=list(student_scores),
+        theta=list(labels),
+        fill='toself',
+        name=student_name,
+        line=dict(color=color)
+    ))
+    fig.add_trace(go.Scatterpolar(
+        r=list(comparison_scores),
+        theta=list(labels),
+        fill='toself',
+        name=comparison_name,
+        line=dict(color='red', dash='dash')
+    ))
+    fig.update_layout(
+        polar=dict(radialaxis=dict(visible=True, range=[0, 100])),
+        showlegend=True
+    )
+    if title is not None:
+        fig.update_layout(title=title)
+    return fig
+
+
+def make_large_scatter_figure(x, y, x_label, y_label, title, ids=None, fit=None,
+                              point_limit=SCATTER_POINT_LIMIT, density_bins=SCATTER_DENSITY_BINS):
+    """件数に応じて描画方法を切り替える散布図
+
+    point_limit 以下はWebGL（Scattergl）で点を描き、超える場合はサーバー側で
+    2次元の度数分布に集計してヒートマップで描く。fit（fit_line の結果）があれば回帰直線を重ねる。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = ~(np.isnan(x) | np.isnan(y))
+
+    fig = go.Figure()
+    if valid.sum() <= point_limit:
+        hovertemplate = f'{x_label}=%{{x:.1f}}<br>{y_label}=%{{y:.1f}}'
+        customdata = None
+        if ids is not None:
+            customdata = np.asarray(ids)[valid]
+            hovertemplate = 'ID=%{customdata}<br>' + hovertemplate
+        fig.add_trace(go.Scattergl(
+            x=x[valid],
+            y=y[valid],
+            mode='markers',
+            customdata=customdata,
+            hovertemplate=hovertemplate + '<extra></extra>',
+            name='生徒',
+            showlegend=False
+        ))
+    else:
+        counts, x_edges, y_edges = np.histogram2d(x[valid], y[valid], bins=density_bins)
+        z = counts.T.astype(np.float64)
+        z[z == 0] = np.nan
+        fig.add_trace(go.Heatmap(
+            x=(x_edges[:-1] + x_edges[1:]) / 2,
+            y=(y_edges[:-1] + y_edges[1:]) / 2,
+            z=z,
+            colorscale='Blues',
+            colorbar=dict(title='人数'),
+            hovertemplate=f'{x_label}=%{{x:.1f}}<br>{y_label}=%{{y:.1f}}<br>人数=%{{z}}<extra></extra>',
+            name='人数'
+        ))
+
+    if fit is not None and not np.isnan(fit['slope']):
+        line_x = np.array([fit['x_min'], fit['x_max']])
+        fig.add_trace(go.Scatter(
+            x=line_x,
+            y=fit['intercept'] + fit['slope'] * line_x,
+            mode='lines',
+            name='回帰直線',
+            line=dict(color='#ff7f0e', width=2),
+            hovertemplate=(f"y = {fit['slope']:.3f}x + {fit['intercept']:.2f}"
+                           f"<br>R² = {fit['r'] ** 2:.3f}<extra></extra>"),
+            showlegend=False
+        ))
+
+    fig.update_layout(title=title, xaxis_title=x_label, yaxis_title=y_label)
+    return fig
+
+
+def compute_student_profiles(df, rate_cols):
+    """生徒ごとの得点率プロファイル（重複IDは平均）"""
+    return df[['ID'] + list(rate_cols)].groupby('ID', sort=True).mean()
+
+
+def _squared_distances(values, centers):
+    """各行と各重心の二乗距離（|x - c|^2 = |x|^2 - 2x・c + |c|^2 を行列積で計算）"""
+    row_norms = (values ** 2).sum(axis=1)
+    return np.maximum(row_norms[:, np.newaxis] - 2 * values @ centers.T + (centers ** 2).sum(axis=1), 0)
+
+
+def compute_similarity_order(values, n_clusters=HEATMAP_CLUSTERS, n_iter=20, sample_size=50000, seed=0):
+    """得点率プロファイルが似ている行が隣り合う並び順
+
+    k-means でクラスタに分け、クラスタは重心の平均得点率の高い順、
+    クラスタ内は各行の平均得点率の高い順に並べる。
+    重心は最大 sample_size 行の無作為抽出で求め、全行はその重心に割り当てる。
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0.0)
+    n = len(values)
+    if n == 0:
+        return np.arange(0)
+    k = min(n_clusters, n)
+    rng = np.random.default_rng(seed)
+    sample = values[rng.choice(n, sample_size, replace=False)] if n > sample_size else values
+
+    # k-means++ で初期重心を選ぶ
+    centroids = sample[[rng.integers(len(sample))]]
+    for _ in range(1, k):
+        dist = _squared_distances(sample, centroids).min(axis=1)
+        total = dist.sum()
+        chosen = rng.choice(len(sample), p=dist / total) if total > 0 else rng.integers(len(sample))
+        centroids = np.vstack([centroids, sample[chosen]])
+
+    for _ in range(n_iter):
+        labels = _squared_distances(sample, centroids).argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.column_stack([np.bincount(labels, weights=sample[:, j], minlength=k)
+                                for j in range(sample.shape[1])])
+        updated = np.where(counts[:, np.newaxis] > 0, sums / np.maximum(counts, 1)[:, np.newaxis], centroids)
+        if np.allclose(updated, centroids):
+            break
+        centroids = updated
+    labels = _squared_distances(values, centroids).argmin(axis=1)
+
+    cluster_rank = np.argsort(np.argsort(-centroids.mean(axis=1)))
+    return np.lexsort((-values.mean(axis=1), cluster_rank[labels]))
+
+
+def downsample_rows(frame, max_rows=HEATMAP_MAX_COLUMNS):
+    """行数が max_rows を超える場合、隣接する行を平均して max_rows 以下にまとめる
+
+    まとめた行のラベルは「先頭〜末尾」になる。
+    """
+    n = len(frame)
+    if n <= max_rows:
+        return frame
+    bucket = int(np.ceil(n / max_rows))
+    starts = np.arange(0, n, bucket)
+    values = frame.to_numpy(dtype=np.float64)
+    sums = np.add.reduceat(np.nan_to_num(values), starts, axis=0)
+    counts = np.add.reduceat((~np.isnan(values)).astype(np.int64), starts, axis=0)
+    with np.errstate(invalid='ignore'):
+        means = sums / counts
+    ends = np.minimum(starts + bucket, n) - 1
+    labels = [f'{frame.index[a]}〜{frame.index[b]}' for a, b in zip(starts, ends)]
+    return pd.DataFrame(means, index=pd.Index(labels, name=frame.index.name), columns=frame.columns)
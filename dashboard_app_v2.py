@@ -1,8 +1,32 @@
+import hashlib
+import os
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
-import plotly.graph_objects as go
+
+from aggregation import (CUBE_DIMS, AggregateCube, get_aggregate_value_cols, get_group_category_means,
+                         rollup_group_aggregates)
+from analysis import (get_axis_stats, get_category_comparison, get_category_profile, get_category_stats,
+                      get_comparison_means, get_correlation_matrix, get_irt_thetas, get_item_analysis,
+                      get_item_correlation_matrix, get_question_correct_rate, get_subject_performance,
+                      get_subject_stats)
+from blueprint import BLUEPRINT_FORMATS, TOTAL_CATEGORY, load_blueprint
+from charts import (compute_similarity_order, compute_student_profiles, downsample_rows, make_large_scatter_figure,
+                    make_profile_radar_figure, make_summary_box_figure, make_summary_histogram_figure)
+from filters import FilterIndex, make_filter_key
+from ingest import read_score_file
+from irt import IRT_MODELS, QUADRATURE_RANGE
+from resampling import DEFAULT_CONFIDENCE, DEFAULT_REPLICATES, bootstrap_correlation_ci, bootstrap_mean_cis
+from response_store import pack_responses, unpack_responses
+from scoring import ABILITY_LABELS, DEFAULT_BLUEPRINT, DOMAIN_LABELS, DOMAIN_PARAMS, calculate_scores
+from session_store import SessionStore
+from sketches import GroupSketches
+from sql_backend import SqlBackend
+from stats_utils import fit_line, summarize_distribution, summarize_sketch
+from streaming import StreamingAggregates
+from student_index import StudentIndex
 
 # ページ設定
 st.set_page_config(
@@ -11,933 +35,1595 @@ st.set_page_config(
     layout="wide"
 )
 
-# 問題パラメータの定義
-DOMAIN_PARAMS = {
-    'domain_1': ['x1', 'x2', 'x3', 'x4', 'x5', 'x6', 'x7', 'x8'],
-    'domain_2': ['x9', 'x10', 'x11', 'x12', 'x13', 'x14', 'x15', 'x16'],
-    'domain_3': ['x17', 'x18', 'x19', 'x20', 'x21', 'x22', 'x23', 'x24'],
-    'domain_4': ['x25', 'x26', 'x27', 'x28', 'x29', 'x30', 'x31', 'x32']
-}
+# 取り込みキャッシュの設定
+# メモリ上に保持する計算済みデータの最大件数（全セッション共有・LRU）
+INGEST_CACHE_MAX_ENTRIES = 8
+# 計算済みデータをディスクに保存するディレクトリ（未設定の場合は保存しない）
+SCORE_STORE_DIR = os.environ.get('DASHBOARD_SCORE_STORE_DIR', '')
+# 絞り込み条件ごとに保持する絞り込み結果・集計結果の最大件数（LRU）
+FILTER_CACHE_MAX_ENTRIES = 32
+# 経年データ（試験回ごとの採点結果）を蓄積するSQLiteファイル（未設定の場合は経年データを使わない）
+SESSION_STORE_PATH = os.environ.get('DASHBOARD_SESSION_STORE', '')
+# 集計に使う埋め込みデータベース（SQLite）のファイル（未設定の場合はデータベース集計を使わない）
+SQL_DATABASE_PATH = os.environ.get('DASHBOARD_SQL_DATABASE', '')
 
-ABILITY_PARAMS = {
-    'ability_a': ['x1', 'x2', 'x9', 'x10', 'x17', 'x18', 'x25', 'x26'],
-    'ability_b': ['x3', 'x4', 'x11', 'x12', 'x19', 'x20', 'x27', 'x28'],
-    'ability_c': ['x5', 'x6', 'x13', 'x14', 'x21', 'x22', 'x29', 'x30'],
-    'ability_d': ['x7', 'x8', 'x15', 'x16', 'x23', 'x24', 'x31', 'x32']
-}
+# 生徒別ヒートマップの1ページあたりの人数の選択肢
+HEATMAP_PAGE_SIZES = [50, 100, 200, 500, '全員']
 
-# 日本語表示用のマッピング
-DOMAIN_LABELS = {
-    'domain_1': '領域1',
-    'domain_2': '領域2',
-    'domain_3': '領域3',
-    'domain_4': '領域4'
-}
+# 信頼区間のブートストラップの反復回数の選択肢
+CI_REPLICATE_OPTIONS = [200, 500, 1000, 2000, 5000]
+
+# 相関行列のヒートマップで選べる組み合わせ（テスト設計の軸の組み合わせの後に並べる）
+CORRELATION_MATRIX_KINDS = ['教科×教科', '小問×小問']
+# 相関行列のヒートマップに値を表示する最大の列数
+CORRELATION_TEXT_MAX_COLUMNS = 12
 
-ABILITY_LABELS = {
-    'ability_a': '能力A',
-    'ability_b': '能力B',
-    'ability_c': '能力C',
-    'ability_d': '能力D'
+# 項目分析の散布図に引く識別指数の目安（これ未満の小問は識別力が低いとされる）
+ITEM_DISCRIMINATION_THRESHOLD = 0.2
+
+# タブを切り替えても選択を保持するウィジェットのキー
+# （選択中のタブだけを描画するため、描画されないタブのウィジェットの状態を明示的に残す）
+# （テスト設計の軸ごとのキーは get_persistent_widget_keys で加える）
+PERSISTENT_WIDGET_KEYS = [
+    'data_columns', 'subject_detail', 'subject_corr_x', 'subject_corr_y',
+    'question_analysis_type', 'student_id', 'student_subject', 'heatmap_unit', 'heatmap_order',
+    'heatmap_page_size', 'heatmap_page', 'irt_model', 'corr_matrix_kind',
+    'trajectory_student_id', 'trajectory_student_subject', 'trajectory_student_axis',
+    'trajectory_grade', 'trajectory_class', 'trajectory_subject', 'trajectory_axis'
+]
+
+# テスト設計の軸ごとのタブのアイコン（軸の順に割り当て、足りない場合は繰り返す）
+AXIS_TAB_ICONS = ['🎯', '📦', '🧩', '📐', '🔖']
+# 個別診断のレーダーチャートの色（軸の順）
+AXIS_RADAR_COLORS = ['blue', 'green', 'orange', 'red', 'brown']
+
+# 絞り込み列の表示名
+FILTER_LABELS = {
+    'grade': '学年',
+    'class': 'クラス',
+    'subject': '教科'
 }
 
-def calculate_scores(df):
-    """能力別・領域別の得点を計算"""
-    question_cols = [f'x{i}' for i in range(1, 33)]
-    
-    # 能力別得点の計算
-    for ability, questions in ABILITY_PARAMS.items():
-        available_questions = [q for q in questions if q in df.columns]
-        if available_questions:
-            df[f'{ability}_score'] = df[available_questions].sum(axis=1)
-            df[f'{ability}_rate'] = (df[f'{ability}_score'] / len(available_questions) * 100).round(1)
-    
-    # 領域別得点の計算
-    for domain, questions in DOMAIN_PARAMS.items():
-        available_questions = [q for q in questions if q in df.columns]
-        if available_questions:
-            df[f'{domain}_score'] = df[available_questions].sum(axis=1)
-            df[f'{domain}_rate'] = (df[f'{domain}_score'] / len(available_questions) * 100).round(1)
-    
-    # 総合得点
-    available_all = [q for q in question_cols if q in df.columns]
-    if available_all:
-        df['total_score'] = df[available_all].sum(axis=1)
-        df['total_rate'] = (df['total_score'] / len(available_all) * 100).round(1)
-    
-    return df
-
-def get_ability_stats(df):
-    """能力別の統計量を取得"""
-    stats = []
-    for ability, label in ABILITY_LABELS.items():
-        score_col = f'{ability}_score'
-        rate_col = f'{ability}_rate'
-        if score_col in df.columns and rate_col in df.columns:
-            stats.append({
-                '能力': label,
-                '平均素点': df[score_col].mean(),
-                '平均得点率(%)': df[rate_col].mean(),
-                '標準偏差': df[rate_col].std(),
-                '最高得点率(%)': df[rate_col].max(),
-                '最低得点率(%)': df[rate_col].min()
-            })
-    return pd.DataFrame(stats)
-
-def get_domain_stats(df):
-    """領域別の統計量を取得"""
-    stats = []
-    for domain, label in DOMAIN_LABELS.items():
-        score_col = f'{domain}_score'
-        rate_col = f'{domain}_rate'
-        if score_col in df.columns and rate_col in df.columns:
-            stats.append({
-                '領域': label,
-                '平均素点': df[score_col].mean(),
-                '平均得点率(%)': df[rate_col].mean(),
-                '標準偏差': df[rate_col].std(),
-                '最高得点率(%)': df[rate_col].max(),
-                '最低得点率(%)': df[rate_col].min()
-            })
-    return pd.DataFrame(stats)
-
-def get_subject_stats(df):
-    """教科別の統計量を取得"""
-    if 'subject' not in df.columns:
-        return pd.DataFrame()
-    
-    stats = []
-    for subject in df['subject'].unique():
-        subject_df = df[df['subject'] == subject]
-        if 'total_score' in subject_df.columns and 'total_rate' in subject_df.columns:
-            stats.append({
-                '教科': subject,
-                '受験者数': len(subject_df),
-                '平均素点': subject_df['total_score'].mean(),
-                '平均得点率(%)': subject_df['total_rate'].mean(),
-                '標準偏差': subject_df['total_rate'].std(),
-                '最高得点率(%)': subject_df['total_rate'].max(),
-                '最低得点率(%)': subject_df['total_rate'].min(),
-                '中央値(%)': subject_df['total_rate'].median()
-            })
-    return pd.DataFrame(stats)
-
-def get_subject_ability_stats(df):
-    """教科×能力のクロス集計"""
-    if 'subject' not in df.columns:
-        return pd.DataFrame()
-    
-    stats = []
-    for subject in df['subject'].unique():
-        subject_df = df[df['subject'] == subject]
-        for ability, label in ABILITY_LABELS.items():
-            rate_col = f'{ability}_rate'
-            if rate_col in subject_df.columns:
-                stats.append({
-                    '教科': subject,
-                    '能力': label,
-                    '平均得点率(%)': subject_df[rate_col].mean()
-                })
-    return pd.DataFrame(stats)
-
-def get_subject_domain_stats(df):
-    """教科×領域のクロス集計"""
-    if 'subject' not in df.columns:
-        return pd.DataFrame()
-    
-    stats = []
-    for subject in df['subject'].unique():
-        subject_df = df[df['subject'] == subject]
-        for domain, label in DOMAIN_LABELS.items():
-            rate_col = f'{domain}_rate'
-            if rate_col in subject_df.columns:
-                stats.append({
-                    '教科': subject,
-                    '領域': label,
-                    '平均得点率(%)': subject_df[rate_col].mean()
-                })
-    return pd.DataFrame(stats)
-
-def get_question_correct_rate(df, param_dict):
-    """小問別正答率を取得"""
-    rates = []
-    for category, questions in param_dict.items():
-        for q in questions:
-            if q in df.columns:
-                rates.append({
-                    '問題': q,
-                    'カテゴリ': category,
-                    '正答率(%)': df[q].mean() * 100,
-                    '正答者数': df[q].sum(),
-                    '受験者数': len(df)
-                })
-    return pd.DataFrame(rates)
+def keep_widget_state(keys):
+    """描画されないウィジェットの状態が破棄されないように保持"""
+    for key in keys:
+        if key in st.session_state:
+            st.session_state[key] = st.session_state[key]
 
-# タイトル
-st.title("📊 学力データ分析ダッシュボード（拡張版）")
-st.markdown("**能力・領域パラメータに基づく多角的分析**")
-st.markdown("---")
+def get_persistent_widget_keys(blueprint):
+    """タブを切り替えても選択を保持するウィジェットのキー（テスト設計の軸ごとのキーを含む）"""
+    axis_keys = [key for axis in blueprint.axes for key in (f'{axis}_x', f'{axis}_y', f'cross_{axis}')]
+    return PERSISTENT_WIDGET_KEYS + axis_keys
 
-# サイドバー
-with st.sidebar:
-    st.header("📁 データアップロード")
-    uploaded_file = st.file_uploader(
-        "CSVファイルを選択してください",
-        type=['csv'],
-        help="ID, grade, class, subject, x1-x32の列を含むCSVファイル"
+def get_axis_tab_labels(blueprint):
+    """テスト設計の軸ごとの分析タブの見出し"""
+    return [f"{AXIS_TAB_ICONS[i % len(AXIS_TAB_ICONS)]} {label}別分析"
+            for i, label in enumerate(blueprint.axes.values())]
+
+def get_axis_rate_cols(blueprint, axis, columns):
+    """軸のカテゴリの得点率の列（columns に含まれるもの、テスト設計の順）"""
+    return [f'{category}_rate' for category in blueprint.labels(axis) if f'{category}_rate' in columns]
+
+def compute_content_hash(file_bytes):
+    """ファイル内容のハッシュ値を計算"""
+    return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+def get_uploaded_file_hash(uploaded_file):
+    """アップロードファイルのハッシュ値を取得（同一ファイルはセッション内で再計算しない）"""
+    file_id = getattr(uploaded_file, 'file_id', None)
+    hash_cache = st.session_state.setdefault('_upload_hashes', {})
+    if file_id is not None and file_id in hash_cache:
+        return hash_cache[file_id]
+    
+    content_hash = compute_content_hash(uploaded_file.getvalue())
+    if file_id is not None:
+        hash_cache.clear()
+        hash_cache[file_id] = content_hash
+    return content_hash
+
+def get_store_path(content_hash):
+    """ディスク保存先のパスを取得（保存無効時はNone）"""
+    if not SCORE_STORE_DIR:
+        return None
+    return os.path.join(SCORE_STORE_DIR, f'{content_hash}.parquet')
+
+def save_to_store(df, store_path):
+    """計算済みデータをディスクに保存"""
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    tmp_path = f'{store_path}.tmp'
+    df.to_parquet(tmp_path, index=False)
+    # 書き込み途中のファイルを読まないように置き換え
+    os.replace(tmp_path, store_path)
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner="データを読み込んでいます...")
+def load_scored_data(content_hash, _file_bytes, _blueprint=DEFAULT_BLUEPRINT):
+    """ファイル内容のハッシュをキーに読み込み・得点計算済みのデータを取得
+    
+    _blueprint（テスト設計）で採点する。既定以外のテスト設計の場合は content_hash にその内容も含めること。
+    戻り値は (x列を除いたDataFrame, 解答データのResponseStore)。部分点（整数）・無回答（欠損）もビット列に格納する。
+    x列が小数や負の値を含む場合は (x列を含むDataFrame, None) となる。
+    結果は全セッションで共有されるため、呼び出し側で変更しないこと。
+    """
+    store_path = get_store_path(content_hash)
+    if store_path and os.path.exists(store_path):
+        try:
+            return pack_responses(pd.read_parquet(store_path), _blueprint.items)
+        except Exception:
+            # 壊れた保存ファイルは無視して再計算
+            pass
+    
+    df = read_score_file(_file_bytes, _blueprint.items)
+    df, responses = pack_responses(df, _blueprint.items)
+    df = calculate_scores(df, responses, _blueprint)
+    
+    if store_path:
+        try:
+            save_to_store(unpack_responses(df, responses), store_path)
+        except Exception:
+            # 保存に失敗しても表示は継続
+            pass
+    return df, responses
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner="ファイルを分割して集計しています...")
+def load_streaming_aggregates(content_hash, _file_bytes, _blueprint=DEFAULT_BLUEPRINT):
+    """ファイルを分割して読み込み、集計値だけを取得（ファイル内容のハッシュごとにキャッシュ）
+    
+    生徒の行は保持しないため、全行をDataFrameにできない大きさのファイルでも集計できる。
+    """
+    return StreamingAggregates.from_source(_file_bytes, blueprint=_blueprint)
+
+@st.cache_resource(show_spinner=False)
+def load_sql_backend(path):
+    """集計用のデータベースを開く（全セッション共有）"""
+    return SqlBackend(path)
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner="データベースに格納しています...")
+def load_sql_upload(dataset_key, file_name, _file_bytes, _sql_backend, _blueprint=DEFAULT_BLUEPRINT, blueprint_hash=''):
+    """アップロードしたファイルを分割して採点し、データベースに格納（格納済みの場合は何もしない）
+
+    dataset_key はファイル内容（とテスト設計）のハッシュで、データセットの名前に使う。
+    """
+    _sql_backend.load_file(dataset_key, _file_bytes, _blueprint, blueprint_hash, label=file_name,
+                           content_hash=dataset_key)
+    return dataset_key
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_sql_dataset(dataset_key, dataset_version, _sql_backend, _blueprint=DEFAULT_BLUEPRINT):
+    """データセットの集計の問い合わせを取得（データセット・格納行数ごとにキャッシュ）"""
+    return _sql_backend.dataset(dataset_key, _blueprint)
+
+@st.cache_resource(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner="データベースで集計しています...")
+def load_sql_selection(dataset_key, dataset_version, filter_key, _dataset):
+    """絞り込み条件を加えた集計の問い合わせを取得（条件ごとにキャッシュし、問い合わせの結果も保持する）"""
+    return _dataset.subset({dim: list(values) for dim, values in filter_key})
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_test_blueprint(blueprint_hash, file_name, _file_bytes):
+    """テスト設計ファイルを読み込む（ファイル内容のハッシュごとにキャッシュ）"""
+    return load_blueprint(_file_bytes, file_name)
+
+@st.cache_resource(show_spinner=False)
+def load_session_store(path):
+    """経年データの格納庫を開く（全セッション共有）"""
+    return SessionStore(path)
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_student_trajectory(store_version, student_id, _store):
+    """生徒の試験回ごとの得点を取得（格納庫の版・生徒IDごとにキャッシュ）"""
+    return _store.student_trajectory(student_id)
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_group_trajectory(store_version, where_key, by, _store):
+    """条件に該当するセルの試験回ごとの得点率の統計量を取得（格納庫の版・条件ごとにキャッシュ）"""
+    return _store.group_trajectory({dim: list(values) for dim, values in where_key}, by)
+
+@st.cache_data(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_store_classes(store_version, _store):
+    """経年データの (学年, クラス) と教科の一覧を取得（格納庫の版ごとにキャッシュ）"""
+    return _store.classes(), _store.subjects()
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_filter_index(content_hash, _df):
+    """絞り込み用の索引を取得（データのハッシュごとにキャッシュ）"""
+    return FilterIndex(_df)
+
+@st.cache_resource(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_filtered_data(content_hash, filter_key, _df, _responses, _filter_index):
+    """絞り込み条件に該当する行を取得（条件ごとにキャッシュ）
+    
+    戻り値は (DataFrame, ResponseStore)。条件がない場合は元のデータをそのまま返す。
+    """
+    if not filter_key:
+        return _df, _responses
+    positions = _filter_index.positions(dict(filter_key))
+    responses = _responses.take(positions) if _responses is not None else None
+    return _df.iloc[positions], responses
+
+@st.cache_resource(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_student_index(content_hash, filter_key, _df):
+    """生徒IDの索引を取得（データのハッシュ・絞り込み条件ごとにキャッシュ）"""
+    return StudentIndex(_df)
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_comparison_means(content_hash, filter_key, _cube, _where):
+    """個別診断の比較用の平均を取得（データのハッシュ・絞り込み条件ごとにキャッシュ）
+    
+    行は '全教科' と各教科、列は得点・得点率の列。
+    """
+    return get_comparison_means(_cube, _where)
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner="項目分析を計算しています...")
+def load_item_analysis(content_hash, filter_key, analysis_type, _df, _responses, _param_dict, _weights=None,
+                       _points=None):
+    """小問の項目分析を取得（データのハッシュ・絞り込み条件・分析タイプごとにキャッシュ）
+    
+    _weights はカテゴリごとの小問の重み、_points は小問の満点（テスト設計はデータのハッシュに含まれる）。
+    戻り値は (小問別の表, カテゴリ別の表)。
+    """
+    return get_item_analysis(_df, _param_dict, _responses, _weights, _points)
+
+@st.cache_resource(show_spinner=False)
+def load_irt_warm_starts():
+    """モデルごとの前回の項目パラメータの推定結果（全セッション共有）"""
+    return {}
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner="能力θを推定しています...")
+def load_irt_thetas(content_hash, model, _df, _responses, _param_dict=None):
+    """カテゴリ別（テスト設計の全軸）の能力θと項目パラメータを取得（データのハッシュ・モデルごとにキャッシュ）
+    
+    項目パラメータは絞り込み前の全データで推定する。推定は同じモデルの前回の結果から始めるため、
+    同じ形式の別のファイルや再読み込みでは少ない反復回数で収束する。
+    """
+    warm_starts = load_irt_warm_starts()
+    theta_df, item_params = get_irt_thetas(_df, model, _responses, warm_starts.get(model), _param_dict)
+    warm_starts[model] = item_params
+    return theta_df, item_params
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_theta_summaries(content_hash, filter_key, model, columns, _theta_df, _index):
+    """能力θの分布の要約を取得（データのハッシュ・絞り込み条件・モデルごとにキャッシュ）"""
+    theta = _theta_df.loc[_index]
+    return {
+        col: summarize_distribution(theta[col].to_numpy(), value_range=(-QUADRATURE_RANGE, QUADRATURE_RANGE))
+        for col in columns
+    }
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_subject_aggregates(content_hash, filter_key, _cube, _sketches, _where):
+    """教科別の集計結果を取得（データのハッシュ・絞り込み条件ごとにキャッシュ）
+    
+    集計キューブと分位点スケッチから求めるため、教科ごとの行の並べ替えは行わない。
+    """
+    return rollup_group_aggregates(_cube, _sketches, 'subject', _where)
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_group_sketches(content_hash, _df):
+    """学年×クラス×教科のセルごとの分位点スケッチを取得（データのハッシュごとにキャッシュ）"""
+    return GroupSketches.from_frame(_df, CUBE_DIMS, get_aggregate_value_cols(_df))
+
+@st.cache_resource(max_entries=INGEST_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_aggregate_cube(content_hash, _df):
+    """学年×クラス×教科の集計キューブを取得（データのハッシュごとにキャッシュ）"""
+    return AggregateCube.from_frame(_df)
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_column_summaries(content_hash, filter_key, columns, _sketches, _summary, _where):
+    """列ごとの分布の要約を分位点スケッチから取得（データのハッシュ・絞り込み条件ごとにキャッシュ）"""
+    return {col: summarize_sketch(_sketches.sketch(col, _where), _summary.at[col, 'mean']) for col in columns}
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_group_summaries(content_hash, filter_key, value_col, group_col, _sketches, _cube, _where):
+    """グループごとの分布の要約を分位点スケッチから取得（データのハッシュ・絞り込み条件ごとにキャッシュ）"""
+    group_means = _cube.rollup([group_col], _where)[(value_col, 'mean')]
+    return {
+        group: summarize_sketch(_sketches.sketch(value_col, {**_where, group_col: [group]}), mean)
+        for group, mean in group_means.items()
+    }
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES * 4, show_spinner=False)
+def load_line_fit(content_hash, filter_key, source, x_col, y_col, _data):
+    """回帰直線と相関係数を取得（データのハッシュ・絞り込み条件・列の組ごとにキャッシュ）
+    
+    source は _data の種類を区別する名前（同じ列名でも元の表が異なる場合に使う）。
+    """
+    return fit_line(_data[x_col].to_numpy(dtype=np.float64), _data[y_col].to_numpy(dtype=np.float64))
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES * 4, show_spinner=False)
+def load_mean_cis(content_hash, filter_key, source, columns, group_col, subset, n_boot, _data):
+    """平均のブートストラップ信頼区間を取得（データのハッシュ・絞り込み条件・グループ・反復回数ごとにキャッシュ）
+    
+    group_col を指定すると group_col の値ごと、subset に (列, 値) を指定するとその値の行だけで計算する。
+    """
+    if subset is not None:
+        _data = _data[_data[subset[0]] == subset[1]]
+    return bootstrap_mean_cis(_data, list(columns), group_col, n_boot)
+
+def load_category_cis(content_hash, filter_key, labels, subject, n_boot, df):
+    """カテゴリの平均得点率の信頼区間を取得（n_boot が None の場合は None、subject を指定するとその教科の行だけで計算）"""
+    if not n_boot:
+        return None
+    columns = tuple(f'{category}_rate' for category in labels if f'{category}_rate' in df.columns)
+    subset = None if subject is None else ('subject', subject)
+    return load_mean_cis(content_hash, filter_key, 'scores', columns, None, subset, n_boot, df)
+
+def load_subject_cis(content_hash, filter_key, n_boot, df):
+    """教科ごとの総合得点率の平均の信頼区間を取得（n_boot が None の場合は None）"""
+    if not n_boot:
+        return None
+    return load_mean_cis(content_hash, filter_key, 'scores', ('total_rate',), 'subject', None, n_boot, df)
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES * 4, show_spinner=False)
+def load_correlation_ci(content_hash, filter_key, source, x_col, y_col, n_boot, _data):
+    """相関係数のブートストラップ信頼区間を取得（データのハッシュ・絞り込み条件・列の組・反復回数ごとにキャッシュ）"""
+    return bootstrap_correlation_ci(_data[x_col].to_numpy(dtype=np.float64), _data[y_col].to_numpy(dtype=np.float64),
+                                    n_boot)
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES * 4, show_spinner=False)
+def load_scatter_figure(content_hash, filter_key, source, x_col, y_col, x_label, y_label, title, _data):
+    """相関の散布図・回帰直線・各軸の平均を取得（データのハッシュ・絞り込み条件・列の組ごとにキャッシュ）
+    
+    戻り値は (図, fit_line の結果, X軸の平均, Y軸の平均)。平均線は呼び出し側で追加する。
+    """
+    x = _data[x_col].to_numpy(dtype=np.float64)
+    y = _data[y_col].to_numpy(dtype=np.float64)
+    fit = load_line_fit(content_hash, filter_key, source, x_col, y_col, _data)
+    fig = make_large_scatter_figure(x, y, x_label, y_label, title, ids=_data['ID'].to_numpy(), fit=fit)
+    return fig, fit, np.nanmean(x), np.nanmean(y)
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_subject_pivot(content_hash, filter_key, _df):
+    """生徒×教科の総合得点率の表を取得（データのハッシュ・絞り込み条件ごとにキャッシュ）"""
+    return _df.pivot_table(
+        index='ID',
+        columns='subject',
+        values='total_rate',
+        observed=True
+    ).reset_index()
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_score_correlations(content_hash, filter_key, _df, _blueprint=DEFAULT_BLUEPRINT):
+    """テスト設計の全カテゴリと総合の得点率の相関行列を取得（データのハッシュ・絞り込み条件ごとにキャッシュ）
+    
+    能力×能力・能力×領域などの相関はすべてこの行列から引く。
+    """
+    rate_cols = [f'{category}_rate' for category in _blueprint.categories] + ['total_rate']
+    return get_correlation_matrix(_df, rate_cols)
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner=False)
+def load_subject_correlations(content_hash, filter_key, _df):
+    """教科間の総合得点率の相関行列を取得（データのハッシュ・絞り込み条件ごとにキャッシュ）"""
+    pivot_df = load_subject_pivot(content_hash, filter_key, _df)
+    return get_correlation_matrix(pivot_df, [col for col in pivot_df.columns if col != 'ID'])
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner="小問間の相関を計算しています...")
+def load_item_correlations(content_hash, filter_key, _df, _responses):
+    """小問間の相関行列を取得（データのハッシュ・絞り込み条件ごとにキャッシュ）"""
+    return get_item_correlation_matrix(_df, _responses)
+
+@st.cache_data(max_entries=FILTER_CACHE_MAX_ENTRIES, show_spinner="ヒートマップを準備しています...")
+def load_student_profiles(content_hash, filter_key, rate_cols, _df):
+    """生徒別の得点率プロファイルと類似度順の並びを取得（データのハッシュ・絞り込み条件ごとにキャッシュ）"""
+    profiles = compute_student_profiles(_df, rate_cols)
+    return profiles, compute_similarity_order(profiles.to_numpy())
+
+def format_ci(ci, digits):
+    """信頼区間の表示用の文字列"""
+    low, high = ci
+    return f"{DEFAULT_CONFIDENCE:.0%}信頼区間: {low:.{digits}f} 〜 {high:.{digits}f}"
+
+def show_ci_caption(n_boot):
+    """統計量の表の信頼区間の説明を表示"""
+    if n_boot:
+        st.caption(f"CIは平均得点率のブートストラップ法（再標本{n_boot}回）による{DEFAULT_CONFIDENCE:.0%}信頼区間です。")
+
+def show_correlation_metrics(content_hash, filter_key, source, data, corr, axes, n_boot):
+    """相関係数と各軸の平均を表示（n_boot を指定した場合はブートストラップ信頼区間も表示）
+    
+    axes は軸ごとの (列, 表示名, 平均) のリスト（X軸, Y軸の順）。
+    """
+    (x_col, _, _), (y_col, _, _) = axes
+    if n_boot:
+        corr_ci = load_correlation_ci(content_hash, filter_key, source, x_col, y_col, n_boot, data)
+        mean_cis = load_mean_cis(content_hash, filter_key, source, (x_col, y_col), None, None, n_boot, data)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("相関係数", f"{corr:.3f}")
+        if n_boot:
+            st.caption(format_ci(corr_ci, 3))
+    for column, (col, label, mean) in zip((col2, col3), axes):
+        with column:
+            st.metric(label, f"{mean:.1f}%")
+            if n_boot:
+                st.caption(format_ci(mean_cis.loc[col], 1))
+
+def make_heatmap_frame(profiles, rate_cols, labels):
+    """ヒートマップ用の表（行: カテゴリ名, 列: 生徒またはクラス）"""
+    frame = profiles[rate_cols].copy()
+    frame.columns = [labels.get(col.replace('_rate', ''), col) for col in rate_cols]
+    return frame.T
+
+@st.fragment
+def render_axis_correlation(df, content_hash, filter_key, blueprint, axis, rate_cols, n_boot=None):
+    """軸のカテゴリ間の相関（軸の選択を変えたときはこの部分だけ再実行）"""
+    labels = blueprint.labels(axis)
+    axis_label = blueprint.axes[axis]
+    col1, col2 = st.columns(2)
+    with col1:
+        category_x = st.selectbox(f"X軸の{axis_label}", rate_cols, format_func=lambda x: labels.get(x.replace('_rate', ''), x),
+                                  key=f"{axis}_x")
+    with col2:
+        category_y = st.selectbox(f"Y軸の{axis_label}", 
+                                  [c for c in rate_cols if c != category_x],
+                                  format_func=lambda x: labels.get(x.replace('_rate', ''), x),
+                                  key=f"{axis}_y")
+    
+    # 散布図作成（件数が多い場合は度数分布で描画）
+    label_x = labels.get(category_x.replace("_rate", ""), category_x)
+    label_y = labels.get(category_y.replace("_rate", ""), category_y)
+    fig, _, mean_x, mean_y = load_scatter_figure(
+        content_hash, filter_key, 'scores', category_x, category_y,
+        label_x, label_y, f'{label_x} vs {label_y}', df
     )
     
-    st.markdown("---")
-    st.markdown("### 📋 パラメータ設定")
-    st.markdown("**領域パラメータ**")
-    for domain, label in DOMAIN_LABELS.items():
-        questions = DOMAIN_PARAMS[domain]
-        st.text(f"{label}: {questions[0]}-{questions[-1]}")
+    # 平均線を追加（赤い破線）
+    fig.add_hline(y=mean_y, line_dash="dash", line_color="red", line_width=2, 
+                 annotation_text=f"Y軸平均: {mean_y:.1f}%", 
+                 annotation_position="right")
+    fig.add_vline(x=mean_x, line_dash="dash", line_color="red", line_width=2,
+                 annotation_text=f"X軸平均: {mean_x:.1f}%",
+                 annotation_position="top")
     
-    st.markdown("**能力パラメータ**")
-    for ability, label in ABILITY_LABELS.items():
-        st.text(f"{label}: 各領域から2問ずつ")
+    st.plotly_chart(fig, use_container_width=True)
+    
+    corr = load_score_correlations(content_hash, filter_key, df, blueprint).at[category_x, category_y]
+    
+    # 相関係数と平均値の情報を表示
+    show_correlation_metrics(content_hash, filter_key, 'scores', df, corr,
+                             [(category_x, f"X軸平均 ({label_x})", mean_x),
+                              (category_y, f"Y軸平均 ({label_y})", mean_y)], n_boot)
 
-# メイン画面
-if uploaded_file is None:
-    st.info("👈 左のサイドバーからCSVファイルをアップロードしてください")
-    st.markdown("""
-    ### このダッシュボードでできること
-    - ✅ **能力別分析**: 4つの能力（A, B, C, D）ごとの素点・得点率を算出
-    - ✅ **領域別分析**: 4つの領域（1, 2, 3, 4）ごとの素点・得点率を算出
-    - ✅ **多次元可視化**: 能力・領域のレーダーチャート、ヒートマップ
-    - ✅ **個別診断**: 生徒ごとの強み・弱みの可視化
-    - ✅ **小問分析**: パラメータごとの正答率分析
-    """)
-else:
-    try:
-        # データ読み込み
-        df = pd.read_csv(uploaded_file)
+@st.fragment
+def render_subject_correlation(df, content_hash, filter_key, subjects, n_boot=None):
+    """教科間の相関（軸の選択を変えたときはこの部分だけ再実行）"""
+    # データをピボット（生徒×教科）
+    pivot_df = load_subject_pivot(content_hash, filter_key, df)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        subject_x = st.selectbox("X軸の教科", subjects, key="subject_corr_x")
+    with col2:
+        subject_y = st.selectbox("Y軸の教科", 
+                               [s for s in subjects if s != subject_x],
+                               key="subject_corr_y")
+    
+    if subject_x in pivot_df.columns and subject_y in pivot_df.columns:
+        # 散布図作成（件数が多い場合は度数分布で描画）
+        fig4, _, mean_subject_x, mean_subject_y = load_scatter_figure(
+            content_hash, filter_key, 'subject_total_rate', subject_x, subject_y,
+            f'{subject_x} 総合得点率(%)',
+            f'{subject_y} 総合得点率(%)',
+            f'{subject_x} vs {subject_y}の総合得点率相関',
+            pivot_df
+        )
         
-        # BOM除去（UTF-8 with BOM対策）
-        df.columns = df.columns.str.replace('\ufeff', '')
+        # 平均線を追加（赤い破線）
+        fig4.add_hline(y=mean_subject_y, line_dash="dash", line_color="red", line_width=2,
+                      annotation_text=f"{subject_y}平均: {mean_subject_y:.1f}%",
+                      annotation_position="right")
+        fig4.add_vline(x=mean_subject_x, line_dash="dash", line_color="red", line_width=2,
+                      annotation_text=f"{subject_x}平均: {mean_subject_x:.1f}%",
+                      annotation_position="top")
         
-        # 得点計算
-        df = calculate_scores(df)
+        st.plotly_chart(fig4, use_container_width=True)
         
-        # タブで機能を分割
-        tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
-            "📄 データ確認", 
-            "🎯 能力別分析",
-            "📦 領域別分析",
-            "📚 教科別分析",
-            "✓ 小問分析", 
-            "👤 個別診断",
-            "📊 総合ダッシュボード"
-        ])
+        corr = load_subject_correlations(content_hash, filter_key, df).at[subject_x, subject_y]
         
-        # タブ1: データ確認
-        with tab1:
-            st.subheader("アップロードされたデータ（計算済み）")
-            
-            # 基本情報
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("生徒数", df['ID'].nunique())
-            with col2:
-                st.metric("学年数", df['grade'].nunique())
-            with col3:
-                st.metric("クラス数", df['class'].nunique())
-            with col4:
-                st.metric("教科数", df['subject'].nunique())
-            
-            # データ表示オプション
-            show_columns = st.multiselect(
-                "表示する列を選択",
-                options=df.columns.tolist(),
-                default=['ID', 'grade', 'class', 'subject', 'total_score', 'total_rate']
+        # 相関係数と平均値の情報を表示
+        show_correlation_metrics(content_hash, filter_key, 'subject_total_rate', pivot_df, corr,
+                                 [(subject_x, f"{subject_x}平均", mean_subject_x),
+                                  (subject_y, f"{subject_y}平均", mean_subject_y)], n_boot)
+
+@st.fragment
+def render_cross_correlation(df, content_hash, filter_key, blueprint, row_axis, col_axis, n_boot=None):
+    """2つの軸（能力×領域など）のクロス分析（カテゴリの選択を変えたときはこの部分だけ再実行）"""
+    row_labels = blueprint.labels(row_axis)
+    col_labels = blueprint.labels(col_axis)
+    row_name = blueprint.axes[row_axis]
+    col_name = blueprint.axes[col_axis]
+    col1, col2 = st.columns(2)
+    with col1:
+        selected_row = st.selectbox(f"{row_name}を選択", list(row_labels.keys()), format_func=lambda x: row_labels[x],
+                                    key=f"cross_{row_axis}")
+    with col2:
+        selected_col = st.selectbox(f"{col_name}を選択", list(col_labels.keys()), format_func=lambda x: col_labels[x],
+                                    key=f"cross_{col_axis}")
+    
+    row_col = f'{selected_row}_rate'
+    col_col = f'{selected_col}_rate'
+    
+    if row_col in df.columns and col_col in df.columns:
+        # 散布図作成（件数が多い場合は度数分布で描画）
+        fig3, _, mean_row, mean_col = load_scatter_figure(
+            content_hash, filter_key, 'scores', row_col, col_col,
+            f'{row_labels[selected_row]}得点率(%)',
+            f'{col_labels[selected_col]}得点率(%)',
+            f'{row_labels[selected_row]} vs {col_labels[selected_col]}',
+            df
+        )
+        
+        # 平均線を追加（赤い破線）
+        fig3.add_hline(y=mean_col, line_dash="dash", line_color="red", line_width=2,
+                      annotation_text=f"{col_name}平均: {mean_col:.1f}%",
+                      annotation_position="right")
+        fig3.add_vline(x=mean_row, line_dash="dash", line_color="red", line_width=2,
+                      annotation_text=f"{row_name}平均: {mean_row:.1f}%",
+                      annotation_position="top")
+        
+        st.plotly_chart(fig3, use_container_width=True)
+        
+        corr = load_score_correlations(content_hash, filter_key, df, blueprint).at[row_col, col_col]
+        
+        # 相関係数と平均値の情報を表示
+        show_correlation_metrics(content_hash, filter_key, 'scores', df, corr,
+                                 [(row_col, f"{row_name}平均 ({row_labels[selected_row]})", mean_row),
+                                  (col_col, f"{col_name}平均 ({col_labels[selected_col]})", mean_col)], n_boot)
+
+def get_correlation_matrix_kinds(blueprint):
+    """相関行列のヒートマップで選べる組み合わせ（{表示名: (行の軸, 列の軸)}、教科・小問は None）"""
+    axes = list(blueprint.axes)
+    kinds = {
+        f'{blueprint.axes[row_axis]}×{blueprint.axes[col_axis]}': (row_axis, col_axis)
+        for i, row_axis in enumerate(axes) for col_axis in axes[i:]
+    }
+    kinds.update({kind: None for kind in CORRELATION_MATRIX_KINDS})
+    return kinds
+
+@st.fragment
+def render_correlation_matrix(df, responses, content_hash, filter_key, blueprint):
+    """相関行列のヒートマップ（組み合わせの選択を変えたときはこの部分だけ再実行）"""
+    kinds = get_correlation_matrix_kinds(blueprint)
+    kind = st.radio("組み合わせ", list(kinds), horizontal=True, key="corr_matrix_kind")
+    
+    if kind == '教科×教科':
+        if 'subject' not in df.columns:
+            st.warning("データにsubject列が見つかりません。")
+            return
+        matrix = load_subject_correlations(content_hash, filter_key, df)
+        if len(matrix) < 2:
+            st.info("教科が1つのため、教科間の相関はありません。")
+            return
+    elif kind == '小問×小問':
+        matrix = load_item_correlations(content_hash, filter_key, df, responses)
+    else:
+        # テスト設計の全カテゴリの相関行列から該当する部分を取り出す
+        score_corr = load_score_correlations(content_hash, filter_key, df, blueprint)
+        row_axis, col_axis = kinds[kind]
+        matrix = score_corr.loc[get_axis_rate_cols(blueprint, row_axis, score_corr.index),
+                                get_axis_rate_cols(blueprint, col_axis, score_corr.index)]
+        labels = blueprint.category_labels
+        matrix = matrix.rename(index=lambda col: labels.get(col.replace('_rate', ''), col),
+                               columns=lambda col: labels.get(col.replace('_rate', ''), col))
+    
+    fig = px.imshow(
+        matrix,
+        labels=dict(color="相関係数"),
+        x=matrix.columns,
+        y=matrix.index,
+        zmin=-1,
+        zmax=1,
+        color_continuous_scale='RdBu_r',
+        aspect='auto',
+        title=f'{kind}の相関行列',
+        text_auto='.2f' if len(matrix.columns) <= CORRELATION_TEXT_MAX_COLUMNS else False
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+def render_subject_category_heatmaps(subject_aggregates, blueprint):
+    """教科×能力・教科×領域（テスト設計の軸ごと）の平均得点率ヒートマップを描画"""
+    for axis, axis_label in blueprint.axes.items():
+        st.markdown(f"### 教科×{axis_label}の平均得点率ヒートマップ")
+        
+        pivot_table = get_group_category_means(subject_aggregates, blueprint.param_dict(axis), blueprint.labels(axis))
+        if not pivot_table.empty:
+            fig = px.imshow(
+                pivot_table,
+                labels=dict(x="教科", y=axis_label, color="平均得点率(%)"),
+                x=pivot_table.columns,
+                y=pivot_table.index,
+                color_continuous_scale='RdYlGn',
+                aspect='auto',
+                title=f'教科×{axis_label}の平均得点率',
+                text_auto='.1f'
             )
-            
-            if show_columns:
-                st.dataframe(df[show_columns], use_container_width=True)
-            else:
-                st.dataframe(df, use_container_width=True)
+            st.plotly_chart(fig, use_container_width=True)
+
+def get_class_mean_profiles(cube, where, rate_cols):
+    """クラスごとの平均得点率（行: 「学年年クラス組」, 列: 得点率の列）"""
+    class_means = cube.rollup(['grade', 'class'], where)
+    profiles = pd.DataFrame({col: class_means[(col, 'mean')] for col in rate_cols})
+    profiles.index = [f'{grade}年{cls}組' for grade, cls in profiles.index]
+    return profiles
+
+def render_category_heatmaps(heatmap_profiles, blueprint, unit_name, unit_label):
+    """単位（生徒・クラス）別の能力・領域別（テスト設計の軸ごと）の得点率ヒートマップを描画"""
+    for axis, axis_label in blueprint.axes.items():
+        # ヒートマップ（生徒×軸のカテゴリ）
+        st.markdown(f"### {unit_name}別・{axis_label}別得点率ヒートマップ")
         
-        # タブ2: 能力別分析
-        with tab2:
-            st.subheader("能力別統計量")
-            
-            ability_stats = get_ability_stats(df)
-            st.dataframe(ability_stats.round(2), use_container_width=True)
+        rate_cols = get_axis_rate_cols(blueprint, axis, heatmap_profiles.columns)
+        if rate_cols:
+            heatmap_df = make_heatmap_frame(heatmap_profiles, rate_cols, blueprint.labels(axis))
             
-            # 能力別得点率の分布
-            st.markdown("### 能力別得点率の分布")
-            
-            ability_rate_cols = [f'{ability}_rate' for ability in ABILITY_PARAMS.keys() if f'{ability}_rate' in df.columns]
+            fig = px.imshow(
+                heatmap_df,
+                labels=dict(x=unit_label, y=axis_label, color="得点率(%)"),
+                x=heatmap_df.columns.astype(str),
+                y=heatmap_df.index,
+                color_continuous_scale='RdYlGn',
+                aspect='auto',
+                title=f"{unit_name}別・{axis_label}別得点率ヒートマップ"
+            )
+            st.plotly_chart(fig, use_container_width=True)
+
+def render_data_tab(df, responses):
+    """データ確認タブを描画"""
+    st.subheader("アップロードされたデータ（計算済み）")
+    
+    # 基本情報
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("生徒数", df['ID'].nunique())
+    with col2:
+        st.metric("学年数", df['grade'].nunique())
+    with col3:
+        st.metric("クラス数", df['class'].nunique())
+    with col4:
+        st.metric("教科数", df['subject'].nunique())
+    
+    # データ表示オプション
+    item_cols = responses.item_cols if responses is not None else []
+    # 既定値はセッション状態に設定（タブ切り替え後も選択を保持するため）
+    st.session_state.setdefault("data_columns", ['ID', 'grade', 'class', 'subject', 'total_score', 'total_rate'])
+    show_columns = st.multiselect(
+        "表示する列を選択",
+        options=df.columns.tolist() + item_cols,
+        key="data_columns"
+    )
+    
+    display_df = df
+    if responses is not None:
+        # ビット列に格納した小問は表示する列だけ展開
+        selected_items = [c for c in show_columns if c in item_cols] if show_columns else item_cols
+        if selected_items:
+            display_df = pd.concat([df, responses.to_frame(selected_items, index=df.index)], axis=1)
+    if show_columns:
+        display_df = display_df[show_columns]
+    st.dataframe(display_df, use_container_width=True)
+    
+    if responses is not None:
+        parts = [f"{responses.n_items}問 × {responses.n_rows:,}行"]
+        if responses.n_planes > 1:
+            parts.append(f"部分点{responses.n_planes}ビット")
+        if responses.valid is not None:
+            parts.append("無回答を区別")
+        st.caption(f"解答データはビット列で格納しています（{', '.join(parts)}, {responses.nbytes / 1024 ** 2:.1f} MB）")
+
+def render_theta_section(df, full_df, full_responses, content_hash, filter_key, blueprint, axis):
+    """能力θ（項目反応理論による推定値）の分布と得点率との比較を描画"""
+    param_dict = blueprint.param_dict(axis)
+    labels = blueprint.labels(axis)
+    category_name = blueprint.axes[axis]
+    st.markdown(f"### {category_name}別の能力推定値（θ）")
+    st.caption("教科・カテゴリごとに項目反応理論のモデルを絞り込み前の全データで推定し、"
+               "生徒の能力θ（EAP推定値、平均0・標準偏差1の尺度）を求めています。"
+               "得点率と異なり、小問ごとの難しさ（2PLでは識別力も）の違いを考慮した値です。")
+    st.session_state.setdefault("irt_model", 'rasch')
+    model = st.radio("モデル", list(IRT_MODELS.keys()), format_func=IRT_MODELS.get, horizontal=True, key="irt_model")
+    
+    try:
+        theta_df, item_params = load_irt_thetas(content_hash, model, full_df, full_responses, blueprint.param_dict())
+    except ValueError as e:
+        st.info(f"能力θを推定できません: {e}")
+        return
+    theta_cols = [f'{category}_theta' for category in param_dict if f'{category}_theta' in theta_df.columns]
+    if not theta_cols:
+        return
+    
+    theta_summaries = load_theta_summaries(content_hash, filter_key, model, tuple(theta_cols), theta_df, df.index)
+    summaries = {labels.get(col.replace('_theta', ''), col): theta_summaries[col] for col in theta_cols}
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        fig = make_summary_box_figure(summaries, category_name, 'θ', f'{category_name}別θの分布')
+        st.plotly_chart(fig, use_container_width=True)
+    with col2:
+        # 得点率と並べて比較
+        theta = theta_df.loc[df.index, theta_cols]
+        comparison = pd.DataFrame([
+            {
+                category_name: labels.get(col.replace('_theta', ''), col),
+                '平均得点率(%)': df[col.replace('_theta', '_rate')].mean(),
+                'θの平均': theta[col].mean(),
+                'θの標準偏差': theta[col].std(),
+                '得点率との相関': df[col.replace('_theta', '_rate')].corr(theta[col]),
+            }
+            for col in theta_cols
+        ])
+        st.dataframe(comparison.round(3), use_container_width=True)
+    
+    with st.expander("項目パラメータ"):
+        params = item_params[item_params['カテゴリ'].isin(param_dict.keys())].copy()
+        params['カテゴリ'] = params['カテゴリ'].map(labels)
+        params = params.rename(columns={'グループ': '教科'}).reset_index(drop=True)
+        if 'subject' not in full_df.columns:
+            params = params.drop(columns='教科')
+        st.dataframe(params.round(3), use_container_width=True)
+
+def render_axis_tab(df, content_hash, filter_key, overall_summary, sketches, cube_where, full_df, full_responses,
+                    blueprint, axis, n_boot=None):
+    """能力別・領域別など、テスト設計の軸ごとの分析タブを描画"""
+    labels = blueprint.labels(axis)
+    category_name = blueprint.axes[axis]
+    st.subheader(f"{category_name}別統計量")
+    
+    cis = load_category_cis(content_hash, filter_key, labels, None, n_boot, df)
+    axis_stats = get_axis_stats(df, blueprint, axis, overall_summary, cis)
+    st.dataframe(axis_stats.round(2), use_container_width=True)
+    show_ci_caption(n_boot)
+    
+    # カテゴリ別得点率の分布
+    st.markdown(f"### {category_name}別得点率の分布")
+    
+    rate_cols = get_axis_rate_cols(blueprint, axis, df.columns)
+    
+    if rate_cols:
+        # 分布の要約統計量をサーバー側で計算し、要約だけを描画
+        column_summaries = load_column_summaries(content_hash, filter_key, tuple(rate_cols),
+                                                 sketches, overall_summary, cube_where)
+        summaries = {
+            labels.get(col.replace('_rate', ''), col): column_summaries[col]
+            for col in rate_cols
+        }
+        
+        # 箱ひげ図
+        fig = make_summary_box_figure(summaries, category_name, '得点率(%)', f'{category_name}別得点率の分布')
+        st.plotly_chart(fig, use_container_width=True)
+        
+        # ヒストグラム（重ね合わせ）
+        fig2 = make_summary_histogram_figure(summaries, category_name, '得点率(%)', f'{category_name}別得点率のヒストグラム')
+        st.plotly_chart(fig2, use_container_width=True)
+        
+        render_theta_section(df, full_df, full_responses, content_hash, filter_key, blueprint, axis)
+    
+    # カテゴリ間の相関分析
+    st.markdown(f"### {category_name}間の相関")
+    
+    if len(rate_cols) >= 2:
+        render_axis_correlation(df, content_hash, filter_key, blueprint, axis, rate_cols, n_boot)
+
+def render_subject_tab(df, content_hash, filter_key, cube, cube_where, sketches, blueprint, n_boot=None):
+    """教科別分析タブを描画"""
+    st.subheader("教科別統計量")
+    subject_aggregates = load_subject_aggregates(content_hash, filter_key, cube, sketches, cube_where)
+    
+    # 教科の数を確認
+    if 'subject' in df.columns:
+        subjects = df['subject'].unique()
+        
+        if len(subjects) > 1:
+            # 複数教科がある場合
+            subject_stats = get_subject_stats(df, subject_aggregates, load_subject_cis(content_hash, filter_key, n_boot, df))
+            st.dataframe(subject_stats.round(2), use_container_width=True)
+            show_ci_caption(n_boot)
             
-            if ability_rate_cols:
-                # データを縦持ちに変換
-                plot_data = []
-                for col in ability_rate_cols:
-                    ability_name = col.replace('_rate', '')
-                    label = ABILITY_LABELS.get(ability_name, ability_name)
-                    for value in df[col]:
-                        plot_data.append({'能力': label, '得点率(%)': value})
-                
-                plot_df = pd.DataFrame(plot_data)
-                
-                # 箱ひげ図
-                fig = px.box(
-                    plot_df,
-                    x='能力',
-                    y='得点率(%)',
-                    title='能力別得点率の分布',
-                    color='能力'
-                )
-                st.plotly_chart(fig, use_container_width=True)
-                
-                # ヒストグラム（重ね合わせ）
-                fig2 = px.histogram(
-                    plot_df,
-                    x='得点率(%)',
-                    color='能力',
-                    nbins=20,
-                    title='能力別得点率のヒストグラム',
-                    opacity=0.7,
-                    barmode='overlay'
-                )
-                st.plotly_chart(fig2, use_container_width=True)
+            # 教科別総合得点率の比較
+            st.markdown("### 教科別総合得点率の比較")
             
-            # 能力間の相関分析
-            st.markdown("### 能力間の相関")
+            subject_summaries = load_group_summaries(content_hash, filter_key, 'total_rate', 'subject',
+                                                     sketches, cube, cube_where)
+            fig = make_summary_box_figure(subject_summaries, '教科', '総合得点率(%)', '教科別総合得点率の分布')
+            st.plotly_chart(fig, use_container_width=True)
             
-            if len(ability_rate_cols) >= 2:
-                col1, col2 = st.columns(2)
-                with col1:
-                    ability_x = st.selectbox("X軸の能力", ability_rate_cols, format_func=lambda x: ABILITY_LABELS.get(x.replace('_rate', ''), x))
-                with col2:
-                    ability_y = st.selectbox("Y軸の能力", 
-                                           [c for c in ability_rate_cols if c != ability_x],
-                                           format_func=lambda x: ABILITY_LABELS.get(x.replace('_rate', ''), x))
-                
-                # 平均値の計算
-                mean_x = df[ability_x].mean()
-                mean_y = df[ability_y].mean()
-                
-                # 散布図作成（IDをホバー表示に追加）
-                fig = px.scatter(
-                    df,
-                    x=ability_x,
-                    y=ability_y,
-                    title=f'{ABILITY_LABELS.get(ability_x.replace("_rate", ""), ability_x)} vs {ABILITY_LABELS.get(ability_y.replace("_rate", ""), ability_y)}',
-                    trendline="ols",
-                    hover_data={'ID': True, ability_x: ':.1f', ability_y: ':.1f'}
-                )
-                
-                # 平均線を追加（赤い破線）
-                fig.add_hline(y=mean_y, line_dash="dash", line_color="red", line_width=2, 
-                             annotation_text=f"Y軸平均: {mean_y:.1f}%", 
-                             annotation_position="right")
-                fig.add_vline(x=mean_x, line_dash="dash", line_color="red", line_width=2,
-                             annotation_text=f"X軸平均: {mean_x:.1f}%",
-                             annotation_position="top")
-                
-                st.plotly_chart(fig, use_container_width=True)
-                
-                corr = df[[ability_x, ability_y]].corr().iloc[0, 1]
-                
-                # 相関係数と平均値の情報を表示
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("相関係数", f"{corr:.3f}")
-                with col2:
-                    st.metric(f"X軸平均 ({ABILITY_LABELS.get(ability_x.replace('_rate', ''), ability_x)})", f"{mean_x:.1f}%")
-                with col3:
-                    st.metric(f"Y軸平均 ({ABILITY_LABELS.get(ability_y.replace('_rate', ''), ability_y)})", f"{mean_y:.1f}%")
-        
-        # タブ3: 領域別分析
-        with tab3:
-            st.subheader("領域別統計量")
+            render_subject_category_heatmaps(subject_aggregates, blueprint)
             
-            domain_stats = get_domain_stats(df)
-            st.dataframe(domain_stats.round(2), use_container_width=True)
+            # 教科選択による詳細分析
+            st.markdown("### 教科別詳細分析")
             
-            # 領域別得点率の分布
-            st.markdown("### 領域別得点率の分布")
+            selected_subject = st.selectbox("詳細分析する教科を選択", subjects, key="subject_detail")
+            subject_summary = cube.summary({**cube_where, 'subject': selected_subject})
             
-            domain_rate_cols = [f'{domain}_rate' for domain in DOMAIN_PARAMS.keys() if f'{domain}_rate' in df.columns]
+            # 軸ごとの統計（2列に並べる）
+            columns = st.columns(2)
+            for i, (axis, axis_label) in enumerate(blueprint.axes.items()):
+                with columns[i % 2]:
+                    st.markdown(f"**{selected_subject} - {axis_label}別統計**")
+                    axis_stats_subject = get_axis_stats(
+                        df, blueprint, axis, subject_summary,
+                        load_category_cis(content_hash, filter_key, blueprint.labels(axis), selected_subject, n_boot, df))
+                    st.dataframe(axis_stats_subject.round(2), use_container_width=True)
+            show_ci_caption(n_boot)
             
-            if domain_rate_cols:
-                # データを縦持ちに変換
-                plot_data = []
-                for col in domain_rate_cols:
-                    domain_name = col.replace('_rate', '')
-                    label = DOMAIN_LABELS.get(domain_name, domain_name)
-                    for value in df[col]:
-                        plot_data.append({'領域': label, '得点率(%)': value})
-                
-                plot_df = pd.DataFrame(plot_data)
+            # 教科間の相関分析
+            if len(subjects) >= 2:
+                st.markdown("### 教科間の相関分析")
                 
-                # 箱ひげ図
-                fig = px.box(
-                    plot_df,
-                    x='領域',
-                    y='得点率(%)',
-                    title='領域別得点率の分布',
-                    color='領域'
-                )
-                st.plotly_chart(fig, use_container_width=True)
-                
-                # ヒストグラム（重ね合わせ）
-                fig2 = px.histogram(
-                    plot_df,
-                    x='得点率(%)',
-                    color='領域',
-                    nbins=20,
-                    title='領域別得点率のヒストグラム',
-                    opacity=0.7,
-                    barmode='overlay'
-                )
-                st.plotly_chart(fig2, use_container_width=True)
+                render_subject_correlation(df, content_hash, filter_key, subjects, n_boot)
         
-        # タブ4: 教科別分析
-        with tab4:
-            st.subheader("教科別統計量")
+        else:
+            # 単一教科の場合
+            st.info(f"データには1つの教科（{subjects[0]}）のみが含まれています。")
+            st.markdown("複数教科のデータをアップロードすると、教科間の比較分析が可能になります。")
             
-            # 教科の数を確認
-            if 'subject' in df.columns:
-                subjects = df['subject'].unique()
-                
-                if len(subjects) > 1:
-                    # 複数教科がある場合
-                    subject_stats = get_subject_stats(df)
-                    st.dataframe(subject_stats.round(2), use_container_width=True)
-                    
-                    # 教科別総合得点率の比較
-                    st.markdown("### 教科別総合得点率の比較")
-                    
-                    fig = px.box(
-                        df,
-                        x='subject',
-                        y='total_rate',
-                        title='教科別総合得点率の分布',
-                        labels={'subject': '教科', 'total_rate': '総合得点率(%)'},
-                        color='subject'
-                    )
-                    st.plotly_chart(fig, use_container_width=True)
-                    
-                    # 教科×能力のヒートマップ
-                    st.markdown("### 教科×能力の平均得点率ヒートマップ")
-                    
-                    subject_ability_stats = get_subject_ability_stats(df)
-                    if not subject_ability_stats.empty:
-                        pivot_table = subject_ability_stats.pivot(index='能力', columns='教科', values='平均得点率(%)')
-                        
-                        fig2 = px.imshow(
-                            pivot_table,
-                            labels=dict(x="教科", y="能力", color="平均得点率(%)"),
-                            x=pivot_table.columns,
-                            y=pivot_table.index,
-                            color_continuous_scale='RdYlGn',
-                            aspect='auto',
-                            title='教科×能力の平均得点率',
-                            text_auto='.1f'
-                        )
-                        st.plotly_chart(fig2, use_container_width=True)
-                    
-                    # 教科×領域のヒートマップ
-                    st.markdown("### 教科×領域の平均得点率ヒートマップ")
-                    
-                    subject_domain_stats = get_subject_domain_stats(df)
-                    if not subject_domain_stats.empty:
-                        pivot_table2 = subject_domain_stats.pivot(index='領域', columns='教科', values='平均得点率(%)')
-                        
-                        fig3 = px.imshow(
-                            pivot_table2,
-                            labels=dict(x="教科", y="領域", color="平均得点率(%)"),
-                            x=pivot_table2.columns,
-                            y=pivot_table2.index,
-                            color_continuous_scale='RdYlGn',
-                            aspect='auto',
-                            title='教科×領域の平均得点率',
-                            text_auto='.1f'
-                        )
-                        st.plotly_chart(fig3, use_container_width=True)
-                    
-                    # 教科選択による詳細分析
-                    st.markdown("### 教科別詳細分析")
-                    
-                    selected_subject = st.selectbox("詳細分析する教科を選択", subjects)
-                    subject_df = df[df['subject'] == selected_subject]
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        # 能力別の統計
-                        st.markdown(f"**{selected_subject} - 能力別統計**")
-                        ability_stats_subject = get_ability_stats(subject_df)
-                        st.dataframe(ability_stats_subject.round(2), use_container_width=True)
-                    
-                    with col2:
-                        # 領域別の統計
-                        st.markdown(f"**{selected_subject} - 領域別統計**")
-                        domain_stats_subject = get_domain_stats(subject_df)
-                        st.dataframe(domain_stats_subject.round(2), use_container_width=True)
-                    
-                    # 教科間の相関分析
-                    if len(subjects) >= 2:
-                        st.markdown("### 教科間の相関分析")
-                        
-                        # データをピボット（生徒×教科）
-                        pivot_df = df.pivot_table(
-                            index='ID',
-                            columns='subject',
-                            values='total_rate'
-                        ).reset_index()
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            subject_x = st.selectbox("X軸の教科", subjects, key="subject_corr_x")
-                        with col2:
-                            subject_y = st.selectbox("Y軸の教科", 
-                                                   [s for s in subjects if s != subject_x],
-                                                   key="subject_corr_y")
-                        
-                        if subject_x in pivot_df.columns and subject_y in pivot_df.columns:
-                            # 平均値の計算
-                            mean_subject_x = pivot_df[subject_x].mean()
-                            mean_subject_y = pivot_df[subject_y].mean()
-                            
-                            # 散布図作成（IDをホバー表示に追加）
-                            fig4 = px.scatter(
-                                pivot_df,
-                                x=subject_x,
-                                y=subject_y,
-                                title=f'{subject_x} vs {subject_y}の総合得点率相関',
-                                labels={subject_x: f'{subject_x} 総合得点率(%)', 
-                                       subject_y: f'{subject_y} 総合得点率(%)'},
-                                trendline="ols",
-                                hover_data={'ID': True, subject_x: ':.1f', subject_y: ':.1f'}
-                            )
-                            
-                            # 平均線を追加（赤い破線）
-                            fig4.add_hline(y=mean_subject_y, line_dash="dash", line_color="red", line_width=2,
-                                          annotation_text=f"{subject_y}平均: {mean_subject_y:.1f}%",
-                                          annotation_position="right")
-                            fig4.add_vline(x=mean_subject_x, line_dash="dash", line_color="red", line_width=2,
-                                          annotation_text=f"{subject_x}平均: {mean_subject_x:.1f}%",
-                                          annotation_position="top")
-                            
-                            st.plotly_chart(fig4, use_container_width=True)
-                            
-                            corr = pivot_df[[subject_x, subject_y]].corr().iloc[0, 1]
-                            
-                            # 相関係数と平均値の情報を表示
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                st.metric("相関係数", f"{corr:.3f}")
-                            with col2:
-                                st.metric(f"{subject_x}平均", f"{mean_subject_x:.1f}%")
-                            with col3:
-                                st.metric(f"{subject_y}平均", f"{mean_subject_y:.1f}%")
-                
-                else:
-                    # 単一教科の場合
-                    st.info(f"データには1つの教科（{subjects[0]}）のみが含まれています。")
-                    st.markdown("複数教科のデータをアップロードすると、教科間の比較分析が可能になります。")
-                    
-                    # 単一教科でも基本統計は表示
-                    subject_stats = get_subject_stats(df)
-                    st.dataframe(subject_stats.round(2), use_container_width=True)
+            # 単一教科でも基本統計は表示
+            subject_stats = get_subject_stats(df, subject_aggregates, load_subject_cis(content_hash, filter_key, n_boot, df))
+            st.dataframe(subject_stats.round(2), use_container_width=True)
+            show_ci_caption(n_boot)
+    else:
+        st.warning("データにsubject列が見つかりません。")
+
+def render_item_analysis(df, responses, content_hash, filter_key, analysis_type, param_dict, label_dict,
+                         weights=None, points=None):
+    """項目分析（通過率・修正済み点双列相関・識別指数・α係数）を描画"""
+    st.markdown(f"### {analysis_type}の項目分析")
+    st.caption("通過率は小問の平均点÷満点（正誤の小問では正答率）です。"
+               "修正済み点双列相関と識別指数（上位27%と下位27%の通過率の差）はカテゴリの合計点（テスト設計の重み付き）を基準に計算しています。"
+               "α係数はカテゴリ内の小問の内的整合性を表し、項目削除時のα係数が元のα係数より高い小問はカテゴリとの整合性が低い可能性があります。")
+    item_stats, category_stats = load_item_analysis(content_hash, filter_key, analysis_type, df, responses, param_dict,
+                                                    weights, points)
+    if item_stats.empty:
+        st.warning("項目分析に使える小問がありません。")
+        return
+    
+    category_stats = category_stats.assign(カテゴリ=category_stats['カテゴリ'].map(label_dict))
+    st.markdown("**カテゴリ別の信頼性**")
+    st.dataframe(category_stats.round(3), use_container_width=True)
+    
+    item_stats = item_stats.assign(カテゴリ名=item_stats['カテゴリ'].map(label_dict))
+    discrimination_col = next(col for col in item_stats.columns if col.startswith('識別指数'))
+    fig = px.scatter(
+        item_stats,
+        x='通過率',
+        y=discrimination_col,
+        color='カテゴリ名',
+        hover_data=['問題', '修正済み点双列相関', '項目削除時のα'],
+        title=f'{analysis_type}の小問の通過率と識別指数'
+    )
+    fig.add_hline(y=ITEM_DISCRIMINATION_THRESHOLD, line_dash="dash", line_color="gray",
+                  annotation_text=f"識別指数 {ITEM_DISCRIMINATION_THRESHOLD}")
+    st.plotly_chart(fig, use_container_width=True)
+    
+    st.markdown("**小問別の項目分析**")
+    st.dataframe(item_stats.round(3), use_container_width=True)
+
+def render_question_tab(df, responses, blueprint, content_hash=None, filter_key=()):
+    """小問分析タブを描画
+    
+    content_hash を渡した場合は、行ごとの解答から項目分析も表示する
+    （分割集計の結果のように行を持たないデータでは渡さない）。
+    """
+    st.subheader("小問別正答率分析")
+    
+    # 分析タイプはテスト設計の軸（「能力別」「領域別」など）
+    analysis_types = {f"{axis_label}別": axis for axis, axis_label in blueprint.axes.items()}
+    analysis_type = st.radio("分析タイプ", list(analysis_types), key="question_analysis_type")
+    
+    axis = analysis_types[analysis_type]
+    param_dict = blueprint.param_dict(axis)
+    label_dict = blueprint.labels(axis)
+    
+    # 正答率データ取得
+    correct_rate_df = get_question_correct_rate(df, param_dict, responses, blueprint.max_points())
+    correct_rate_df['カテゴリ名'] = correct_rate_df['カテゴリ'].map(label_dict)
+    
+    # 棒グラフ
+    fig = px.bar(
+        correct_rate_df,
+        x='問題',
+        y='正答率(%)',
+        color='カテゴリ名',
+        title=f'{analysis_type}の小問別正答率',
+        hover_data=['正答者数', '受験者数', '無回答数']
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # カテゴリ別の平均正答率
+    st.markdown(f"### {analysis_type}の平均正答率")
+    category_avg = correct_rate_df.groupby('カテゴリ名')['正答率(%)'].mean().reset_index()
+    category_avg.columns = ['カテゴリ', '平均正答率(%)']
+    category_avg['平均正答率(%)'] = category_avg['平均正答率(%)'].round(2)
+    
+    fig2 = px.bar(
+        category_avg,
+        x='カテゴリ',
+        y='平均正答率(%)',
+        title=f'{analysis_type}の平均正答率',
+        text='平均正答率(%)'
+    )
+    fig2.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
+    st.plotly_chart(fig2, use_container_width=True)
+    
+    # 詳細データ
+    st.markdown("### 詳細データ")
+    st.dataframe(correct_rate_df.round(2), use_container_width=True)
+    
+    if content_hash is not None:
+        render_item_analysis(df, responses, content_hash, filter_key, analysis_type, param_dict, label_dict,
+                             blueprint.category_weights(axis), blueprint.max_points())
+
+def render_student_tab(df, content_hash, filter_key, cube, cube_where, sketches, blueprint):
+    """個別診断タブを描画"""
+    st.subheader("生徒別診断")
+    
+    # 生徒と教科の選択
+    col1, col2 = st.columns(2)
+    
+    student_index = load_student_index(content_hash, filter_key, df)
+    comparison_means = load_comparison_means(content_hash, filter_key, cube, cube_where)
+    
+    with col1:
+        students = student_index.ids
+        selected_student = st.selectbox("生徒を選択", students, key="student_id")
+    
+    with col2:
+        # 教科選択（複数教科がある場合）
+        if 'subject' in df.columns:
+            subjects_available = sorted(student_index.subjects)
+            if len(subjects_available) > 1:
+                selected_subject = st.selectbox("教科を選択", ['全教科'] + list(subjects_available), key="student_subject")
             else:
-                st.warning("データにsubject列が見つかりません。")
+                selected_subject = subjects_available[0]
+                st.info(f"教科: {selected_subject}")
+        else:
+            subjects_available = []
+            selected_subject = '全教科'
+    
+    # 索引から生徒の行を取得
+    if selected_subject == '全教科':
+        student_df_filtered = df.iloc[student_index.rows(selected_student)]
+    else:
+        student_row = student_index.row(selected_student, selected_subject)
+        student_df_filtered = df.iloc[[student_row] if student_row is not None else []]
+    comparison_summary = comparison_means.loc[selected_subject]  # クラス平均用
+    
+    if len(student_df_filtered) == 0:
+        st.warning("選択された条件に該当するデータがありません。")
+    else:
+        # 全教科の場合は平均を取る
+        if selected_subject == '全教科' and len(student_df_filtered) > 1:
+            student_data = student_df_filtered.mean(numeric_only=True)
+        else:
+            student_data = student_df_filtered.iloc[0]
         
-        # タブ5: 小問分析
-        with tab5:
-            st.subheader("小問別正答率分析")
-            
-            analysis_type = st.radio("分析タイプ", ["能力別", "領域別"])
-            
-            if analysis_type == "能力別":
-                param_dict = ABILITY_PARAMS
-                label_dict = ABILITY_LABELS
-            else:
-                param_dict = DOMAIN_PARAMS
-                label_dict = DOMAIN_LABELS
-            
-            # 正答率データ取得
-            correct_rate_df = get_question_correct_rate(df, param_dict)
-            correct_rate_df['カテゴリ名'] = correct_rate_df['カテゴリ'].map(label_dict)
-            
-            # 棒グラフ
-            fig = px.bar(
-                correct_rate_df,
-                x='問題',
-                y='正答率(%)',
-                color='カテゴリ名',
-                title=f'{analysis_type}の小問別正答率',
-                hover_data=['正答者数', '受験者数']
-            )
-            st.plotly_chart(fig, use_container_width=True)
-            
-            # カテゴリ別の平均正答率
-            st.markdown(f"### {analysis_type}の平均正答率")
-            category_avg = correct_rate_df.groupby('カテゴリ名')['正答率(%)'].mean().reset_index()
-            category_avg.columns = ['カテゴリ', '平均正答率(%)']
-            category_avg['平均正答率(%)'] = category_avg['平均正答率(%)'].round(2)
-            
-            fig2 = px.bar(
-                category_avg,
-                x='カテゴリ',
-                y='平均正答率(%)',
-                title=f'{analysis_type}の平均正答率',
-                text='平均正答率(%)'
-            )
-            fig2.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
-            st.plotly_chart(fig2, use_container_width=True)
-            
-            # 詳細データ
-            st.markdown("### 詳細データ")
-            st.dataframe(correct_rate_df.round(2), use_container_width=True)
+        # 絞り込み条件内での総合得点率の位置（分位点スケッチによる近似）
+        percentile_where = cube_where if selected_subject == '全教科' else {**cube_where, 'subject': [selected_subject]}
+        percentile = sketches.sketch('total_rate', percentile_where).rank(student_data['total_rate']) * 100
         
-        # タブ6: 個別診断
-        with tab6:
-            st.subheader("生徒別診断")
-            
-            # 生徒と教科の選択
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                students = sorted(df['ID'].unique())
-                selected_student = st.selectbox("生徒を選択", students)
-            
-            with col2:
-                # 教科選択（複数教科がある場合）
-                if 'subject' in df.columns:
-                    subjects_available = sorted(df['subject'].unique())
-                    if len(subjects_available) > 1:
-                        selected_subject = st.selectbox("教科を選択", ['全教科'] + list(subjects_available))
-                    else:
-                        selected_subject = subjects_available[0]
-                        st.info(f"教科: {selected_subject}")
-                else:
-                    selected_subject = '全教科'
-            
-            # データをフィルタリング
+        # 基本情報
+        col1, col2, col3, col4, col5 = st.columns(5)
+        with col1:
+            st.metric("ID", selected_student)
+        with col2:
+            st.metric("学年", int(student_df_filtered['grade'].iloc[0]))
+        with col3:
+            st.metric("クラス", student_df_filtered['class'].iloc[0])
+        with col4:
             if selected_subject == '全教科':
-                student_df_filtered = df[df['ID'] == selected_student]
-                comparison_df = df  # クラス平均用
+                st.metric("総合得点率（全教科平均）", f"{student_data['total_rate']:.1f}%")
             else:
-                student_df_filtered = df[(df['ID'] == selected_student) & (df['subject'] == selected_subject)]
-                comparison_df = df[df['subject'] == selected_subject]  # クラス平均用
-            
-            if len(student_df_filtered) == 0:
-                st.warning("選択された条件に該当するデータがありません。")
-            else:
-                # 全教科の場合は平均を取る
-                if selected_subject == '全教科' and len(student_df_filtered) > 1:
-                    student_data = student_df_filtered.mean(numeric_only=True)
-                else:
-                    student_data = student_df_filtered.iloc[0]
-                
-                # 基本情報
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("ID", selected_student)
-                with col2:
-                    st.metric("学年", int(student_data['grade']))
-                with col3:
-                    st.metric("クラス", student_df_filtered['class'].iloc[0])
-                with col4:
-                    if selected_subject == '全教科':
-                        st.metric("総合得点率（全教科平均）", f"{student_data['total_rate']:.1f}%")
-                    else:
-                        st.metric(f"総合得点率（{selected_subject}）", f"{student_data['total_rate']:.1f}%")
-                
-                # 教科別の得点表示（全教科選択時）
-                if selected_subject == '全教科' and len(student_df_filtered) > 1:
-                    st.markdown("### 教科別総合得点率")
-                    subject_scores = student_df_filtered[['subject', 'total_rate']].copy()
-                    subject_scores.columns = ['教科', '総合得点率(%)']
-                    st.dataframe(subject_scores, use_container_width=True)
-                
-                # レーダーチャート（能力）
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.markdown("### 能力別プロファイル")
-                    
-                    abilities = []
-                    student_scores = []
-                    class_avg_scores = []
-                    
-                    for ability, label in ABILITY_LABELS.items():
-                        rate_col = f'{ability}_rate'
-                        if rate_col in df.columns:
-                            abilities.append(label)
-                            student_scores.append(student_data[rate_col])
-                            class_avg_scores.append(comparison_df[rate_col].mean())
-                    
-                    fig = go.Figure()
-                    
-                    fig.add_trace(go.Scatterpolar(
-                        r=student_scores,
-                        theta=abilities,
-                        fill='toself',
-                        name=f'{selected_student} ({selected_subject})',
-                        line=dict(color='blue')
-                    ))
-                    
-                    fig.add_trace(go.Scatterpolar(
-                        r=class_avg_scores,
-                        theta=abilities,
-                        fill='toself',
-                        name=f'クラス平均 ({selected_subject})',
-                        line=dict(color='red', dash='dash')
-                    ))
-                    
-                    fig.update_layout(
-                        polar=dict(radialaxis=dict(visible=True, range=[0, 100])),
-                        showlegend=True
-                    )
-                    
-                    st.plotly_chart(fig, use_container_width=True)
-                
-                with col2:
-                    st.markdown("### 領域別プロファイル")
-                    
-                    domains = []
-                    student_scores_d = []
-                    class_avg_scores_d = []
-                    
-                    for domain, label in DOMAIN_LABELS.items():
-                        rate_col = f'{domain}_rate'
-                        if rate_col in df.columns:
-                            domains.append(label)
-                            student_scores_d.append(student_data[rate_col])
-                            class_avg_scores_d.append(comparison_df[rate_col].mean())
-                    
-                    fig2 = go.Figure()
-                    
-                    fig2.add_trace(go.Scatterpolar(
-                        r=student_scores_d,
-                        theta=domains,
-                        fill='toself',
-                        name=f'{selected_student} ({selected_subject})',
-                        line=dict(color='green')
-                    ))
-                    
-                    fig2.add_trace(go.Scatterpolar(
-                        r=class_avg_scores_d,
-                        theta=domains,
-                        fill='toself',
-                        name=f'クラス平均 ({selected_subject})',
-                        line=dict(color='red', dash='dash')
-                    ))
-                    
-                    fig2.update_layout(
-                        polar=dict(radialaxis=dict(visible=True, range=[0, 100])),
-                        showlegend=True
-                    )
-                    
-                    st.plotly_chart(fig2, use_container_width=True)
-                
-                # 強み・弱みの分析
-                st.markdown("### 強み・弱みの分析")
-                
-                # 能力別
-                ability_data = []
-                for ability, label in ABILITY_LABELS.items():
-                    rate_col = f'{ability}_rate'
-                    if rate_col in df.columns:
-                        student_rate = student_data[rate_col]
-                        class_avg = comparison_df[rate_col].mean()
-                        diff = student_rate - class_avg
-                        ability_data.append({
-                            'カテゴリ': label,
-                            '生徒得点率(%)': student_rate,
-                            'クラス平均(%)': class_avg,
-                            '差分': diff
-                        })
-                
-                ability_analysis_df = pd.DataFrame(ability_data)
-                ability_analysis_df = ability_analysis_df.sort_values('差分', ascending=False)
-                
-                st.markdown(f"**能力別比較（{selected_subject}）**")
-                st.dataframe(ability_analysis_df.round(2), use_container_width=True)
-                
-                # 領域別
-                domain_data = []
-                for domain, label in DOMAIN_LABELS.items():
-                    rate_col = f'{domain}_rate'
-                    if rate_col in df.columns:
-                        student_rate = student_data[rate_col]
-                        class_avg = comparison_df[rate_col].mean()
-                        diff = student_rate - class_avg
-                        domain_data.append({
-                            'カテゴリ': label,
-                            '生徒得点率(%)': student_rate,
-                            'クラス平均(%)': class_avg,
-                            '差分': diff
-                        })
-                
-                domain_analysis_df = pd.DataFrame(domain_data)
-                domain_analysis_df = domain_analysis_df.sort_values('差分', ascending=False)
-                
-                st.markdown(f"**領域別比較（{selected_subject}）**")
-                st.dataframe(domain_analysis_df.round(2), use_container_width=True)
-                
-                # 教科別の強み・弱み（全教科選択時）
-                if selected_subject == '全教科' and len(subjects_available) > 1:
-                    st.markdown("### 教科別パフォーマンス")
-                    
-                    subject_performance = []
-                    for subj in subjects_available:
-                        subj_student_df = df[(df['ID'] == selected_student) & (df['subject'] == subj)]
-                        subj_class_df = df[df['subject'] == subj]
-                        
-                        if len(subj_student_df) > 0:
-                            student_rate = subj_student_df['total_rate'].iloc[0]
-                            class_avg = subj_class_df['total_rate'].mean()
-                            diff = student_rate - class_avg
-                            
-                            subject_performance.append({
-                                '教科': subj,
-                                '生徒得点率(%)': student_rate,
-                                'クラス平均(%)': class_avg,
-                                '差分': diff
-                            })
-                    
-                    subject_performance_df = pd.DataFrame(subject_performance)
-                    subject_performance_df = subject_performance_df.sort_values('差分', ascending=False)
-                    
-                    st.dataframe(subject_performance_df.round(2), use_container_width=True)
-                    
-                    # 教科別レーダーチャート
-                    fig3 = go.Figure()
-                    
-                    fig3.add_trace(go.Scatterpolar(
-                        r=subject_performance_df['生徒得点率(%)'].tolist(),
-                        theta=subject_performance_df['教科'].tolist(),
-                        fill='toself',
-                        name=selected_student,
-                        line=dict(color='purple')
-                    ))
-                    
-                    fig3.add_trace(go.Scatterpolar(
-                        r=subject_performance_df['クラス平均(%)'].tolist(),
-                        theta=subject_performance_df['教科'].tolist(),
-                        fill='toself',
-                        name='クラス平均',
-                        line=dict(color='red', dash='dash')
-                    ))
-                    
-                    fig3.update_layout(
-                        polar=dict(radialaxis=dict(visible=True, range=[0, 100])),
-                        showlegend=True,
-                        title='教科別総合得点率'
-                    )
-                    
-                    st.plotly_chart(fig3, use_container_width=True)
+                st.metric(f"総合得点率（{selected_subject}）", f"{student_data['total_rate']:.1f}%")
+        with col5:
+            st.metric("パーセンタイル順位", f"{percentile:.0f}",
+                      help="絞り込み条件内で総合得点率がこの生徒以下の割合（%）")
         
-        # タブ7: 総合ダッシュボード
-        with tab7:
-            st.subheader("総合ダッシュボード")
-            
-            # ヒートマップ（生徒×能力）
-            st.markdown("### 生徒別・能力別得点率ヒートマップ")
-            
-            ability_rate_cols = [f'{ability}_rate' for ability in ABILITY_PARAMS.keys() if f'{ability}_rate' in df.columns]
-            
-            if ability_rate_cols:
-                heatmap_df = df[['ID'] + ability_rate_cols].copy()
-                # 重複IDの処理：各生徒のデータを集約（平均）
-                heatmap_df = heatmap_df.groupby('ID', as_index=False).mean()
-                heatmap_df.columns = ['ID'] + [ABILITY_LABELS.get(col.replace('_rate', ''), col) for col in ability_rate_cols]
-                heatmap_df = heatmap_df.set_index('ID')
-                
-                fig = px.imshow(
-                    heatmap_df.T,
-                    labels=dict(x="生徒ID", y="能力", color="得点率(%)"),
-                    x=heatmap_df.index,
-                    y=heatmap_df.columns,
-                    color_continuous_scale='RdYlGn',
-                    aspect='auto',
-                    title='生徒別・能力別得点率ヒートマップ'
-                )
+        # 教科別の得点表示（全教科選択時）
+        if selected_subject == '全教科' and len(student_df_filtered) > 1:
+            st.markdown("### 教科別総合得点率")
+            subject_scores = student_df_filtered[['subject', 'total_rate']].copy()
+            subject_scores.columns = ['教科', '総合得点率(%)']
+            st.dataframe(subject_scores, use_container_width=True)
+        
+        # レーダーチャート（テスト設計の軸ごと、2列に並べる）
+        columns = st.columns(2)
+        
+        for i, (axis, axis_label) in enumerate(blueprint.axes.items()):
+            with columns[i % 2]:
+                st.markdown(f"### {axis_label}別プロファイル")
+                categories, student_scores, class_avg_scores = get_category_profile(
+                    student_data, comparison_summary, blueprint.labels(axis))
+                fig = make_profile_radar_figure(
+                    categories, student_scores, class_avg_scores,
+                    f'{selected_student} ({selected_subject})', f'クラス平均 ({selected_subject})',
+                    AXIS_RADAR_COLORS[i % len(AXIS_RADAR_COLORS)])
                 st.plotly_chart(fig, use_container_width=True)
+        
+        # 強み・弱みの分析
+        st.markdown("### 強み・弱みの分析")
+        
+        for axis, axis_label in blueprint.axes.items():
+            analysis_df = get_category_comparison(student_data, comparison_summary, blueprint.labels(axis))
             
-            # ヒートマップ（生徒×領域）
-            st.markdown("### 生徒別・領域別得点率ヒートマップ")
-            
-            domain_rate_cols = [f'{domain}_rate' for domain in DOMAIN_PARAMS.keys() if f'{domain}_rate' in df.columns]
-            
-            if domain_rate_cols:
-                heatmap_df2 = df[['ID'] + domain_rate_cols].copy()
-                # 重複IDの処理：各生徒のデータを集約（平均）
-                heatmap_df2 = heatmap_df2.groupby('ID', as_index=False).mean()
-                heatmap_df2.columns = ['ID'] + [DOMAIN_LABELS.get(col.replace('_rate', ''), col) for col in domain_rate_cols]
-                heatmap_df2 = heatmap_df2.set_index('ID')
-                
-                fig2 = px.imshow(
-                    heatmap_df2.T,
-                    labels=dict(x="生徒ID", y="領域", color="得点率(%)"),
-                    x=heatmap_df2.index,
-                    y=heatmap_df2.columns,
-                    color_continuous_scale='RdYlGn',
-                    aspect='auto',
-                    title='生徒別・領域別得点率ヒートマップ'
-                )
-                st.plotly_chart(fig2, use_container_width=True)
-            
-            # 能力×領域のクロス分析
-            st.markdown("### 能力×領域のクロス分析")
-            
-            col1, col2 = st.columns(2)
-            with col1:
-                selected_ability = st.selectbox("能力を選択", list(ABILITY_LABELS.keys()), format_func=lambda x: ABILITY_LABELS[x])
-            with col2:
-                selected_domain = st.selectbox("領域を選択", list(DOMAIN_LABELS.keys()), format_func=lambda x: DOMAIN_LABELS[x])
+            st.markdown(f"**{axis_label}別比較（{selected_subject}）**")
+            st.dataframe(analysis_df.round(2), use_container_width=True)
+        
+        # 教科別の強み・弱み（全教科選択時）
+        if selected_subject == '全教科' and len(subjects_available) > 1:
+            st.markdown("### 教科別パフォーマンス")
             
-            ability_col = f'{selected_ability}_rate'
-            domain_col = f'{selected_domain}_rate'
+            subject_performance_df = get_subject_performance(student_df_filtered, comparison_means)
+            st.dataframe(subject_performance_df.round(2), use_container_width=True)
             
-            if ability_col in df.columns and domain_col in df.columns:
-                # 平均値の計算
-                mean_ability = df[ability_col].mean()
-                mean_domain = df[domain_col].mean()
-                
-                # 散布図作成（IDをホバー表示に追加）
-                fig3 = px.scatter(
-                    df,
-                    x=ability_col,
-                    y=domain_col,
-                    title=f'{ABILITY_LABELS[selected_ability]} vs {DOMAIN_LABELS[selected_domain]}',
-                    labels={ability_col: f'{ABILITY_LABELS[selected_ability]}得点率(%)', 
-                           domain_col: f'{DOMAIN_LABELS[selected_domain]}得点率(%)'},
-                    trendline="ols",
-                    hover_data={'ID': True, ability_col: ':.1f', domain_col: ':.1f'}
-                )
-                
-                # 平均線を追加（赤い破線）
-                fig3.add_hline(y=mean_domain, line_dash="dash", line_color="red", line_width=2,
-                              annotation_text=f"領域平均: {mean_domain:.1f}%",
-                              annotation_position="right")
-                fig3.add_vline(x=mean_ability, line_dash="dash", line_color="red", line_width=2,
-                              annotation_text=f"能力平均: {mean_ability:.1f}%",
-                              annotation_position="top")
-                
-                st.plotly_chart(fig3, use_container_width=True)
-                
-                corr = df[[ability_col, domain_col]].corr().iloc[0, 1]
-                
-                # 相関係数と平均値の情報を表示
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("相関係数", f"{corr:.3f}")
-                with col2:
-                    st.metric(f"能力平均 ({ABILITY_LABELS[selected_ability]})", f"{mean_ability:.1f}%")
-                with col3:
-                    st.metric(f"領域平均 ({DOMAIN_LABELS[selected_domain]})", f"{mean_domain:.1f}%")
+            # 教科別レーダーチャート
+            fig3 = make_profile_radar_figure(
+                subject_performance_df['教科'], subject_performance_df['生徒得点率(%)'],
+                subject_performance_df['クラス平均(%)'], selected_student, 'クラス平均', 'purple',
+                title='教科別総合得点率')
+            st.plotly_chart(fig3, use_container_width=True)
+
+def render_overview_tab(df, responses, content_hash, filter_key, cube, cube_where, blueprint, n_boot=None):
+    """総合ダッシュボードタブを描画"""
+    st.subheader("総合ダッシュボード")
+    
+    rate_cols = [col for axis in blueprint.axes for col in get_axis_rate_cols(blueprint, axis, df.columns)]
+    
+    # ヒートマップの表示設定（描画する列数は人数によらず上限まで）
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        heatmap_unit = st.radio("表示単位", ["生徒", "クラス平均"], horizontal=True, key="heatmap_unit")
+    
+    if heatmap_unit == "クラス平均":
+        heatmap_profiles = get_class_mean_profiles(cube, cube_where, rate_cols)
+        unit_name = "クラス"
+        unit_label = "クラス"
+    else:
+        profiles, similarity_order = load_student_profiles(
+            content_hash, filter_key, tuple(rate_cols), df)
+        with col2:
+            heatmap_order = st.selectbox("並び順", ["ID順", "類似度順（クラスタ）"], key="heatmap_order")
+        with col3:
+            st.session_state.setdefault("heatmap_page_size", HEATMAP_PAGE_SIZES[1])
+            page_size = st.selectbox("1ページの人数", HEATMAP_PAGE_SIZES, key="heatmap_page_size")
+        
+        if heatmap_order != "ID順":
+            profiles = profiles.iloc[similarity_order]
+        if page_size != '全員' and len(profiles) > page_size:
+            n_pages = (len(profiles) + page_size - 1) // page_size
+            if st.session_state.get("heatmap_page", 1) > n_pages:
+                st.session_state["heatmap_page"] = n_pages
+            page = st.number_input(f"ページ（全{n_pages}ページ）", min_value=1, max_value=n_pages,
+                                   key="heatmap_page")
+            profiles = profiles.iloc[(page - 1) * page_size:page * page_size]
+        
+        # 画面幅を超える人数は隣接する生徒を平均してまとめる
+        heatmap_profiles = downsample_rows(profiles)
+        if len(heatmap_profiles) < len(profiles):
+            st.caption(f"{len(profiles):,}人を{len(heatmap_profiles)}列にまとめて表示しています（隣接する生徒の平均）")
+        unit_name = "生徒"
+        unit_label = "生徒ID"
+    
+    render_category_heatmaps(heatmap_profiles, blueprint, unit_name, unit_label)
+    
+    # 相関行列
+    st.markdown("### 相関行列")
+    
+    render_correlation_matrix(df, responses, content_hash, filter_key, blueprint)
+    
+    # 能力×領域のクロス分析（テスト設計の最初の2つの軸）
+    if len(blueprint.axes) >= 2:
+        row_axis, col_axis = list(blueprint.axes)[:2]
+        st.markdown(f"### {blueprint.axes[row_axis]}×{blueprint.axes[col_axis]}のクロス分析")
+        
+        render_cross_correlation(df, content_hash, filter_key, blueprint, row_axis, col_axis, n_boot)
+
+def render_filter_sidebar(values):
+    """サイドバーに絞り込みの選択欄を描画し、条件（{列: 選択した値のリスト}）を返す"""
+    with st.sidebar:
+        st.markdown("---")
+        st.markdown("### 🔍 絞り込み")
+        filters = {}
+        for dim, options in values.items():
+            filters[dim] = st.multiselect(
+                FILTER_LABELS.get(dim, dim),
+                options=options,
+                placeholder="すべて",
+                key=f"filter_{dim}"
+            )
+    return filters
+
+def show_filter_caption(filter_key):
+    """適用中の絞り込み条件を表示"""
+    if filter_key:
+        st.caption("絞り込み: " + " / ".join(
+            f"{FILTER_LABELS.get(dim, dim)} {', '.join(map(str, selected))}" for dim, selected in filter_key))
+
+def render_full_view(content_hash, uploaded_file, blueprint, n_boot=None):
+    """全行を読み込んだデータで全タブを描画
+    
+    blueprint（テスト設計）の軸ごとに分析タブを作る。
+    n_boot を指定すると、平均と相関係数にその回数のブートストラップによる信頼区間を表示する。
+    """
+    # データ読み込み・得点計算（ファイル内容のハッシュでキャッシュ）
+    full_df, full_responses = load_scored_data(content_hash, uploaded_file.getvalue(), blueprint)
+    filter_index = load_filter_index(content_hash, full_df)
+
+    # 絞り込み（全タブに適用）
+    filters = render_filter_sidebar(filter_index.values)
+    filter_key = make_filter_key(filters)
+    # 集計キューブの条件（選択がない列は条件に含めない）
+    cube_where = {dim: list(selected) for dim, selected in filter_key}
+
+    df, responses = load_filtered_data(content_hash, filter_key, full_df, full_responses, filter_index)
+    if len(df) == 0:
+        st.warning("絞り込み条件に該当するデータがありません。条件を変更してください。")
+        return
+
+    cube = load_aggregate_cube(content_hash, full_df)
+    sketches = load_group_sketches(content_hash, full_df)
+    overall_summary = cube.summary(cube_where)
+    show_filter_caption(filter_key)
+
+    # タブで機能を分割（選択中のタブだけを計算・描画し、他のタブの計算結果はキャッシュに残す）
+    keep_widget_state(get_persistent_widget_keys(blueprint))
+    data_tab, *axis_tabs, subject_tab, question_tab, student_tab, overview_tab = st.tabs([
+        "📄 データ確認", 
+        *get_axis_tab_labels(blueprint),
+        "📚 教科別分析",
+        "✓ 小問分析", 
+        "👤 個別診断",
+        "📊 総合ダッシュボード"
+    ], key="active_tab", on_change="rerun")
+
+    # データ確認
+    with data_tab:
+        if data_tab.open:
+            render_data_tab(df, responses)
+
+    # 能力別・領域別など（テスト設計の軸ごと）の分析
+    for axis, axis_tab in zip(blueprint.axes, axis_tabs):
+        with axis_tab:
+            if axis_tab.open:
+                render_axis_tab(df, content_hash, filter_key, overall_summary, sketches, cube_where,
+                                full_df, full_responses, blueprint, axis, n_boot)
+
+    # 教科別分析
+    with subject_tab:
+        if subject_tab.open:
+            render_subject_tab(df, content_hash, filter_key, cube, cube_where, sketches, blueprint, n_boot)
+
+    # 小問分析
+    with question_tab:
+        if question_tab.open:
+            render_question_tab(df, responses, blueprint, content_hash, filter_key)
+
+    # 個別診断
+    with student_tab:
+        if student_tab.open:
+            render_student_tab(df, content_hash, filter_key, cube, cube_where, sketches, blueprint)
+
+    # 総合ダッシュボード
+    with overview_tab:
+        if overview_tab.open:
+            render_overview_tab(df, responses, content_hash, filter_key, cube, cube_where, blueprint, n_boot)
+
+def render_streaming_category_tab(aggregates, axis):
+    """分割集計の結果から能力別・領域別（テスト設計の軸ごと）の分析タブを描画"""
+    labels = aggregates.blueprint.labels(axis)
+    category_name = aggregates.blueprint.axes[axis]
+    st.subheader(f"{category_name}別統計量")
+    
+    summary = aggregates.summary()
+    category_stats = get_category_stats(None, labels, category_name, summary)
+    st.dataframe(category_stats.round(2), use_container_width=True)
+    
+    # 得点率の分布（四分位数・度数は分位点スケッチから求める）
+    st.markdown(f"### {category_name}別得点率の分布")
+    
+    rate_cols = get_axis_rate_cols(aggregates.blueprint, axis, aggregates.value_cols)
+    if rate_cols:
+        summaries = {
+            labels.get(col.replace('_rate', ''), col): summarize_sketch(aggregates.sketch(col), summary.at[col, 'mean'])
+            for col in rate_cols
+        }
+        fig = make_summary_box_figure(summaries, category_name, '得点率(%)', f'{category_name}別得点率の分布')
+        st.plotly_chart(fig, use_container_width=True)
+        
+        fig2 = make_summary_histogram_figure(summaries, category_name, '得点率(%)', f'{category_name}別得点率のヒストグラム')
+        st.plotly_chart(fig2, use_container_width=True)
+    
+    st.info("分割集計モードでは生徒ごとの散布図は表示されません。")
+
+def render_streaming_subject_tab(aggregates):
+    """分割集計の結果から教科別分析タブを描画"""
+    st.subheader("教科別統計量")
+    
+    subject_aggregates = aggregates.group_aggregates('subject')
+    if subject_aggregates.empty:
+        st.warning("データにsubject列が見つかりません。")
+        return
+    
+    st.dataframe(get_subject_stats(None, subject_aggregates).round(2), use_container_width=True)
+    
+    # 教科別総合得点率の比較
+    st.markdown("### 教科別総合得点率の比較")
+    
+    subject_summaries = {
+        subject: summarize_sketch(aggregates.sketch('total_rate', {'subject': [subject]}),
+                                  subject_aggregates.at[subject, ('total_rate', 'mean')])
+        for subject in subject_aggregates.index
+    }
+    fig = make_summary_box_figure(subject_summaries, '教科', '総合得点率(%)', '教科別総合得点率の分布')
+    st.plotly_chart(fig, use_container_width=True)
+    
+    if len(subject_aggregates) > 1:
+        render_subject_category_heatmaps(subject_aggregates, aggregates.blueprint)
+
+def render_streaming_overview_tab(aggregates):
+    """分割集計の結果から総合ダッシュボードタブを描画（クラス平均のみ）"""
+    st.subheader("総合ダッシュボード")
+    
+    blueprint = aggregates.blueprint
+    rate_cols = [col for axis in blueprint.axes for col in get_axis_rate_cols(blueprint, axis, aggregates.value_cols)]
+    
+    if 'grade' in aggregates.dims and 'class' in aggregates.dims:
+        heatmap_profiles = get_class_mean_profiles(aggregates.cube, None, rate_cols)
+        render_category_heatmaps(heatmap_profiles, blueprint, "クラス", "クラス")
+    else:
+        st.warning("データにgrade列・class列が見つかりません。")
+
+def render_streaming_view(content_hash, uploaded_file, blueprint):
+    """分割集計の結果だけで集計系のタブを描画（生徒の行は保持しない）"""
+    aggregates = load_streaming_aggregates(content_hash, uploaded_file.getvalue(), blueprint)
+    
+    # 絞り込み（集計のセル単位で適用）
+    filters = render_filter_sidebar({dim: aggregates.values(dim) for dim in aggregates.dims})
+    filter_key = make_filter_key(filters)
+    selected = aggregates.subset({dim: list(values) for dim, values in filter_key})
+    if selected.n_rows == 0:
+        st.warning("絞り込み条件に該当するデータがありません。条件を変更してください。")
+        return
+    
+    st.caption(f"分割集計モード: {aggregates.n_rows:,}行を集計（生徒ごとの表示はありません）")
+    show_filter_caption(filter_key)
+    render_aggregate_tabs(selected, blueprint)
+
+def render_sql_view(dataset_key, dataset_version, sql_backend, blueprint):
+    """データベースに格納したデータセットの集計系のタブを描画（集計はデータベース側で行う）"""
+    dataset = load_sql_dataset(dataset_key, dataset_version, sql_backend, blueprint)
+    
+    # 絞り込み（データベースの問い合わせの条件に加える）
+    filters = render_filter_sidebar({dim: dataset.values(dim) for dim in dataset.dims})
+    filter_key = make_filter_key(filters)
+    selected = load_sql_selection(dataset_key, dataset_version, filter_key, dataset)
+    if selected.n_rows == 0:
+        st.warning("絞り込み条件に該当するデータがありません。条件を変更してください。")
+        return
+    
+    st.caption(f"データベース集計モード: {dataset.n_rows:,}行をデータベースで集計（生徒ごとの表示はありません）")
+    show_filter_caption(filter_key)
+    render_aggregate_tabs(selected, blueprint)
+
+def render_aggregate_tabs(selected, blueprint):
+    """集計結果（StreamingAggregates・SqlDataset）だけで集計系のタブを描画"""
+    keep_widget_state(get_persistent_widget_keys(blueprint))
+    *axis_tabs, subject_tab, question_tab, overview_tab = st.tabs([
+        *get_axis_tab_labels(blueprint),
+        "📚 教科別分析",
+        "✓ 小問分析",
+        "📊 総合ダッシュボード"
+    ], key="streaming_tab", on_change="rerun")
+    
+    for axis, axis_tab in zip(blueprint.axes, axis_tabs):
+        with axis_tab:
+            if axis_tab.open:
+                render_streaming_category_tab(selected, axis)
+    
+    with subject_tab:
+        if subject_tab.open:
+            render_streaming_subject_tab(selected)
+    
+    with question_tab:
+        if question_tab.open:
+            # 正答者数は集計結果から取得（ResponseStore と同じ item_correct_counts / n_rows を持つ）
+            render_question_tab(pd.DataFrame(), selected, blueprint)
+    
+    with overview_tab:
+        if overview_tab.open:
+            render_streaming_overview_tab(selected)
+
+def select_trajectory_axis(trajectory, key):
+    """推移のグラフに表示する軸を選び、総合とその軸のカテゴリの行を返す"""
+    axis_labels = list(dict.fromkeys(trajectory['axis_label'].dropna()))
+    if not axis_labels:
+        return trajectory[trajectory['category'] == TOTAL_CATEGORY]
+    axis_label = st.radio("表示する軸", axis_labels, horizontal=True, key=key)
+    return trajectory[(trajectory['category'] == TOTAL_CATEGORY) | (trajectory['axis_label'] == axis_label)]
+
+def make_trajectory_figure(data, value_col, title):
+    """試験回ごとの得点率の推移の折れ線グラフ（x: 試験回, 色: カテゴリ）"""
+    fig = px.line(
+        data, x='name', y=value_col, color='label', markers=True,
+        title=title,
+        labels={'name': '試験回', value_col: '得点率(%)', 'label': 'カテゴリ'}
+    )
+    fig.update_xaxes(type='category')
+    fig.update_layout(yaxis_range=[0, 100])
+    return fig
+
+def render_student_trajectory(store, store_version):
+    """経年データから生徒の試験回ごとの得点率の推移を描画"""
+    student_id = st.text_input("生徒ID", key="trajectory_student_id", placeholder="例: S00001").strip()
+    if not student_id:
+        st.info("生徒IDを入力してください。")
+        return
+    
+    trajectory = load_student_trajectory(store_version, student_id, store)
+    if trajectory.empty:
+        st.warning(f"生徒ID {student_id} のデータが経年データにありません。")
+        return
+    
+    subjects = sorted(trajectory['subject'].unique())
+    if len(subjects) > 1:
+        selected_subject = st.selectbox("教科を選択", ['全教科'] + subjects, key="trajectory_student_subject")
+    else:
+        selected_subject = subjects[0]
+    
+    # 全教科の場合は試験回ごとに教科の平均を取る
+    if selected_subject == '全教科':
+        data = trajectory.groupby(['session_id', 'name', 'category', 'axis_label', 'label'], sort=False,
+                                  dropna=False)['rate'].mean().reset_index()
+    else:
+        data = trajectory[trajectory['subject'] == selected_subject]
+    
+    # 試験回ごとの学年・クラス
+    placements = trajectory.drop_duplicates('session_id')
+    st.caption(" → ".join(f"{name}: {grade}年 {class_name}" for name, grade, class_name
+                          in zip(placements['name'], placements['grade'], placements['class'])))
+    
+    data = select_trajectory_axis(data, "trajectory_student_axis")
+    st.plotly_chart(make_trajectory_figure(data, 'rate', f"{student_id} の得点率の推移（{selected_subject}）"),
+                    use_container_width=True)
+    
+    table = data.pivot_table(index='label', columns='name', values='rate', sort=False)
+    st.dataframe(table[list(dict.fromkeys(data['name']))].round(1), use_container_width=True)
+
+def render_class_trajectory(store, store_version):
+    """経年データからクラス・学年の試験回ごとの平均得点率の推移を描画（セルの集計値から求める）"""
+    classes, subjects = load_store_classes(store_version, store)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        grades = list(dict.fromkeys(classes['grade']))
+        selected_grade = st.selectbox("学年", ['全学年'] + grades, key="trajectory_grade")
+    with col2:
+        grade_classes = classes if selected_grade == '全学年' else classes[classes['grade'] == selected_grade]
+        class_options = list(dict.fromkeys(grade_classes['class']))
+        selected_class = st.selectbox("クラス", ['全クラス'] + class_options, key="trajectory_class")
+    with col3:
+        selected_subject = st.selectbox("教科", ['全教科'] + subjects, key="trajectory_subject")
+    
+    where = {}
+    if selected_grade != '全学年':
+        where['grade'] = [selected_grade]
+    if selected_class != '全クラス':
+        where['class'] = [selected_class]
+    if selected_subject != '全教科':
+        where['subject'] = [selected_subject]
+    where_key = tuple((dim, tuple(values)) for dim, values in where.items())
+    
+    trajectory = load_group_trajectory(store_version, where_key, (), store)
+    if trajectory.empty:
+        st.warning("選択された条件に該当するデータがありません。")
+        return
+    
+    group_label = " ".join([
+        '全学年' if selected_grade == '全学年' else f"{selected_grade}年",
+        selected_class, selected_subject
+    ])
+    data = select_trajectory_axis(trajectory, "trajectory_axis")
+    st.plotly_chart(make_trajectory_figure(data, 'mean', f"{group_label} の平均得点率の推移"),
+                    use_container_width=True)
+    
+    table = data.rename(columns={
+        'name': '試験回', 'label': 'カテゴリ', 'n': '人数', 'mean': '平均', 'std': '標準偏差',
+        'min': '最小', 'max': '最大'
+    })[['試験回', 'カテゴリ', '人数', '平均', '標準偏差', '最小', '最大']]
+    st.dataframe(table.round(2), use_container_width=True, hide_index=True)
+    
+    # 学年を選んだ場合はクラスごとの総合得点率を比較
+    if selected_grade != '全学年' and selected_class == '全クラス' and len(class_options) > 1:
+        st.markdown("### クラス別の総合得点率の推移")
+        by_class = load_group_trajectory(store_version, where_key, ('class',), store)
+        by_class = by_class[by_class['category'] == TOTAL_CATEGORY]
+        fig = px.line(
+            by_class, x='name', y='mean', color='class', markers=True,
+            title=f"{selected_grade}年 クラス別の平均総合得点率（{selected_subject}）",
+            labels={'name': '試験回', 'mean': '平均総合得点率(%)', 'class': 'クラス'}
+        )
+        fig.update_xaxes(type='category')
+        st.plotly_chart(fig, use_container_width=True)
+
+def render_trajectory_view(store):
+    """経年データの格納庫から生徒・クラスの試験回ごとの推移を描画（アップロードしたファイルは使わない）"""
+    sessions = store.sessions()
+    if sessions.empty:
+        st.info("経年データがまだありません。サイドバーの「経年データ」でファイルを試験回に追加してください。")
+        return
+    
+    store_version = store.version()
+    st.caption(f"経年データ: {len(sessions)}回・{int(sessions['n_rows'].sum()):,}行")
+    with st.expander("試験回の一覧"):
+        st.dataframe(sessions.rename(columns={
+            'name': '試験回', 'created_at': '追加日時', 'n_files': 'ファイル数', 'n_rows': '行数'
+        }).drop(columns='session_id'), use_container_width=True, hide_index=True)
+    
+    keep_widget_state(PERSISTENT_WIDGET_KEYS)
+    student_tab, class_tab = st.tabs(["👤 生徒の推移", "🏫 クラスの推移"], key="trajectory_tab", on_change="rerun")
+    
+    with student_tab:
+        if student_tab.open:
+            render_student_trajectory(store, store_version)
+    
+    with class_tab:
+        if class_tab.open:
+            render_class_trajectory(store, store_version)
+
+# タイトル
+st.title("📊 学力データ分析ダッシュボード（拡張版）")
+st.markdown("**能力・領域パラメータに基づく多角的分析**")
+st.markdown("---")
+
+# サイドバー
+with st.sidebar:
+    st.header("📁 データアップロード")
+    uploaded_file = st.file_uploader(
+        "CSV・Parquet・Arrowファイルを選択してください",
+        type=['csv', 'parquet', 'arrow', 'feather', 'ipc'],
+        help="ID, grade, class, subject, x1-x32の列を含むCSV・Parquet・Arrow IPCファイル"
+    )
+    blueprint_file = st.file_uploader(
+        "テスト設計ファイル（任意）",
+        type=[ext.lstrip('.') for ext in BLUEPRINT_FORMATS],
+        help="小問の列名・配点と、能力・領域などの軸ごとのカテゴリへの対応（重み）を定義したYAML・JSON・CSVファイル。"
+             "指定しない場合は既定の能力・領域パラメータ（x1-x32）で採点します。"
+    )
+    streaming_mode = st.checkbox(
+        "大容量ファイルを分割して集計する",
+        key="streaming_mode",
+        help="ファイルを一定の大きさごとに読み込み、集計値だけを保持します。生徒ごとの表示（散布図・個別診断など）は使えません。"
+    )
+    show_ci = st.checkbox(
+        "平均・相関係数の信頼区間を表示する",
+        key="show_ci",
+        help="ブートストラップ法で統計量の表の平均得点率と相関係数の信頼区間を求めます（分割集計では使えません）。"
+    )
+    ci_replicates = st.selectbox(
+        "ブートストラップの反復回数",
+        CI_REPLICATE_OPTIONS,
+        index=CI_REPLICATE_OPTIONS.index(DEFAULT_REPLICATES),
+        key="ci_replicates",
+        disabled=not show_ci
+    )
+    
+    # テスト設計の読み込み（指定がない場合は既定の能力・領域パラメータ）
+    blueprint = DEFAULT_BLUEPRINT
+    blueprint_hash = None
+    if blueprint_file is not None:
+        try:
+            blueprint_hash = compute_content_hash(blueprint_file.getvalue())
+            blueprint = load_test_blueprint(blueprint_hash, blueprint_file.name, blueprint_file.getvalue())
+        except ValueError as e:
+            st.error(f"テスト設計を読み込めません: {e}")
+            st.stop()
+    
+    # 経年データ（格納庫のファイルが設定されている場合のみ）
+    session_store = load_session_store(SESSION_STORE_PATH) if SESSION_STORE_PATH else None
+    trajectory_mode = False
+    if session_store is not None:
+        st.markdown("---")
+        st.markdown("### 🗂 経年データ")
+        session_name = st.text_input("試験回の名前", key="session_name", placeholder="例: 2025年度1学期").strip()
+        if st.button("アップロードしたファイルを追加", disabled=uploaded_file is None or not session_name,
+                     help="ファイルを採点して試験回の経年データに追加します。追加済みの生徒・教科の行は採点しません。"):
+            try:
+                session_hash = get_uploaded_file_hash(uploaded_file)
+                if blueprint_hash is not None:
+                    session_hash = f'{session_hash}-{blueprint_hash}'
+                with st.spinner("採点して経年データに追加しています..."):
+                    n_added = session_store.append_session(session_name, uploaded_file.getvalue(), blueprint,
+                                                           session_hash)
+                if n_added:
+                    st.success(f"{session_name}に{n_added:,}行を追加しました")
+                else:
+                    st.info(f"{session_name}に追加する新しい行はありません（追加済みです）")
+            except ValueError as e:
+                st.error(f"経年データに追加できません: {e}")
+        trajectory_mode = st.checkbox(
+            "経年変化を表示する",
+            key="trajectory_mode",
+            help="経年データに追加した試験回ごとの生徒・クラスの得点率の推移を表示します。"
+        )
+    
+    # データベース集計（データベースのファイルが設定されている場合のみ）
+    sql_backend = load_sql_backend(SQL_DATABASE_PATH) if SQL_DATABASE_PATH else None
+    sql_mode = False
+    sql_dataset = None
+    if sql_backend is not None:
+        st.markdown("---")
+        st.markdown("### 🗄 データベース集計")
+        sql_mode = st.checkbox(
+            "データベースで集計する",
+            key="sql_mode",
+            help="データを分割して採点しながら埋め込みデータベース（SQLite）に格納し、統計量・教科別集計・小問別正答率を"
+                 "データベース側で集計します。全行をメモリに読み込まないため、複数年度・複数校の大きなデータも扱えます。"
+                 "生徒ごとの表示（散布図・個別診断など）は使えません。"
+        )
+        if sql_mode:
+            # 同じテスト設計で採点したデータセットだけを選べる
+            datasets = sql_backend.datasets(blueprint_hash or '')
+            dataset_labels = {key: f"{label}（{n_rows:,}行）"
+                              for key, label, n_rows in zip(datasets['dataset'], datasets['label'], datasets['n_rows'])}
+            dataset_versions = {key: (n_files, n_rows)
+                                for key, n_files, n_rows in zip(datasets['dataset'], datasets['n_files'], datasets['n_rows'])}
+            sql_dataset = st.selectbox(
+                "データセット",
+                [None] + list(dataset_labels),
+                format_func=lambda key: "アップロードしたファイル" if key is None else dataset_labels[key],
+                key="sql_dataset"
+            )
+    
+    st.markdown("---")
+    st.markdown("### 📋 パラメータ設定")
+    if blueprint is DEFAULT_BLUEPRINT:
+        st.markdown("**領域パラメータ**")
+        for domain, label in DOMAIN_LABELS.items():
+            questions = DOMAIN_PARAMS[domain]
+            st.text(f"{label}: {questions[0]}-{questions[-1]}")
+        
+        st.markdown("**能力パラメータ**")
+        for ability, label in ABILITY_LABELS.items():
+            st.text(f"{label}: 各領域から2問ずつ")
+    else:
+        st.text(f"小問: {blueprint.n_items}問")
+        for axis, axis_label in blueprint.axes.items():
+            st.markdown(f"**{axis_label}パラメータ**")
+            for category, questions in blueprint.param_dict(axis).items():
+                st.text(f"{blueprint.category_labels[category]}: {len(questions)}問")
+        with st.expander("対応表"):
+            st.dataframe(blueprint.to_frame(), use_container_width=True)
+
+# メイン画面
+if trajectory_mode:
+    render_trajectory_view(session_store)
+elif sql_mode and sql_dataset is not None:
+    render_sql_view(sql_dataset, dataset_versions[sql_dataset], sql_backend, blueprint)
+elif uploaded_file is None:
+    st.info("👈 左のサイドバーからCSV・Parquet・Arrowファイルをアップロードしてください")
+    st.markdown("""
+    ### このダッシュボードでできること
+    - ✅ **能力別分析**: 4つの能力（A, B, C, D）ごとの素点・得点率を算出
+    - ✅ **領域別分析**: 4つの領域（1, 2, 3, 4）ごとの素点・得点率を算出
+    - ✅ **多次元可視化**: 能力・領域のレーダーチャート、ヒートマップ
+    - ✅ **個別診断**: 生徒ごとの強み・弱みの可視化
+    - ✅ **小問分析**: パラメータごとの正答率分析と項目分析（識別指数・点双列相関・α係数）
+    """)
+else:
+    try:
+        content_hash = get_uploaded_file_hash(uploaded_file)
+        if blueprint_hash is not None:
+            # 採点結果はテスト設計によって変わるため、キャッシュのキーに設計の内容も含める
+            content_hash = f'{content_hash}-{blueprint_hash}'
+        if sql_mode:
+            dataset_key = load_sql_upload(content_hash, uploaded_file.name, uploaded_file.getvalue(), sql_backend,
+                                          blueprint, blueprint_hash or '')
+            render_sql_view(dataset_key, None, sql_backend, blueprint)
+        elif streaming_mode:
+            render_streaming_view(content_hash, uploaded_file, blueprint)
+        else:
+            render_full_view(content_hash, uploaded_file, blueprint, ci_replicates if show_ci else None)
     
     except Exception as e:
         st.error(f"エラーが発生しました: {str(e)}")
-        st.info("CSVファイルの形式を確認してください")
+        st.info("ファイルの形式を確認してください")
         import traceback
         st.code(traceback.format_exc())
 
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+# 絞り込みに使う列
+FILTER_DIMS = ['grade', 'class', 'subject']
+
+
+class FilterIndex:
+    """絞り込み用に列の値ごとの行ビットマップを事前計算した索引
+
+    値ごとの行マスクを np.packbits で1行1ビットに詰めて保持し、
+    同じ列の複数値はOR、異なる列の条件はANDで組み合わせる。
+    """
+
+    def __init__(self, df, dims=None):
+        self.n_rows = len(df)
+        self.dims = [d for d in (dims or FILTER_DIMS) if d in df.columns]
+        self.values = {}
+        self._bitmaps = {}
+        for dim in self.dims:
+            codes, uniques = pd.factorize(df[dim], sort=True)
+            self.values[dim] = uniques.tolist()
+            self._bitmaps[dim] = {
+                value: np.packbits(codes == code)
+                for code, value in enumerate(self.values[dim])
+            }
+
+    @property
+    def nbytes(self):
+        return sum(bitmap.nbytes for bitmaps in self._bitmaps.values() for bitmap in bitmaps.values())
+
+    def bitmap(self, filters):
+        """条件（{列: 値のリスト}）に該当する行のビットマップ。条件がなければNone"""
+        combined = None
+        for dim, selected in filters.items():
+            if dim not in self._bitmaps or not selected:
+                continue
+            dim_bitmap = np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+            for value in selected:
+                if value in self._bitmaps[dim]:
+                    dim_bitmap |= self._bitmaps[dim][value]
+            combined = dim_bitmap if combined is None else combined & dim_bitmap
+        return combined
+
+    def mask(self, filters):
+        """条件に該当する行の真偽値マスク"""
+        bitmap = self.bitmap(filters)
+        if bitmap is None:
+            return np.ones(self.n_rows, dtype=bool)
+        return np.unpackbits(bitmap, count=self.n_rows).astype(bool)
+
+    def positions(self, filters):
+        """条件に該当する行の位置"""
+        return np.flatnonzero(self.mask(filters))
+
+
+def make_filter_key(filters):
+    """条件の辞書をキャッシュのキーに使える形に変換（未選択の列は除く）"""
+    return tuple((dim, tuple(selected)) for dim, selected in filters.items() if selected)
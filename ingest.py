@@ -0,0 +1,153 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as pa_ipc
+import pyarrow.parquet as pq
+
+from scoring import QUESTION_COLS
+
+# カテゴリ型で保持する列
+CATEGORY_COLS = ['grade', 'class', 'subject']
+
+# ファイル形式の判定に使う先頭バイト
+_PARQUET_MAGIC = b'PAR1'
+_ARROW_FILE_MAGIC = b'ARROW1'
+_ARROW_STREAM_MAGIC = b'\xff\xff\xff\xff'
+
+# CSVの文字列のカテゴリ列の型（辞書型で読み込む）
+CSV_CATEGORY_TYPES = {
+    'class': pa.dictionary(pa.int32(), pa.string()),
+    'subject': pa.dictionary(pa.int32(), pa.string()),
+}
+# 分割読み込みでCSVを区切る大きさ（バイト）
+STREAM_BLOCK_BYTES = 16 << 20
+
+
+def detect_format(file_bytes):
+    """ファイルの先頭バイトから形式（'parquet', 'arrow', 'arrow_stream', 'csv'）を判定"""
+    file_bytes = _read_magic(file_bytes)
+    if file_bytes[:4] == _PARQUET_MAGIC:
+        return 'parquet'
+    if file_bytes[:6] == _ARROW_FILE_MAGIC:
+        return 'arrow'
+    if file_bytes[:4] == _ARROW_STREAM_MAGIC:
+        return 'arrow_stream'
+    return 'csv'
+
+
+def _open_source(source):
+    """バイト列・パス・ファイルオブジェクトを pyarrow で読める形にする"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return pa.BufferReader(source)
+    return source
+
+
+def _read_magic(source):
+    """形式の判定に使う先頭バイトを取得"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source[:8])
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return f.read(8)
+    position = source.tell()
+    magic = source.read(8)
+    source.seek(position)
+    return magic
+
+
+def csv_column_types(items=QUESTION_COLS, typed=True):
+    """CSVの列の型
+
+    小問（items の列）は int8、文字列のカテゴリ列は辞書型。typed=False の場合は
+    小数や範囲外の値を含むCSVを分割して読むため、小問だけを float64 とする。
+    """
+    if not typed:
+        return {q: pa.float64() for q in items}
+    return {**{q: pa.int8() for q in items}, **CSV_CATEGORY_TYPES}
+
+
+def _read_csv_table(file_bytes, items=QUESTION_COLS):
+    """pyarrowでCSVを読み込む（型が合わない場合は型推論で読み直す）"""
+    try:
+        return pa_csv.read_csv(
+            io.BytesIO(file_bytes),
+            convert_options=pa_csv.ConvertOptions(column_types=csv_column_types(items))
+        )
+    except pa.ArrowInvalid:
+        # 小数の配点や範囲外の値を含む場合
+        return pa_csv.read_csv(io.BytesIO(file_bytes))
+
+
+def normalize_types(df, items=QUESTION_COLS):
+    """列の型を揃える
+
+    列名のBOMを除き、整数の小問（items の列）は int8、grade・class・subject は
+    値の昇順に並んだカテゴリ型にする。欠損や小数を含む小問はそのまま残す。
+    """
+    df.columns = df.columns.str.replace('\ufeff', '')
+    for q in items:
+        if q not in df.columns:
+            continue
+        values = df[q]
+        if values.dtype.kind in 'iu' and len(values) and values.min() >= -128 and values.max() <= 127:
+            df[q] = values.astype(np.int8)
+        elif values.dtype.kind == 'b':
+            df[q] = values.astype(np.int8)
+
+    for col in CATEGORY_COLS:
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype('category')
+        try:
+            categories = sorted(values.cat.categories)
+        except TypeError:
+            categories = list(values.cat.categories)
+        df[col] = values.cat.reorder_categories(categories)
+    return df
+
+
+def read_score_file(file_bytes, items=QUESTION_COLS):
+    """CSV・Parquet・Arrow IPC の内容をDataFrameに変換（items は小問の列名）"""
+    file_format = detect_format(file_bytes)
+    if file_format == 'parquet':
+        table = pq.read_table(io.BytesIO(file_bytes))
+    elif file_format == 'arrow':
+        table = pa_ipc.open_file(pa.BufferReader(file_bytes)).read_all()
+    elif file_format == 'arrow_stream':
+        table = pa_ipc.open_stream(pa.BufferReader(file_bytes)).read_all()
+    else:
+        table = _read_csv_table(file_bytes, items)
+    return normalize_types(table.to_pandas(), items)
+
+
+def iter_frames(source, block_bytes=STREAM_BLOCK_BYTES, typed=True, items=QUESTION_COLS):
+    """ファイルを先頭から一定の大きさごとに読み、型を揃えたDataFrameを順に返す
+
+    source はバイト列・パス・ファイルオブジェクト。CSVは block_bytes ごと、
+    Parquet は行グループごと、Arrow IPC はレコードバッチごとに区切る。
+    typed=False の場合、CSVの小問を float64 で読む（小数の配点を含むファイル用）。
+    items は小問の列名。
+    """
+    file_format = detect_format(source)
+    if file_format == 'parquet':
+        batches = pq.ParquetFile(_open_source(source)).iter_batches()
+    elif file_format == 'arrow':
+        reader = pa_ipc.open_file(_open_source(source))
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    elif file_format == 'arrow_stream':
+        batches = pa_ipc.open_stream(_open_source(source))
+    else:
+        batches = pa_csv.open_csv(
+            _open_source(source),
+            read_options=pa_csv.ReadOptions(block_size=block_bytes),
+            convert_options=pa_csv.ConvertOptions(column_types=csv_column_types(items, typed))
+        )
+    for batch in batches:
+        if batch.num_rows:
+            yield normalize_types(batch.to_pandas(), items)
@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+
+# モデルの表示名
+IRT_MODELS = {
+    'rasch': 'Rasch（1PL）',
+    '2pl': '2PL'
+}
+# 能力θの事前分布（標準正規分布）の求積点の数と範囲
+QUADRATURE_POINTS = 41
+QUADRATURE_RANGE = 4.0
+# EMアルゴリズムの最大反復回数と収束の判定（1回の更新での項目パラメータの最大変化量）
+MAX_ITER = 500
+TOLERANCE = 1e-4
+# 1回の更新で動かすパラメータの上限（初期値が悪い場合の発散を防ぐ）
+_MAX_STEP = 1.0
+# 識別力・切片の範囲（全員正答・全員誤答の小問で値が発散しないようにする）
+_SLOPE_RANGE = (0.05, 10.0)
+_INTERCEPT_RANGE = (-30.0, 30.0)
+# 解答パターンを np.bincount で数える上限（グループ数×パターンの種類）
+_BINCOUNT_LIMIT = 1 << 22
+
+
+def _quadrature():
+    """求積点と標準正規分布の重み"""
+    nodes = np.linspace(-QUADRATURE_RANGE, QUADRATURE_RANGE, QUADRATURE_POINTS)
+    weights = np.exp(-nodes ** 2 / 2)
+    return nodes, weights / weights.sum()
+
+
+def _posterior(patterns, slopes, intercepts, nodes, log_prior):
+    """解答パターンごとの求積点上の事後確率（パターン×求積点）と求積点での正答確率の対数"""
+    z = np.outer(nodes, slopes) + intercepts
+    log_p = -np.logaddexp(0, -z)
+    log_q = -np.logaddexp(0, z)
+    log_like = patterns @ log_p.T + (1 - patterns) @ log_q.T + log_prior
+    log_like -= log_like.max(axis=1, keepdims=True)
+    posterior = np.exp(log_like)
+    posterior /= posterior.sum(axis=1, keepdims=True)
+    return posterior, log_p
+
+
+def fit_item_parameters(patterns, counts, model='rasch', slopes=None, intercepts=None,
+                        max_iter=MAX_ITER, tol=TOLERANCE):
+    """解答パターンと人数から項目パラメータを周辺最尤推定（EMアルゴリズム）
+
+    モデルは P = 1 / (1 + exp(-(a θ + d)))、θ は標準正規分布に従うとする。
+    'rasch' は全小問で共通の識別力 a、'2pl' は小問ごとの a を推定する。
+    Mステップは全小問のニュートン法の更新を配列演算でまとめて行う。
+    slopes・intercepts を渡した場合はその値から反復を始める（前回の推定結果からのウォームスタート）。
+    戻り値は (識別力 a, 切片 d, 反復回数)。
+    """
+    patterns = np.asarray(patterns, dtype=np.float64)
+    counts = np.asarray(counts, dtype=np.float64)
+    n_items = patterns.shape[1]
+    nodes, prior = _quadrature()
+    log_prior = np.log(prior)
+
+    if intercepts is None:
+        p = np.clip(counts @ patterns / counts.sum(), 0.01, 0.99)
+        intercepts = np.log(p / (1 - p))
+    slopes = np.ones(n_items) if slopes is None else np.asarray(slopes, dtype=np.float64)
+    if model == 'rasch':
+        slopes = np.full(n_items, slopes.mean())
+    slopes = slopes.copy()
+    intercepts = np.asarray(intercepts, dtype=np.float64).copy()
+
+    iteration = 0
+    for iteration in range(1, max_iter + 1):
+        # Eステップ: 求積点ごとの期待人数と期待正答数
+        posterior, log_p = _posterior(patterns, slopes, intercepts, nodes, log_prior)
+        posterior *= counts[:, np.newaxis]
+        expected_n = posterior.sum(axis=0)
+        expected_correct = patterns.T @ posterior
+
+        # Mステップ: 重み付きロジスティック回帰のニュートン法（小問×求積点の配列で計算）
+        p = np.exp(log_p).T
+        residual = expected_correct - expected_n * p
+        weight = expected_n * p * (1 - p)
+        grad_d = residual.sum(axis=1)
+        grad_a = residual @ nodes
+        info_dd = weight.sum(axis=1)
+        info_ad = weight @ nodes
+        info_aa = weight @ nodes ** 2
+        if model == 'rasch':
+            # 共通の識別力と小問ごとの切片をシューア補元で同時に更新
+            schur = info_aa.sum() - (info_ad ** 2 / info_dd).sum()
+            step_a = (grad_a.sum() - (info_ad * grad_d / info_dd).sum()) / schur
+            step_a = np.full(n_items, np.clip(step_a, -_MAX_STEP, _MAX_STEP))
+            step_d = (grad_d - info_ad * step_a) / info_dd
+        else:
+            det = info_aa * info_dd - info_ad ** 2
+            step_a = (info_dd * grad_a - info_ad * grad_d) / det
+            step_d = (info_aa * grad_d - info_ad * grad_a) / det
+        step_a = np.clip(step_a, -_MAX_STEP, _MAX_STEP)
+        step_d = np.clip(step_d, -_MAX_STEP, _MAX_STEP)
+        slopes = np.clip(slopes + step_a, *_SLOPE_RANGE)
+        intercepts = np.clip(intercepts + step_d, *_INTERCEPT_RANGE)
+        if max(np.abs(step_a).max(), np.abs(step_d).max()) < tol:
+            break
+    return slopes, intercepts, iteration
+
+
+def estimate_abilities(patterns, slopes, intercepts):
+    """解答パターンごとの能力θの事後期待値（EAP推定値）と事後標準偏差"""
+    nodes, prior = _quadrature()
+    posterior, _ = _posterior(np.asarray(patterns, dtype=np.float64), slopes, intercepts, nodes, np.log(prior))
+    theta = posterior @ nodes
+    se = np.sqrt(np.maximum(posterior @ nodes ** 2 - theta ** 2, 0))
+    return theta, se
+
+
+def _count_patterns(codes, n_groups, n_items):
+    """（グループ, 解答パターン）の組を数える
+
+    codes はグループ番号×2^小問数＋パターン番号。戻り値は (異なる組, 人数, 行ごとの組の番号)。
+    """
+    n_codes = n_groups << n_items
+    if n_codes <= _BINCOUNT_LIMIT:
+        counts = np.bincount(codes, minlength=n_codes)
+        unique = np.flatnonzero(counts)
+        lookup = np.zeros(n_codes, dtype=np.int64)
+        lookup[unique] = np.arange(len(unique))
+        return unique, counts[unique], lookup[codes]
+    unique, inverse, counts = np.unique(codes, return_inverse=True, return_counts=True)
+    return unique, counts, inverse
+
+
+def fit_irt(block, item_cols, param_dict, model='rasch', groups=None, init=None):
+    """カテゴリ（と教科などのグループ）ごとに項目反応モデルを当てはめ、能力θを推定
+
+    block は正誤（0/1）の配列（行×小問, 列は item_cols の順）、groups は行ごとのグループの値
+    （教科のように同じ列でも小問の内容が異なる単位。グループごとに別々に推定する）。
+    同じ解答パターンの行はまとめて1回だけ計算するため、計算量は行数ではなくパターンの種類で決まる。
+    init に前回の結果の項目パラメータの表を渡すと、同じグループ・カテゴリ・小問の値から反復を始める。
+    戻り値は (θの配列（行×カテゴリ）, カテゴリ名のリスト, 項目パラメータの表, 反復回数の合計)。
+    """
+    block = np.asarray(block)
+    n_rows = block.shape[0]
+    if block.size and (block.min() < 0 or block.max() > 1
+                       or (block.dtype.kind == 'f' and not np.array_equal(block, np.round(block)))):
+        raise ValueError('項目反応理論の推定には正誤（0/1）のデータが必要です')
+
+    positions = {q: i for i, q in enumerate(item_cols)}
+    categories = []
+    members = []
+    for category, questions in param_dict.items():
+        available = [positions[q] for q in questions if q in positions]
+        if available:
+            if len(available) > 52:
+                raise ValueError(f'カテゴリ {category} の小問が多すぎます（52問まで）')
+            categories.append(category)
+            members.append(available)
+
+    if groups is None:
+        group_codes = np.zeros(n_rows, dtype=np.int64)
+        group_values = [None]
+    else:
+        group_codes, group_values = pd.factorize(pd.Series(groups), use_na_sentinel=False)
+        group_codes = group_codes.astype(np.int64)
+        group_values = list(group_values)
+
+    # 全カテゴリの解答パターン番号（小問の正誤を2進数とみなした値）を1回の行列積で求める
+    # （24問以下のカテゴリだけなら float32 で正確に表せる）
+    dtype = np.float32 if max(map(len, members), default=0) <= 24 else np.float64
+    weights = np.zeros((len(categories), len(item_cols)), dtype=dtype)
+    for j, items in enumerate(members):
+        weights[j, items] = 2.0 ** np.arange(len(items))
+    pattern_keys = (weights @ block.T.astype(dtype)).astype(np.int64)
+
+    previous = {}
+    if init is not None:
+        for row in init.itertuples(index=False):
+            previous[(row.グループ, row.カテゴリ, row.問題)] = (row.識別力, row.切片)
+
+    thetas = np.full((n_rows, len(categories)), np.nan)
+    param_rows = []
+    total_iter = 0
+    for j, (category, items) in enumerate(zip(categories, members)):
+        n_items = len(items)
+        unique, counts, inverse = _count_patterns((group_codes << n_items) + pattern_keys[j],
+                                                  len(group_values), n_items)
+        unique_groups = unique >> n_items
+        unique_patterns = ((unique[:, np.newaxis] >> np.arange(n_items)) & 1).astype(np.float64)
+        theta_by_pattern = np.empty(len(unique))
+        for g in np.unique(unique_groups):
+            in_group = unique_groups == g
+            names = [item_cols[i] for i in items]
+            start = [previous.get((group_values[g], category, q)) for q in names]
+            if all(value is not None for value in start):
+                slopes, intercepts = np.array(start).T
+            else:
+                slopes = intercepts = None
+            slopes, intercepts, n_iter = fit_item_parameters(
+                unique_patterns[in_group], counts[in_group], model, slopes, intercepts)
+            total_iter += n_iter
+            theta_by_pattern[in_group], _ = estimate_abilities(unique_patterns[in_group], slopes, intercepts)
+            for q, a, d in zip(names, slopes, intercepts):
+                param_rows.append({
+                    'グループ': group_values[g],
+                    'カテゴリ': category,
+                    '問題': q,
+                    '識別力': a,
+                    '困難度': -d / a,
+                    '切片': d,
+                })
+        thetas[:, j] = theta_by_pattern[inverse]
+    return thetas, categories, pd.DataFrame(param_rows), total_iter
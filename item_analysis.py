@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+
+# 上位群・下位群に含める受験者の割合
+DEFAULT_GROUP_FRACTION = 0.27
+# 行列積をまとめて行う行数（float32で1ブロック内の正誤の合計が正確に表せる大きさ）
+_CHUNK_ROWS = 65536
+# float32で整数が正確に表せる上限
+_FLOAT32_EXACT_LIMIT = 2 ** 24
+
+
+def _chunk_dtype(block, chunk_rows=_CHUNK_ROWS):
+    """行列積の型（1ブロック内の積の合計が float32 で正確に表せる整数の得点なら float32、それ以外は float64）"""
+    if block.size == 0:
+        return np.float32
+    if block.dtype.kind == 'f' and not np.array_equal(block, np.round(block)):
+        return np.float64
+    max_abs = float(np.abs(block).max())
+    return np.float32 if max_abs ** 2 * min(chunk_rows, block.shape[0]) < _FLOAT32_EXACT_LIMIT else np.float64
+
+
+def _iter_chunks(block, chunk_rows=_CHUNK_ROWS, dtype=np.float32):
+    for start in range(0, block.shape[0], chunk_rows):
+        yield start, block[start:start + chunk_rows].astype(dtype)
+
+
+def _weight_matrix(members, n_items, weights=None):
+    """カテゴリ×小問の重みの行列（float32、weights を省略した場合は所属する小問が1）"""
+    matrix = np.zeros((len(members), n_items), dtype=np.float32)
+    for j, positions in enumerate(members):
+        matrix[j, positions] = 1 if weights is None else weights[j]
+    return matrix
+
+
+def compute_item_moments(block, members=(), weights=None, chunk_rows=_CHUNK_ROWS):
+    """解答の配列（行×小問）から小問の平均・共分散行列とカテゴリの合計点を求める
+
+    行ブロックごとに float32 の行列積でグラム行列を作り、float64で合算する
+    （部分点が大きく float32 で正確に表せない場合や小数の得点は float64 で計算する）。
+    カテゴリの合計点の分散や小問との共分散はすべてこの共分散行列から求められる。
+    合計点は (カテゴリ数, 行数) の配列で、members（カテゴリごとの小問の位置）の順。
+    weights（members と同じ並びの重みの配列）を渡した場合、合計点は「重み×小問の得点」の合計。
+    """
+    n_rows, n_items = block.shape
+    matrix = _weight_matrix(members, n_items, weights)
+    sums = np.zeros(n_items)
+    gram = np.zeros((n_items, n_items))
+    totals = np.empty((len(members), n_rows), dtype=np.float32)
+    for start, chunk in _iter_chunks(block, chunk_rows, _chunk_dtype(block, chunk_rows)):
+        sums += chunk.sum(axis=0, dtype=np.float64)
+        gram += chunk.T @ chunk
+        totals[:, start:start + len(chunk)] = matrix @ chunk.T
+    if n_rows == 0:
+        return np.full(n_items, np.nan), np.full((n_items, n_items), np.nan), totals
+    means = sums / n_rows
+    return means, gram / n_rows - np.outer(means, means), totals
+
+
+def _group_weights(totals, fraction):
+    """合計点の上位・下位 fraction の行の重み（2×行）と群の人数
+
+    境界の点数に同点の行が複数ある場合は、群の人数がちょうど fraction になるように
+    同点の行に等しい端数の重みを付ける（行の並び順によらず結果が決まる）。
+    """
+    n_rows = len(totals)
+    group_size = n_rows * fraction
+    k = min(max(int(np.ceil(group_size)), 1), n_rows)
+    upper_cut = np.partition(totals, n_rows - k)[n_rows - k]
+    lower_cut = np.partition(totals, k - 1)[k - 1]
+
+    weights = np.empty((2, n_rows), dtype=np.float32)
+    for row, beyond, tied in ((0, totals > upper_cut, totals == upper_cut),
+                              (1, totals < lower_cut, totals == lower_cut)):
+        tie_weight = (group_size - np.count_nonzero(beyond)) / np.count_nonzero(tied)
+        np.add(beyond, tied * np.float32(tie_weight), out=weights[row], dtype=np.float32)
+    return weights, group_size
+
+
+def compute_group_difference(block, totals, fraction=DEFAULT_GROUP_FRACTION, chunk_rows=_CHUNK_ROWS):
+    """合計点による上位群と下位群の小問の平均の差（識別指数）
+
+    totals は compute_item_moments が返すカテゴリの合計点（カテゴリ×行）。
+    戻り値は (カテゴリ数, 小問数) の配列で、カテゴリに含まれない小問の値も同じ群分けで計算される。
+    """
+    n_categories, n_rows = totals.shape
+    if n_rows == 0:
+        return np.full((n_categories, block.shape[1]), np.nan)
+
+    # 全カテゴリの上位群・下位群の重みを並べ、1回の行列積で群ごとの合計を求める
+    weights = np.empty((2 * n_categories, n_rows), dtype=np.float32)
+    group_sizes = np.empty(n_categories)
+    for j in range(n_categories):
+        weights[2 * j:2 * j + 2], group_sizes[j] = _group_weights(totals[j], fraction)
+    group_sums = np.zeros((2 * n_categories, block.shape[1]))
+    for start, chunk in _iter_chunks(block, chunk_rows, _chunk_dtype(block, chunk_rows)):
+        group_sums += weights[:, start:start + len(chunk)] @ chunk
+    group_means = group_sums.reshape(n_categories, 2, -1) / group_sizes[:, np.newaxis, np.newaxis]
+    return group_means[:, 0] - group_means[:, 1]
+
+
+def compute_item_analysis(block, item_cols, param_dict, fraction=DEFAULT_GROUP_FRACTION, weights=None,
+                          max_points=None):
+    """カテゴリごとの古典的テスト理論による項目分析
+
+    block は解答の配列（行×小問, 列は item_cols の順）。各小問について、
+    通過率（平均÷満点）、修正済み点双列相関（その小問を除いたカテゴリの合計点との相関）、
+    上位・下位 fraction 群の識別指数（群の平均÷満点の差）、その小問を除いた場合のα係数を求める。
+    満点は max_points（{小問: 満点}、省略時は1）で、部分点の小問も通過率・識別指数は0〜1の割合になる。
+    カテゴリについては問題数・平均点・標準偏差・クロンバックのα係数を求める。
+    weights（{カテゴリ: {小問: 重み}}）を渡した場合、カテゴリの合計点はテスト設計のカテゴリ得点と同じ
+    「重み×小問の得点」の合計とし（重みが0の小問は含めない）、α係数は重み付きの合計点について求める。
+    戻り値は (小問別の表, カテゴリ別の表)。
+    """
+    positions = {q: i for i, q in enumerate(item_cols)}
+    categories = []
+    members = []
+    member_weights = []
+    for category, questions in param_dict.items():
+        category_weights = (weights or {}).get(category)
+        if category_weights is None:
+            category_weights = dict.fromkeys(questions, 1)
+        available = [q for q in questions if q in positions and category_weights.get(q, 0) != 0]
+        if available:
+            categories.append(category)
+            members.append([positions[q] for q in available])
+            member_weights.append(np.array([category_weights[q] for q in available], dtype=np.float64))
+
+    means, cov, totals = compute_item_moments(block, members, member_weights)
+    item_vars = np.diag(cov)
+    # 通過率・識別指数は小問の満点に対する割合
+    points = np.array([(max_points or {}).get(q, 1) for q in item_cols], dtype=np.float64)
+    discrimination = compute_group_difference(block, totals, fraction) / points
+
+    item_rows = []
+    category_rows = []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for j, (category, items, w) in enumerate(zip(categories, members, member_weights)):
+            n_items = len(items)
+            sub_cov = cov[np.ix_(items, items)]
+            # 小問とカテゴリの合計点の共分散、合計点の分散（合計点は重み w の線形結合）
+            item_total_cov = sub_cov @ w
+            total_var = w @ item_total_cov
+            variances = item_vars[items]
+            # 重み付きの合計点の各項の分散（w²σ²）
+            term_vars = w ** 2 * variances
+            alpha = n_items / (n_items - 1) * (1 - term_vars.sum() / total_var) if n_items > 1 else np.nan
+
+            # その小問を除いた合計点（残りの合計点）との共分散・分散
+            rest_cov = item_total_cov - w * variances
+            rest_var = total_var - 2 * w * item_total_cov + term_vars
+            point_biserial = rest_cov / np.sqrt(variances * rest_var)
+            if n_items > 2:
+                alpha_if_deleted = (n_items - 1) / (n_items - 2) * (1 - (term_vars.sum() - term_vars) / rest_var)
+            else:
+                alpha_if_deleted = np.full(n_items, np.nan)
+
+            for i, position in enumerate(items):
+                item_rows.append({
+                    '問題': item_cols[position],
+                    'カテゴリ': category,
+                    '通過率': means[position] / points[position],
+                    '修正済み点双列相関': point_biserial[i],
+                    f'識別指数(上位-下位{fraction:.0%})': discrimination[j, position],
+                    '項目削除時のα': alpha_if_deleted[i],
+                })
+            category_rows.append({
+                'カテゴリ': category,
+                '問題数': n_items,
+                '平均点': means[items] @ w,
+                '標準偏差': np.sqrt(total_var),
+                'α係数': alpha,
+            })
+    return pd.DataFrame(item_rows), pd.DataFrame(category_rows)
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+# 既定の反復回数と信頼水準
+DEFAULT_REPLICATES = 1000
+DEFAULT_CONFIDENCE = 0.95
+# 異なる値（相関の場合は値の組）がこれ以下なら、値ごとの人数の多項分布から再標本を作る
+MULTINOMIAL_MAX_VALUES = 4096
+# 行番号の行列で再標本を作る場合の1バッチの要素数の上限（反復回数×行数）
+_MAX_BATCH_CELLS = 1 << 22
+
+
+def _compress(*columns):
+    """値（の組）ごとの人数にまとめる。戻り値は (値の配列のリスト, 人数)
+
+    列ごとの値の番号を組み合わせた番号を np.bincount で数える（並べ替えは行わない）。
+    """
+    codes = np.zeros(len(columns[0]), dtype=np.int64)
+    column_uniques = []
+    for values in columns:
+        column_codes, uniques = pd.factorize(values, sort=False)
+        codes = codes * len(uniques) + column_codes
+        column_uniques.append(uniques)
+    sizes = [len(uniques) for uniques in column_uniques]
+    if np.prod(sizes, dtype=np.float64) <= len(codes):
+        counts = np.bincount(codes, minlength=int(np.prod(sizes)))
+        unique_codes = np.flatnonzero(counts)
+        counts = counts[unique_codes]
+    else:
+        unique_codes, counts = np.unique(codes, return_counts=True)
+    values = []
+    for uniques, size in zip(reversed(column_uniques), reversed(sizes)):
+        values.append(uniques[unique_codes % size])
+        unique_codes = unique_codes // size
+    return values[::-1], counts
+
+
+def _iter_resampled_weights(counts, n_boot, rng):
+    """再標本での値ごとの人数（反復×値）をバッチごとに返す
+
+    n 行からの復元抽出で各値が選ばれる人数は、元の人数の割合を確率とする多項分布に従う。
+    """
+    n = counts.sum()
+    batch = max(1, _MAX_BATCH_CELLS // max(len(counts), 1))
+    for start in range(0, n_boot, batch):
+        yield rng.multinomial(n, counts / n, size=min(batch, n_boot - start)).astype(np.float64)
+
+
+def _iter_resampled_indices(n, n_boot, rng):
+    """再標本の行番号（反復×行）をバッチごとに返す"""
+    batch = max(1, _MAX_BATCH_CELLS // n)
+    for start in range(0, n_boot, batch):
+        yield rng.integers(0, n, size=(min(batch, n_boot - start), n))
+
+
+def _interval(replicates, confidence):
+    tail = (1 - confidence) / 2
+    low, high = np.nanquantile(replicates, [tail, 1 - tail])
+    return low, high
+
+
+def bootstrap_mean_ci(values, n_boot=DEFAULT_REPLICATES, confidence=DEFAULT_CONFIDENCE, seed=0):
+    """平均のブートストラップ信頼区間（パーセンタイル法）。戻り値は (下限, 上限)
+
+    異なる値が少ない場合（得点率など）は値ごとの人数の多項分布から、多い場合は行番号の
+    行列からバッチごとに再標本を作り、反復ごとのPythonのループは行わない。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if n < 2:
+        return np.nan, np.nan
+    rng = np.random.default_rng(seed)
+    (uniques,), counts = _compress(values)
+    if len(uniques) <= MULTINOMIAL_MAX_VALUES:
+        replicates = np.concatenate([weights @ uniques / n
+                                     for weights in _iter_resampled_weights(counts, n_boot, rng)])
+    else:
+        replicates = np.concatenate([values[indices].mean(axis=1)
+                                     for indices in _iter_resampled_indices(n, n_boot, rng)])
+    return _interval(replicates, confidence)
+
+
+def _weighted_correlation(weights, x, y):
+    """重み（反復×値の組）ごとの相関係数"""
+    n = weights.sum(axis=1)
+    moments = weights @ np.column_stack([x, y, x * x, y * y, x * y])
+    mean_x = moments[:, 0] / n
+    mean_y = moments[:, 1] / n
+    var_x = moments[:, 2] / n - mean_x ** 2
+    var_y = moments[:, 3] / n - mean_y ** 2
+    cov = moments[:, 4] / n - mean_x * mean_y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cov / np.sqrt(var_x * var_y)
+
+
+def bootstrap_correlation_ci(x, y, n_boot=DEFAULT_REPLICATES, confidence=DEFAULT_CONFIDENCE, seed=0):
+    """相関係数のブートストラップ信頼区間（パーセンタイル法、欠損を含む組は除く）。戻り値は (下限, 上限)"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x = x[valid]
+    y = y[valid]
+    n = len(x)
+    if n < 3:
+        return np.nan, np.nan
+    rng = np.random.default_rng(seed)
+    (unique_x, unique_y), counts = _compress(x, y)
+    if len(counts) <= MULTINOMIAL_MAX_VALUES:
+        replicates = np.concatenate([_weighted_correlation(weights, unique_x, unique_y)
+                                     for weights in _iter_resampled_weights(counts, n_boot, rng)])
+    else:
+        batches = []
+        for indices in _iter_resampled_indices(n, n_boot, rng):
+            xs = x[indices]
+            ys = y[indices]
+            xs = xs - xs.mean(axis=1, keepdims=True)
+            ys = ys - ys.mean(axis=1, keepdims=True)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                batches.append((xs * ys).sum(axis=1) / np.sqrt((xs * xs).sum(axis=1) * (ys * ys).sum(axis=1)))
+        replicates = np.concatenate(batches)
+    return _interval(replicates, confidence)
+
+
+def bootstrap_mean_cis(df, columns, group_col=None, n_boot=DEFAULT_REPLICATES,
+                       confidence=DEFAULT_CONFIDENCE, seed=0):
+    """列ごと（group_col を指定した場合はグループ×列ごと）の平均の信頼区間
+
+    戻り値の行は列名（グループ別の場合は (グループ, 列名)）、列は 'low'・'high'。
+    """
+    if group_col is None:
+        groups = [(None, df)]
+    else:
+        groups = df.groupby(group_col, sort=True, observed=True)
+    rows = {}
+    for group, rows_df in groups:
+        for col in columns:
+            if col in rows_df.columns:
+                key = col if group_col is None else (group, col)
+                rows[key] = bootstrap_mean_ci(rows_df[col].to_numpy(), n_boot, confidence, seed)
+    if not rows:
+        return pd.DataFrame(columns=['low', 'high'])
+    return pd.DataFrame.from_dict(rows, orient='index', columns=['low', 'high'])
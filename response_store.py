@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+
+from scoring import QUESTION_COLS, extract_item_block
+
+# 小問の展開をまとめて行う行数（展開時のメモリ使用量を抑える）
+_UNPACK_CHUNK_ROWS = 65536
+# ビット列に格納できる小問の得点の上限（展開後の int8 に収まる値）
+MAX_PACKED_POINTS = 127
+
+if hasattr(np, 'bitwise_count'):
+    def _popcount(values):
+        """各要素の立っているビット数を数える"""
+        return np.bitwise_count(values)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        """各要素の立っているビット数を数える"""
+        values = np.ascontiguousarray(values)
+        byte_view = values.view(np.uint8).reshape(values.shape + (values.itemsize,))
+        return _POPCOUNT_TABLE[byte_view].sum(axis=-1, dtype=np.uint8)
+
+
+def _pack_bits(flags):
+    """真偽値の配列（行×小問）を1行あたりのワード列に詰める
+
+    32問以下は uint32 の1ワード、それを超える場合は np.packbits の uint8 ブロックになる。
+    """
+    n_items = flags.shape[1]
+    packed = np.packbits(flags, axis=1, bitorder='little')
+    if n_items > 32:
+        return packed
+    padded = np.zeros((packed.shape[0], 4), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return padded.view('<u4')
+
+
+class ResponseStore:
+    """解答データ（x1〜x32）をビット列で保持する格納庫
+
+    1行の解答を uint32 のビットマスク（33問以上は np.packbits のブロック）に詰め、
+    カテゴリ別の得点はカテゴリのマスクとの論理積のポップカウントで求める。
+    部分点（0〜満点の整数）は得点を2進数の桁ごとのビット列（planes）に分けて持ち、
+    桁ごとのポップカウントに2の累乗を掛けて合計する。正誤だけのデータは1桁になる。
+    無回答（欠損）は得点0として数え、解答の有無は別の有効ビット列（valid）で区別する。
+    行の並びは元のDataFrameの行位置と一致する。
+    """
+
+    def __init__(self, planes, item_cols, valid=None):
+        # 得点の桁ごとのビット列（planes[k] は 2**k の桁）
+        self.planes = list(planes)
+        self.item_cols = list(item_cols)
+        # 解答がある小問のビット列（無回答がない場合は None）
+        self.valid = valid
+
+    @classmethod
+    def from_block(cls, block, item_cols, valid=None):
+        """得点の配列（行×小問, 0以上の整数）から作成
+
+        valid は解答の有無の真偽値の配列（行×小問）。無回答の得点は0にしておくこと。
+        """
+        block = np.asarray(block)
+        n_planes = max(int(block.max()).bit_length(), 1) if block.size else 1
+        if n_planes == 1:
+            planes = [_pack_bits(block != 0)]
+        else:
+            planes = [_pack_bits(((block >> k) & 1) != 0) for k in range(n_planes)]
+        if valid is not None and not np.all(valid):
+            valid = _pack_bits(np.asarray(valid, dtype=bool))
+        else:
+            valid = None
+        return cls(planes, item_cols, valid)
+
+    @property
+    def words(self):
+        """1の位のビット列（正誤だけのデータでは正答のビット列）"""
+        return self.planes[0]
+
+    @property
+    def n_rows(self):
+        return self.words.shape[0]
+
+    @property
+    def n_items(self):
+        return len(self.item_cols)
+
+    @property
+    def n_planes(self):
+        return len(self.planes)
+
+    @property
+    def nbytes(self):
+        return sum(plane.nbytes for plane in self.planes) + (self.valid.nbytes if self.valid is not None else 0)
+
+    def __len__(self):
+        return self.n_rows
+
+    def take(self, rows):
+        """行位置（または真偽値マスク）で行を絞り込んだ格納庫を返す"""
+        valid = self.valid[rows] if self.valid is not None else None
+        return ResponseStore([plane[rows] for plane in self.planes], self.item_cols, valid)
+
+    def item_mask(self, items):
+        """指定した小問のビットを立てたマスクを作成"""
+        positions = {q: i for i, q in enumerate(self.item_cols)}
+        flags = np.zeros((1, self.n_items), dtype=bool)
+        for q in items:
+            if q in positions:
+                flags[0, positions[q]] = True
+        return _pack_bits(flags)[0]
+
+    @staticmethod
+    def _count_bits(words, mask):
+        counts = _popcount(words & mask)
+        if counts.shape[1] == 1:
+            return counts[:, 0].astype(np.int64)
+        return counts.sum(axis=1, dtype=np.int64)
+
+    def count_correct(self, mask):
+        """マスクに含まれる小問の正答数（部分点がある場合は得点の合計）を行ごとに数える"""
+        counts = self._count_bits(self.planes[0], mask)
+        for k, plane in enumerate(self.planes[1:], start=1):
+            counts += self._count_bits(plane, mask) << k
+        return counts
+
+    def count_missing(self, mask):
+        """マスクに含まれる小問の無回答数を行ごとに数える"""
+        if self.valid is None:
+            return np.zeros(self.n_rows, dtype=np.int64)
+        return self._count_bits(~self.valid, mask)
+
+    def category_scores(self, matrix, item_cols=None):
+        """問題×カテゴリの対応行列の各カテゴリについて正答数（重みがある場合は重み付きの合計）を数える
+
+        item_cols は対応行列の行の小問（省略時は格納庫の小問の順）。重みの値ごとにマスクを作り、
+        ポップカウントに重みを掛けて合計する。重みがすべて整数なら int64、それ以外は float64。
+        戻り値は (行×カテゴリ) だが、カテゴリごとの列が連続するメモリ配置になっている。
+        """
+        item_cols = self.item_cols if item_cols is None else list(item_cols)
+        dtype = np.int64 if matrix.dtype.kind in 'iub' else np.float64
+        scores = np.zeros((matrix.shape[1], self.n_rows), dtype=dtype)
+        for j in range(matrix.shape[1]):
+            column = matrix[:, j]
+            for weight in np.unique(column[column != 0]):
+                members = [q for q, value in zip(item_cols, column) if value == weight]
+                counts = self.count_correct(self.item_mask(members))
+                if weight == 1:
+                    scores[j] += counts
+                else:
+                    scores[j] += counts * weight
+        return scores.T
+
+    def _unpack(self, words, start, stop):
+        byte_view = words.view(np.uint8).reshape(self.n_rows, -1)
+        return np.unpackbits(byte_view[start:stop], axis=1, count=self.n_items, bitorder='little')
+
+    def iter_blocks(self, chunk_rows=_UNPACK_CHUNK_ROWS):
+        """得点の配列（行×小問, uint8、無回答は0）を行ブロックごとに展開して返す"""
+        for start in range(0, self.n_rows, chunk_rows):
+            stop = start + chunk_rows
+            block = self._unpack(self.planes[0], start, stop)
+            for k, plane in enumerate(self.planes[1:], start=1):
+                block |= self._unpack(plane, start, stop) << k
+            yield block
+
+    def iter_valid_blocks(self, chunk_rows=_UNPACK_CHUNK_ROWS):
+        """解答の有無の配列（行×小問, uint8）を行ブロックごとに展開して返す（無回答がない場合は None）"""
+        if self.valid is None:
+            return None
+        return (self._unpack(self.valid, start, start + chunk_rows) for start in range(0, self.n_rows, chunk_rows))
+
+    def item_correct_counts(self):
+        """小問ごとの正答者数（部分点がある場合は得点の合計）"""
+        counts = np.zeros(self.n_items, dtype=np.int64)
+        for block in self.iter_blocks():
+            counts += block.sum(axis=0, dtype=np.int64)
+        return pd.Series(counts, index=self.item_cols)
+
+    def item_response_counts(self):
+        """小問ごとの解答者数（無回答を除いた人数）"""
+        counts = np.full(self.n_items, self.n_rows, dtype=np.int64)
+        if self.valid is not None:
+            counts[:] = 0
+            for block in self.iter_valid_blocks():
+                counts += block.sum(axis=0, dtype=np.int64)
+        return pd.Series(counts, index=self.item_cols)
+
+    def _concat_blocks(self, chunks, dtype):
+        block = np.empty((self.n_rows, self.n_items), dtype=dtype)
+        start = 0
+        for chunk in chunks:
+            block[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        return block
+
+    def to_block(self):
+        """得点の配列（行×小問, int8、無回答は0）に展開"""
+        return self._concat_blocks(self.iter_blocks(), np.int8)
+
+    def to_valid_block(self):
+        """解答の有無の配列（行×小問, bool）に展開"""
+        if self.valid is None:
+            return np.ones((self.n_rows, self.n_items), dtype=bool)
+        return self._concat_blocks(self.iter_valid_blocks(), bool)
+
+    def to_frame(self, columns=None, index=None):
+        """解答データをDataFrameに展開（columns で小問を指定可能、無回答がある場合は欠損を含む小数の列）"""
+        block = self.to_block()
+        if self.valid is not None:
+            block = np.where(self.to_valid_block(), block, np.nan)
+        frame = pd.DataFrame(block, columns=self.item_cols, index=index)
+        if columns is not None:
+            frame = frame[[q for q in columns if q in self.item_cols]]
+        return frame
+
+
+def pack_responses(df, items=QUESTION_COLS):
+    """x列（items の列）が0〜MAX_PACKED_POINTS の整数（と欠損）の場合はビット列に格納し、DataFrameからx列を取り除く
+
+    戻り値は (x列を除いたDataFrame, ResponseStore)。欠損は無回答として有効ビット列で区別する。
+    負の値・小数の得点・上限を超える値を含む場合は圧縮せず (df, None) を返す。
+    """
+    item_cols = [q for q in items if q in df.columns]
+    if not item_cols:
+        return df, None
+
+    block = extract_item_block(df, item_cols)
+    valid = None
+    if block.dtype.kind == 'f':
+        # 欠損は extract_item_block で0になっているので、解答の有無を別に取り出す
+        if not np.array_equal(block, np.round(block)):
+            return df, None
+        valid = df[item_cols].notna().to_numpy()
+    if block.size and (block.min() < 0 or block.max() > MAX_PACKED_POINTS):
+        return df, None
+    block = block.astype(np.int8, copy=False)
+    return df.drop(columns=item_cols), ResponseStore.from_block(block, item_cols, valid)
+
+
+def unpack_responses(df, responses):
+    """ビット列に格納したx列をDataFrameに戻す"""
+    if responses is None:
+        return df
+    return pd.concat([df, responses.to_frame(index=df.index)], axis=1)
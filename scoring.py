@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+from blueprint import Blueprint
+
+# 問題パラメータの定義
+DOMAIN_PARAMS = {
+    'domain_1': ['x1', 'x2', 'x3', 'x4', 'x5', 'x6', 'x7', 'x8'],
+    'domain_2': ['x9', 'x10', 'x11', 'x12', 'x13', 'x14', 'x15', 'x16'],
+    'domain_3': ['x17', 'x18', 'x19', 'x20', 'x21', 'x22', 'x23', 'x24'],
+    'domain_4': ['x25', 'x26', 'x27', 'x28', 'x29', 'x30', 'x31', 'x32']
+}
+
+ABILITY_PARAMS = {
+    'ability_a': ['x1', 'x2', 'x9', 'x10', 'x17', 'x18', 'x25', 'x26'],
+    'ability_b': ['x3', 'x4', 'x11', 'x12', 'x19', 'x20', 'x27', 'x28'],
+    'ability_c': ['x5', 'x6', 'x13', 'x14', 'x21', 'x22', 'x29', 'x30'],
+    'ability_d': ['x7', 'x8', 'x15', 'x16', 'x23', 'x24', 'x31', 'x32']
+}
+
+QUESTION_COLS = [f'x{i}' for i in range(1, 33)]
+
+# 日本語表示用のマッピング
+DOMAIN_LABELS = {
+    'domain_1': '領域1',
+    'domain_2': '領域2',
+    'domain_3': '領域3',
+    'domain_4': '領域4'
+}
+
+ABILITY_LABELS = {
+    'ability_a': '能力A',
+    'ability_b': '能力B',
+    'ability_c': '能力C',
+    'ability_d': '能力D'
+}
+
+# 組み込みのテスト設計（32問・能力4×領域4）
+DEFAULT_BLUEPRINT = Blueprint.from_params(QUESTION_COLS, {
+    'ability': ('能力', ABILITY_PARAMS, ABILITY_LABELS),
+    'domain': ('領域', DOMAIN_PARAMS, DOMAIN_LABELS)
+})
+
+# float32の行列積で整数の合計が正確に表せる上限
+_FLOAT32_EXACT_LIMIT = 2 ** 24
+
+
+def build_incidence_matrix(columns, blueprint=DEFAULT_BLUEPRINT):
+    """問題×カテゴリの対応行列を作成
+
+    戻り値は (使用する問題列, カテゴリ名, 対応行列, カテゴリごとの満点)。
+    カテゴリはテスト設計の軸の順（組み込みの設計では能力・領域）に総合（'total'）を加えたもので、
+    データに問題が1つもないカテゴリは含めない。
+    """
+    return blueprint.compile(columns)
+
+
+def extract_item_block(df, item_cols):
+    """問題列を1つのNumPy配列として取り出す
+
+    欠損のない整数・真偽値の列は int8 で、それ以外は欠損を0とした float64 で返す。
+    """
+    items = df[item_cols]
+    if all(isinstance(t, np.dtype) and t.kind in 'iub' for t in items.dtypes):
+        values = items.to_numpy()
+        if values.size == 0 or (values.min() >= -128 and values.max() <= 127):
+            return values.astype(np.int8, copy=False)
+        return values.astype(np.int64, copy=False)
+    return np.nan_to_num(items.to_numpy(dtype=np.float64, na_value=np.nan), nan=0.0)
+
+
+def score_matrix(block, matrix):
+    """問題ブロックと対応行列の積でカテゴリ別得点を計算
+
+    戻り値は (行×カテゴリ) だが、カテゴリごとの列が連続するメモリ配置になっている。
+    """
+    # 転置側で積をとり、カテゴリごとの得点を連続した配列として得る
+    if block.dtype.kind in 'iub' and matrix.dtype.kind in 'iub':
+        # 整数の合計はfloat32で正確に表せる範囲ならBLASの行列積を使う
+        max_abs = int(np.abs(block).max()) if block.size else 0
+        max_weight = int(np.abs(matrix).sum(axis=0).max()) if matrix.size else 0
+        if max_abs * max_weight < _FLOAT32_EXACT_LIMIT:
+            product = matrix.T.astype(np.float32) @ block.T.astype(np.float32)
+            return product.astype(np.int64).T
+        return (matrix.T.astype(np.int64) @ block.T.astype(np.int64)).T
+    if block.dtype.kind in 'iub':
+        # 小数の重みでは整数の問題ブロックをfloat32に変換して積をとる（float64への変換でメモリを倍にしない）
+        return (matrix.T.astype(np.float32) @ block.T.astype(np.float32)).astype(np.float64).T
+    return (matrix.T.astype(np.float64) @ block.T).T
+
+
+def calculate_scores(df, responses=None, blueprint=DEFAULT_BLUEPRINT):
+    """テスト設計のカテゴリ別（組み込みの設計では能力別・領域別）の得点を計算
+
+    responses（ResponseStore）を渡した場合は、x列の代わりにビット列から
+    ポップカウントで得点を求める。得点率は満点（重み×小問の満点の合計）に対する割合。
+    小問の値は得点（部分点を含む）として扱い、欠損（無回答）は0点とする。
+    """
+    columns = df.columns if responses is None else responses.item_cols
+    item_cols, categories, matrix, max_points = build_incidence_matrix(columns, blueprint)
+    if not categories:
+        return df
+
+    if responses is None:
+        # 全カテゴリの素点を1回の行列積で求める
+        block = extract_item_block(df, item_cols)
+        scores = score_matrix(block, matrix)
+    else:
+        scores = responses.category_scores(matrix, item_cols)
+    # カテゴリごとに連続した配列にしてから列を組み立てる（列ごとのコピーを避ける）
+    scores = np.ascontiguousarray(scores.T)
+    rates = np.round(scores / max_points[:, np.newaxis] * 100, 1)
+
+    result = {}
+    for j, category in enumerate(categories):
+        result[f'{category}_score'] = scores[j]
+        result[f'{category}_rate'] = rates[j]
+    result_df = pd.DataFrame(result, index=df.index, copy=False)
+
+    existing = [c for c in result_df.columns if c in df.columns]
+    if existing:
+        # 再計算の場合は既存列を上書き
+        df = df.copy()
+        for col in result_df.columns:
+            df[col] = result_df[col]
+        return df
+    return pd.concat([df, result_df], axis=1)
@@ -0,0 +1,350 @@
+"""試験回（セッション）ごとの採点結果を蓄積する経年データの格納庫
+
+SQLiteのファイルに、試験回ごとの生徒別のカテゴリ得点と、学年×クラス×教科のセルごとの
+集計値（件数・合計・二乗和・最小・最大）を保存する。ファイルを追加するときは
+まだ格納されていない行だけを採点し、セルの集計値はその行の分だけ足し込む。
+生徒・クラスの推移は索引を使った問い合わせで求め、過去のファイルは読み直さない。
+
+    python session_store.py scores.sqlite 2025年度1学期 data/2025_1.csv --blueprint blueprint.yaml
+"""
+import argparse
+import contextlib
+import datetime
+import hashlib
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from aggregation import CUBE_DIMS, AggregateCube, get_score_columns
+from blueprint import TOTAL_CATEGORY, load_blueprint
+from ingest import read_score_file
+from response_store import pack_responses
+from scoring import DEFAULT_BLUEPRINT, calculate_scores
+
+# 総合のカテゴリの表示名
+TOTAL_LABEL = '総合'
+# 次元の列がないデータで使う値
+MISSING_DIM_VALUE = ''
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS session_files (
+    session_id INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    n_rows INTEGER NOT NULL,
+    PRIMARY KEY (session_id, content_hash)
+);
+CREATE TABLE IF NOT EXISTS categories (
+    session_id INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    axis TEXT,
+    axis_label TEXT,
+    label TEXT NOT NULL,
+    PRIMARY KEY (session_id, category)
+);
+CREATE TABLE IF NOT EXISTS student_scores (
+    student_id TEXT NOT NULL,
+    session_id INTEGER NOT NULL,
+    subject TEXT NOT NULL,
+    category TEXT NOT NULL,
+    grade TEXT NOT NULL,
+    class TEXT NOT NULL,
+    score REAL,
+    rate REAL,
+    PRIMARY KEY (student_id, session_id, subject, category)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cell_stats (
+    grade TEXT NOT NULL,
+    class TEXT NOT NULL,
+    session_id INTEGER NOT NULL,
+    subject TEXT NOT NULL,
+    col TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    sumsq REAL NOT NULL,
+    min REAL,
+    max REAL,
+    PRIMARY KEY (grade, class, session_id, subject, col)
+) WITHOUT ROWID;
+"""
+
+# 同じセルの集計値は件数・合計・二乗和を足し、最小・最大を取り直す（欠損のNULLは無視）
+_UPSERT_CELL_STATS = """
+INSERT INTO cell_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (grade, class, session_id, subject, col) DO UPDATE SET
+    n = n + excluded.n,
+    sum = sum + excluded.sum,
+    sumsq = sumsq + excluded.sumsq,
+    min = coalesce(min(min, excluded.min), min, excluded.min),
+    max = coalesce(max(max, excluded.max), max, excluded.max)
+"""
+
+# セルの集計値の次元（集計キューブの次元の前に試験回を加える）
+SESSION_CUBE_DIMS = ['session_id'] + CUBE_DIMS
+
+
+def compute_content_hash(file_bytes):
+    """ファイル内容のハッシュ値を計算"""
+    return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+
+class SessionStore:
+    """試験回ごとの採点結果と集計値を保持するSQLiteの格納庫
+
+    生徒別の得点は (生徒ID, 試験回, 教科, カテゴリ) を主キーにした縦持ちの表で、
+    生徒の推移は主キーの先頭（生徒ID）の範囲を読むだけで求まる。
+    セルの集計値は (学年, クラス, 試験回, 教科, 列) を主キーにし、クラスの推移も同様に求める。
+    操作ごとに接続を開くため、複数のスレッドから使える。
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _query(self, sql, params=()):
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def version(self):
+        """格納内容の版（ファイルを追加するたびに変わる値。キャッシュのキーに使う）"""
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*), COALESCE(SUM(n_rows), 0) FROM session_files').fetchone()
+
+    def sessions(self):
+        """試験回の一覧（追加した順、列: session_id, name, created_at, n_files, n_rows）"""
+        return self._query("""
+            SELECT s.session_id, s.name, s.created_at,
+                   COUNT(f.content_hash) AS n_files, COALESCE(SUM(f.n_rows), 0) AS n_rows
+            FROM sessions s LEFT JOIN session_files f USING (session_id)
+            GROUP BY s.session_id ORDER BY s.session_id
+        """)
+
+    def classes(self):
+        """格納されている (学年, クラス) の一覧"""
+        return self._query('SELECT DISTINCT grade, class FROM cell_stats ORDER BY grade, class')
+
+    def subjects(self):
+        """格納されている教科の一覧"""
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute('SELECT DISTINCT subject FROM cell_stats ORDER BY subject')]
+
+    def append_session(self, name, file_bytes, blueprint=DEFAULT_BLUEPRINT, content_hash=None):
+        """ファイルを試験回 name に追加し、新たに格納した行数を返す
+
+        試験回がなければ作成する。同じ内容のファイル（content_hash、省略時はファイル内容のハッシュ）を
+        同じ試験回に追加済みの場合は何もしない。ファイル内で (生徒ID, 教科) が重複する行は最後の行だけを使い、
+        試験回に格納済みの (生徒ID, 教科) の行は除いてから採点して、セルの集計値には新しい行の分だけを足し込む
+        （生徒別の得点とセルの集計値が同じ行から作られるようにする）。
+        """
+        content_hash = content_hash or compute_content_hash(file_bytes)
+        with self._connect() as conn:
+            session_id = self._ensure_session(conn, name)
+            if conn.execute('SELECT 1 FROM session_files WHERE session_id = ? AND content_hash = ?',
+                            (session_id, content_hash)).fetchone():
+                return 0
+
+            df = read_score_file(file_bytes, blueprint.items)
+            if 'ID' not in df.columns:
+                raise ValueError('ID列がないため経年データに追加できません')
+            df = self._normalize_keys(df)
+            df = df.drop_duplicates(['ID', 'subject'], keep='last')
+            df = self._drop_stored_rows(conn, session_id, df)
+            if len(df):
+                df, responses = pack_responses(df, blueprint.items)
+                df = calculate_scores(df, responses, blueprint)
+                self._insert_scores(conn, session_id, df)
+                self._upsert_cell_stats(conn, session_id, df)
+                self._insert_categories(conn, session_id, df, blueprint)
+            conn.execute('INSERT INTO session_files VALUES (?, ?, ?)', (session_id, content_hash, len(df)))
+        return len(df)
+
+    @staticmethod
+    def _ensure_session(conn, name):
+        row = conn.execute('SELECT session_id FROM sessions WHERE name = ?', (name,)).fetchone()
+        if row:
+            return row[0]
+        created_at = datetime.datetime.now().isoformat(timespec='seconds')
+        return conn.execute('INSERT INTO sessions (name, created_at) VALUES (?, ?)', (name, created_at)).lastrowid
+
+    @staticmethod
+    def _normalize_keys(df):
+        """生徒ID・学年・クラス・教科を文字列にそろえる（ない列は空文字列）"""
+        df = df.copy()
+        df['ID'] = df['ID'].astype(str)
+        for dim in CUBE_DIMS:
+            if dim in df.columns:
+                df[dim] = df[dim].astype(str).astype('category')
+            else:
+                df[dim] = pd.Categorical([MISSING_DIM_VALUE] * len(df))
+        return df
+
+    @staticmethod
+    def _drop_stored_rows(conn, session_id, df):
+        """試験回に格納済みの (生徒ID, 教科) の行を除く（主キーの索引で照合）"""
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS incoming (student_id TEXT, subject TEXT)')
+        conn.execute('DELETE FROM incoming')
+        conn.executemany('INSERT INTO incoming VALUES (?, ?)',
+                         zip(df['ID'].tolist(), df['subject'].astype(str).tolist()))
+        stored = conn.execute("""
+            SELECT DISTINCT i.student_id, i.subject FROM incoming i
+            JOIN student_scores s ON s.student_id = i.student_id AND s.session_id = ? AND s.subject = i.subject
+        """, (session_id,)).fetchall()
+        conn.execute('DELETE FROM incoming')
+        if not stored:
+            return df
+        keys = pd.MultiIndex.from_arrays([df['ID'], df['subject'].astype(str)])
+        return df[~keys.isin(stored)]
+
+    @staticmethod
+    def _insert_scores(conn, session_id, df):
+        """生徒別のカテゴリ得点を縦持ちで追加"""
+        categories = [c[:-len('_score')] for c in df.columns
+                      if c.endswith('_score') and f'{c[:-len("_score")]}_rate' in df.columns]
+        ids = df['ID'].tolist()
+        subjects = df['subject'].astype(str).tolist()
+        grades = df['grade'].astype(str).tolist()
+        classes = df['class'].astype(str).tolist()
+        for category in categories:
+            scores = df[f'{category}_score'].to_numpy(dtype=np.float64).tolist()
+            rates = df[f'{category}_rate'].to_numpy(dtype=np.float64).tolist()
+            conn.executemany(
+                'INSERT OR REPLACE INTO student_scores VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                zip(ids, [session_id] * len(ids), subjects, [category] * len(ids), grades, classes, scores, rates)
+            )
+
+    @staticmethod
+    def _upsert_cell_stats(conn, session_id, df):
+        """新しい行だけで作った集計キューブのセルをセルの集計値に足し込む"""
+        cube = AggregateCube.from_frame(df, CUBE_DIMS, get_score_columns(df))
+        stacked = pd.DataFrame({stat: cube.cells[stat].stack() for stat in AggregateCube.STATS})
+        stacked = stacked[stacked['n'] > 0]
+        keys = stacked.index
+        rows = zip(
+            keys.get_level_values('grade').astype(str).tolist(),
+            keys.get_level_values('class').astype(str).tolist(),
+            [session_id] * len(stacked),
+            keys.get_level_values('subject').astype(str).tolist(),
+            keys.get_level_values(-1).tolist(),
+            stacked['n'].astype(np.int64).tolist(),
+            stacked['sum'].tolist(),
+            stacked['sumsq'].tolist(),
+            stacked['min'].tolist(),
+            stacked['max'].tolist(),
+        )
+        conn.executemany(_UPSERT_CELL_STATS, rows)
+
+    @staticmethod
+    def _insert_categories(conn, session_id, df, blueprint):
+        """試験回のカテゴリの軸・表示名を記録"""
+        rows = []
+        for col in df.columns:
+            if not col.endswith('_score'):
+                continue
+            category = col[:-len('_score')]
+            if category == TOTAL_CATEGORY:
+                rows.append((session_id, category, None, None, TOTAL_LABEL))
+            elif category in blueprint.category_axis:
+                axis = blueprint.category_axis[category]
+                rows.append((session_id, category, axis, blueprint.axes[axis], blueprint.category_labels[category]))
+        conn.executemany('INSERT OR IGNORE INTO categories VALUES (?, ?, ?, ?, ?)', rows)
+
+    def student_trajectory(self, student_id):
+        """生徒の試験回ごとのカテゴリ得点
+
+        列は session_id, name（試験回）, subject, grade, class, category, axis, axis_label, label, score, rate。
+        試験回の追加順に並ぶ。
+        """
+        return self._query("""
+            SELECT s.session_id, ss.name, s.subject, s.grade, s.class, s.category,
+                   c.axis, c.axis_label, COALESCE(c.label, s.category) AS label, s.score, s.rate
+            FROM student_scores s
+            JOIN sessions ss USING (session_id)
+            LEFT JOIN categories c ON c.session_id = s.session_id AND c.category = s.category
+            WHERE s.student_id = ?
+            ORDER BY s.session_id, s.subject, c.axis, s.category
+        """, (str(student_id),))
+
+    def session_cube(self, where=None):
+        """条件（{学年・クラス・教科: 値のリスト}）に該当するセルの集計値から試験回を次元に含む集計キューブを作成"""
+        clauses = []
+        params = []
+        for dim, values in (where or {}).items():
+            if dim not in CUBE_DIMS:
+                raise KeyError(f'経年データに次元 {dim} がありません')
+            values = [str(v) for v in (values if isinstance(values, (list, tuple, set)) else [values])]
+            clauses.append(f'"{dim}" IN ({", ".join("?" * len(values))})')
+            params += values
+        sql = 'SELECT session_id, grade, class, subject, col, n, sum, sumsq, min, max FROM cell_stats'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        cells = self._query(sql, params)
+        if cells.empty:
+            return None
+        cells = cells.set_index(SESSION_CUBE_DIMS + ['col'])
+        tables = {stat: cells[stat].unstack('col') for stat in AggregateCube.STATS}
+        tables['n'] = tables['n'].fillna(0)
+        for stat in ('sum', 'sumsq'):
+            tables[stat] = tables[stat].fillna(0.0)
+        return AggregateCube(SESSION_CUBE_DIMS, list(tables['n'].columns), tables)
+
+    def group_trajectory(self, where=None, by=()):
+        """条件に該当する生徒の試験回ごとのカテゴリ得点率の統計量（クラス・学年などの推移）
+
+        by に次元（'class' など）を指定すると、試験回×その値ごとに求める。列は session_id, name（試験回）,
+        by の次元, category, axis, axis_label, label, n, mean, std, min, max。
+        セルの集計値を試験回ごとに合算して求めるため、生徒別の得点は読まない。
+        """
+        by = list(by)
+        columns = ['session_id', 'name'] + by + ['category', 'axis', 'axis_label', 'label',
+                                                 'n', 'mean', 'std', 'min', 'max']
+        cube = self.session_cube(where)
+        if cube is None:
+            return pd.DataFrame(columns=columns)
+        rate_cols = [c for c in cube.value_cols if c.endswith('_rate')]
+        rolled = cube.rollup(['session_id'] + by)[rate_cols]
+        rolled.columns = rolled.columns.set_names(['col', 'stat'])
+        stats = rolled.stack('col', future_stack=True).reset_index()
+        stats['category'] = stats['col'].str[:-len('_rate')]
+        stats = stats.drop(columns='col')
+
+        labels = self._query('SELECT session_id, category, axis, axis_label, label FROM categories')
+        sessions = self._query('SELECT session_id, name FROM sessions')
+        stats = stats.merge(sessions, on='session_id').merge(labels, on=['session_id', 'category'], how='left')
+        stats['label'] = stats['label'].fillna(stats['category'])
+        return stats[columns].sort_values(['session_id'] + by + ['category']).reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='成績ファイルを経年データの格納庫に追加')
+    parser.add_argument('store', help='格納庫のSQLiteファイル（なければ作成）')
+    parser.add_argument('session', help='試験回の名前（例: 2025年度1学期）')
+    parser.add_argument('files', nargs='+', help='追加する成績ファイル（CSV・Parquet・Arrow IPC）')
+    parser.add_argument('--blueprint', help='テスト設計ファイル（YAML・JSON・CSV、既定: 能力・領域パラメータ）')
+    args = parser.parse_args(argv)
+
+    blueprint = load_blueprint(args.blueprint) if args.blueprint else DEFAULT_BLUEPRINT
+    store = SessionStore(args.store)
+    for path in args.files:
+        with open(path, 'rb') as f:
+            n_rows = store.append_session(args.session, f.read(), blueprint)
+        print(f'{path}: {n_rows:,}行を追加')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
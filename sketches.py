@@ -0,0 +1,210 @@
+import numpy as np
+
+# 既定の精度パラメータ（大きいほど誤差が小さく、メモリを多く使う）
+DEFAULT_SKETCH_K = 200
+# 下のレベルほど容量を小さくする割合
+_CAPACITY_DECAY = 2 / 3
+
+
+class QuantileSketch:
+    """KLL方式の分位点スケッチ
+
+    値をレベルごとの圧縮器に保持し、容量を超えたレベルは整列して1つおきに
+    上のレベル（重み2倍）へ送る。順位の誤差はおおむね 1.7/k 以下、保持する値の数は O(k log(n/k))。
+    同じ k のスケッチ同士は merge で結合できるため、チャンクやグループごとに作って後から合算できる。
+    件数が k 以下で圧縮が起きていない間は元の値をそのまま保持し、分位点は正確な値になる。
+    """
+
+    def __init__(self, k=DEFAULT_SKETCH_K, seed=0):
+        self.k = k
+        self.n = 0
+        self.min = np.nan
+        self.max = np.nan
+        self._levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.n
+
+    def __getstate__(self):
+        return {'data': self.to_bytes()}
+
+    def __setstate__(self, state):
+        self.__dict__.update(QuantileSketch.from_bytes(state['data']).__dict__)
+
+    def to_bytes(self):
+        """スケッチをバイト列に変換（from_bytes で復元できる）"""
+        header = np.array([self.k, self.n, len(self._levels)], dtype='<i8')
+        bounds = np.array([self.min, self.max], dtype='<f8')
+        sizes = np.array([len(items) for items in self._levels], dtype='<i8')
+        items = np.concatenate(self._levels).astype('<f8')
+        return header.tobytes() + bounds.tobytes() + sizes.tobytes() + items.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data, seed=0):
+        """to_bytes で作成したバイト列からスケッチを復元"""
+        k, n, n_levels = np.frombuffer(data, dtype='<i8', count=3)
+        sketch = cls(int(k), seed)
+        sketch.n = int(n)
+        sketch.min, sketch.max = np.frombuffer(data, dtype='<f8', count=2, offset=24).tolist()
+        sizes = np.frombuffer(data, dtype='<i8', count=n_levels, offset=40)
+        items = np.frombuffer(data, dtype='<f8', offset=40 + 8 * int(n_levels))
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        sketch._levels = [items[a:b].copy() for a, b in zip(offsets[:-1], offsets[1:])]
+        return sketch
+
+    @property
+    def is_exact(self):
+        """圧縮が起きておらず元の値をすべて保持しているか"""
+        return len(self._levels) == 1
+
+    @property
+    def n_retained(self):
+        """保持している値の数"""
+        return sum(len(items) for items in self._levels)
+
+    def _capacity(self, level):
+        depth = len(self._levels) - level - 1
+        return max(int(np.ceil(self.k * _CAPACITY_DECAY ** depth)), 2)
+
+    def _compress(self):
+        """容量を超えたレベルを下から順に圧縮"""
+        level = 0
+        while level < len(self._levels):
+            items = self._levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self._levels):
+                    self._levels.append(np.empty(0))
+                items = np.sort(items)
+                # 奇数個の場合は最小の1個をこのレベルに残す
+                keep = len(items) % 2
+                promoted = items[keep + self._rng.integers(2)::2]
+                self._levels[level] = items[:keep]
+                self._levels[level + 1] = np.concatenate([self._levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values):
+        """値（配列）を追加（欠損は無視）"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.n += len(values)
+        self.min = values.min() if np.isnan(self.min) else min(self.min, values.min())
+        self.max = values.max() if np.isnan(self.max) else max(self.max, values.max())
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """別のスケッチの内容をこのスケッチに結合（自身を返す）"""
+        if other.n == 0:
+            return self
+        while len(self._levels) < len(other._levels):
+            self._levels.append(np.empty(0))
+        for level, items in enumerate(other._levels):
+            self._levels[level] = np.concatenate([self._levels[level], items])
+        self.n += other.n
+        self.min = other.min if np.isnan(self.min) else min(self.min, other.min)
+        self.max = other.max if np.isnan(self.max) else max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _sorted_items(self):
+        """保持している値（昇順）と各値の重みの累積和"""
+        items = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(len(level), 2 ** h, dtype=np.float64)
+                                  for h, level in enumerate(self._levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantile(self, q):
+        """分位点（q は 0〜1 のスカラーまたは配列）"""
+        q = np.asarray(q, dtype=np.float64)
+        if self.n == 0:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+        if self.is_exact:
+            return np.quantile(self._levels[0], q)
+        items, cumulative = self._sorted_items()
+        positions = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        result = items[np.clip(positions, 0, len(items) - 1)]
+        result = np.where(q <= 0, self.min, np.where(q >= 1, self.max, result))
+        return result if q.ndim else float(result)
+
+    def rank(self, values, inclusive=True):
+        """値以下（inclusive=False の場合は値未満）の割合（values はスカラーまたは配列）"""
+        values = np.asarray(values, dtype=np.float64)
+        if self.n == 0:
+            return np.full(values.shape, np.nan) if values.ndim else np.nan
+        items, cumulative = self._sorted_items()
+        positions = np.searchsorted(items, values, side='right' if inclusive else 'left')
+        below = np.concatenate([[0.0], cumulative])[positions]
+        result = below / cumulative[-1]
+        return result if values.ndim else float(result)
+
+
+class GroupSketches:
+    """グループ（次元の値の組）×列ごとの分位点スケッチ
+
+    学年×クラス×教科などのセルごとにスケッチを持ち、任意のセルの組み合わせの
+    分位点・順位はセルのスケッチを合算して求める。
+    """
+
+    def __init__(self, dims, k=DEFAULT_SKETCH_K):
+        self.dims = list(dims)
+        self.k = k
+        # {セルのキー（次元の値のタプル）: {列: QuantileSketch}}
+        self.cells = {}
+
+    @classmethod
+    def from_frame(cls, df, dims, value_cols, k=DEFAULT_SKETCH_K):
+        """DataFrameから作成（df にない次元は使わない）"""
+        sketches = cls([d for d in dims if d in df.columns], k)
+        return sketches.update(df, value_cols)
+
+    def update(self, df, value_cols):
+        """DataFrameの行をセルごとのスケッチに追加（自身を返す）"""
+        if self.dims:
+            groups = df.groupby(self.dims, sort=False, observed=True, dropna=False).indices
+        else:
+            groups = {(): np.arange(len(df))}
+        columns = {col: df[col].to_numpy() for col in value_cols if col in df.columns}
+        for key, rows in groups.items():
+            key = key if isinstance(key, tuple) else (key,)
+            cell = self.cells.setdefault(key, {})
+            for col, values in columns.items():
+                cell.setdefault(col, QuantileSketch(self.k)).update(values[rows])
+        return self
+
+    def merge(self, other):
+        """別のスケッチ表の内容をこの表に結合（自身を返す）"""
+        if self.dims != other.dims:
+            raise ValueError('次元が異なるスケッチ表は結合できません')
+        for key, other_cell in other.cells.items():
+            cell = self.cells.setdefault(key, {})
+            for col, sketch in other_cell.items():
+                cell.setdefault(col, QuantileSketch(self.k)).merge(sketch)
+        return self
+
+    def _matches(self, key, where):
+        for dim, value in (where or {}).items():
+            if dim not in self.dims:
+                raise KeyError(f'スケッチ表に次元 {dim} がありません')
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            if key[self.dims.index(dim)] not in values:
+                return False
+        return True
+
+    def subset(self, where=None):
+        """条件（{次元: 値 または 値のリスト}）に該当するセルだけのスケッチ表"""
+        subset = GroupSketches(self.dims, self.k)
+        subset.cells = {key: cell for key, cell in self.cells.items() if self._matches(key, where)}
+        return subset
+
+    def sketch(self, col, where=None):
+        """条件に該当するセルを合算した列のスケッチ"""
+        combined = QuantileSketch(self.k)
+        for key, cell in self.cells.items():
+            if col in cell and self._matches(key, where):
+                combined.merge(cell[col])
+        return combined
@@ -0,0 +1,438 @@
+"""埋め込みデータベース（SQLite）で集計するバックエンド
+
+採点済みのデータをSQLiteのファイルに格納し、カテゴリ別・教科別の統計量、教科×カテゴリの
+クロス集計、小問別正答率の元になる集計をデータベース側の集約（GROUP BY）で求める。
+Pythonに戻すのは学年×クラス×教科のセルごとの集計値や値ごとの件数などの小さな結果だけなので、
+全行をメモリに読み込めない大きさのデータ（複数年度・複数校）も扱える。
+
+    python sql_backend.py scores.sqlite 2024年度全校 data/school_*.csv --blueprint blueprint.yaml
+"""
+import argparse
+import contextlib
+import datetime
+import hashlib
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from aggregation import CUBE_DIMS, AggregateCube, get_aggregate_value_cols, get_score_columns, rollup_group_aggregates
+from blueprint import load_blueprint
+from ingest import STREAM_BLOCK_BYTES, iter_frames
+from scoring import DEFAULT_BLUEPRINT, calculate_scores
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    dataset TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    table_name TEXT NOT NULL UNIQUE,
+    blueprint_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dataset_files (
+    dataset TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    n_rows INTEGER NOT NULL,
+    PRIMARY KEY (dataset, content_hash)
+);
+"""
+
+# セルの集計値の統計量（AggregateCube.STATS）ごとのSQLの集約式（TOTAL は欠損だけの場合に0を返す）
+_STAT_EXPRS = {
+    'n': 'COUNT({0})',
+    'sum': 'TOTAL({0})',
+    'sumsq': 'TOTAL({0} * {0})',
+    'min': 'MIN({0})',
+    'max': 'MAX({0})',
+}
+# グループ別統計量で中央値を求める列（教科別の統計量で使う列）
+GROUP_MEDIAN_COLS = ('total_rate',)
+# ファイルのハッシュ値を計算するときに一度に読む大きさ（バイト）
+_HASH_BLOCK_BYTES = 1 << 20
+
+
+def _quote(name):
+    """SQLの識別子（列名・表名）を引用符で囲む"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def compute_source_hash(source):
+    """バイト列・パスの内容のハッシュ値を計算（パスは分割して読む）"""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    else:
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK_BYTES), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def combine_where(where, other=None):
+    """2つの条件（{次元: 値のリスト}）を重ねた条件（同じ次元は両方に含まれる値だけにする）"""
+    combined = {}
+    for conditions in (where or {}, other or {}):
+        for dim, values in conditions.items():
+            values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+            if dim in combined:
+                values = [v for v in combined[dim] if v in values]
+            combined[dim] = values
+    return combined
+
+
+def _where_key(where):
+    """条件を結果の保持に使えるキーにする"""
+    return tuple(sorted((dim, tuple(values)) for dim, values in where.items()))
+
+
+class ValueDistribution:
+    """値ごとの件数から作る正確な分布
+
+    データベースの GROUP BY で求めた (値, 件数) を持ち、分位点スケッチ（QuantileSketch）と同じ
+    n・min・max・quantile・rank を提供する。得点率は小数第1位に丸めているため、値の種類は行数によらず少ない。
+    """
+
+    def __init__(self, values, counts):
+        values = np.asarray(values, dtype=np.float64)
+        order = np.argsort(values, kind='stable')
+        self.values = values[order]
+        self._cumulative = np.cumsum(np.asarray(counts, dtype=np.int64)[order])
+        self.n = int(self._cumulative[-1]) if len(self._cumulative) else 0
+        self.min = float(self.values[0]) if self.n else np.nan
+        self.max = float(self.values[-1]) if self.n else np.nan
+
+    def __len__(self):
+        return self.n
+
+    def _value_at(self, positions):
+        """昇順に並べたときの位置（0始まり）の値"""
+        return self.values[np.searchsorted(self._cumulative, positions, side='right')]
+
+    def quantile(self, q):
+        """分位点（np.quantile の線形補間と同じ方法、q は 0〜1 のスカラーまたは配列）"""
+        q = np.asarray(q, dtype=np.float64)
+        if self.n == 0:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+        position = q * (self.n - 1)
+        lower = np.floor(position)
+        low = self._value_at(lower)
+        high = self._value_at(np.minimum(lower + 1, self.n - 1))
+        result = low + (high - low) * (position - lower)
+        return result if q.ndim else float(result)
+
+    def rank(self, values, inclusive=True):
+        """値以下（inclusive=False の場合は値未満）の割合（values はスカラーまたは配列）"""
+        values = np.asarray(values, dtype=np.float64)
+        if self.n == 0:
+            return np.full(values.shape, np.nan) if values.ndim else np.nan
+        positions = np.searchsorted(self.values, values, side='right' if inclusive else 'left')
+        result = np.concatenate([[0], self._cumulative])[positions] / self.n
+        return result if values.ndim else float(result)
+
+
+class SqlBackend:
+    """採点済みのデータセットを格納するSQLiteのデータベース
+
+    データセットごとに1つの表（1行が生徒×教科、列は生徒ID・学年・クラス・教科・小問・素点・得点率）を持ち、
+    複数のファイル（学校・年度など）を同じデータセットに追加できる。操作ごとに接続を開くため、
+    複数のスレッドから使える。
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _fetch(self, sql, params=()):
+        with self._connect() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def datasets(self, blueprint_hash=None):
+        """データセットの一覧（列: dataset, label, blueprint_hash, created_at, n_files, n_rows）
+
+        blueprint_hash を指定すると、そのテスト設計で採点したデータセットだけを返す。
+        """
+        sql = """
+            SELECT d.dataset, d.label, d.blueprint_hash, d.created_at,
+                   COUNT(f.content_hash) AS n_files, COALESCE(SUM(f.n_rows), 0) AS n_rows
+            FROM datasets d LEFT JOIN dataset_files f USING (dataset)
+        """
+        params = ()
+        if blueprint_hash is not None:
+            sql += ' WHERE d.blueprint_hash = ?'
+            params = (blueprint_hash,)
+        sql += ' GROUP BY d.dataset ORDER BY d.created_at, d.dataset'
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def load_file(self, dataset, source, blueprint=DEFAULT_BLUEPRINT, blueprint_hash='', label=None,
+                  content_hash=None, block_bytes=STREAM_BLOCK_BYTES):
+        """ファイルを分割して読み、チャンクごとに採点してデータセットの表に追加し、追加した行数を返す
+
+        source はバイト列・パス・ファイルオブジェクト。データセットがなければ作成する。
+        同じ内容のファイル（content_hash、省略時はファイル内容のハッシュ）を追加済みの場合は何もしない。
+        blueprint_hash はテスト設計の識別子（既定の設計は空文字列）で、別の設計のデータセットには追加できない。
+        """
+        content_hash = content_hash or compute_source_hash(source)
+        with self._connect() as conn:
+            table = self._ensure_dataset(conn, dataset, label or dataset, blueprint_hash)
+            if conn.execute('SELECT 1 FROM dataset_files WHERE dataset = ? AND content_hash = ?',
+                            (dataset, content_hash)).fetchone():
+                return 0
+            try:
+                n_rows = self._insert_frames(conn, table, iter_frames(source, block_bytes, items=blueprint.items),
+                                             blueprint)
+            except pa.ArrowInvalid:
+                # 小問に小数を含むCSVは、追加した分を取り消して小問を小数として最初から読み直す
+                conn.rollback()
+                if hasattr(source, 'seek'):
+                    source.seek(0)
+                table = self._ensure_dataset(conn, dataset, label or dataset, blueprint_hash)
+                n_rows = self._insert_frames(
+                    conn, table, iter_frames(source, block_bytes, typed=False, items=blueprint.items), blueprint)
+            self._create_indexes(conn, table)
+            conn.execute('INSERT INTO dataset_files VALUES (?, ?, ?)', (dataset, content_hash, n_rows))
+        return n_rows
+
+    @staticmethod
+    def _ensure_dataset(conn, dataset, label, blueprint_hash):
+        row = conn.execute('SELECT table_name, blueprint_hash FROM datasets WHERE dataset = ?', (dataset,)).fetchone()
+        if row:
+            if row[1] != blueprint_hash:
+                raise ValueError(f'データセット {label} は別のテスト設計で採点されています')
+            return row[0]
+        table = 'data_' + hashlib.blake2b(dataset.encode(), digest_size=8).hexdigest()
+        created_at = datetime.datetime.now().isoformat(timespec='seconds')
+        conn.execute('INSERT INTO datasets VALUES (?, ?, ?, ?, ?)', (dataset, label, table, blueprint_hash, created_at))
+        return table
+
+    @staticmethod
+    def _table_columns(conn, table):
+        return [row[1] for row in conn.execute(f'PRAGMA table_info({_quote(table)})')]
+
+    def _insert_frames(self, conn, table, frames, blueprint):
+        """チャンクを採点して表に追加（表にない列は追加する）"""
+        n_rows = 0
+        for frame in frames:
+            frame = calculate_scores(frame, blueprint=blueprint)
+            columns = [c for c in ['ID'] + CUBE_DIMS if c in frame.columns]
+            columns += [q for q in blueprint.items if q in frame.columns] + get_score_columns(frame)
+            existing = self._table_columns(conn, table)
+            if not existing:
+                conn.execute(f'CREATE TABLE {_quote(table)} ({", ".join(map(_quote, columns))})')
+            for col in columns:
+                if existing and col not in existing:
+                    conn.execute(f'ALTER TABLE {_quote(table)} ADD COLUMN {_quote(col)}')
+            conn.executemany(
+                f'INSERT INTO {_quote(table)} ({", ".join(map(_quote, columns))}) '
+                f'VALUES ({", ".join("?" * len(columns))})',
+                zip(*[frame[col].tolist() for col in columns])
+            )
+            n_rows += len(frame)
+        return n_rows
+
+    def _create_indexes(self, conn, table):
+        """絞り込みに使う学年・クラス・教科の索引を作成"""
+        columns = self._table_columns(conn, table)
+        dims = [d for d in CUBE_DIMS if d in columns]
+        if dims:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {_quote(table + "_cell")} '
+                         f'ON {_quote(table)} ({", ".join(map(_quote, dims))})')
+        if 'subject' in columns:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {_quote(table + "_subject")} ON {_quote(table)} ("subject")')
+
+    def dataset(self, dataset, blueprint=DEFAULT_BLUEPRINT):
+        """データセットの集計の問い合わせ（SqlDataset）を返す"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT table_name FROM datasets WHERE dataset = ?', (dataset,)).fetchone()
+            if not row:
+                raise KeyError(f'データセット {dataset} がありません')
+            columns = self._table_columns(conn, row[0])
+        return SqlDataset(self, row[0], columns, blueprint)
+
+
+class SqlDataset:
+    """データベースの表のうち条件に該当する行の集計
+
+    StreamingAggregates と同じ問い合わせ（summary・sketch・group_aggregates・item_correct_counts など）を持つ。
+    統計量は学年×クラス×教科のセルごとの集計値（GROUP BY）から作る集計キューブで、
+    分布は値ごとの件数から求める。結果はインスタンスに保持し、同じ問い合わせは繰り返さない。
+    """
+
+    def __init__(self, backend, table, columns, blueprint=DEFAULT_BLUEPRINT, where=None):
+        self.backend = backend
+        self.table = table
+        self.columns = list(columns)
+        self.blueprint = blueprint
+        self.where = dict(where or {})
+        self.dims = [d for d in CUBE_DIMS if d in self.columns]
+        self.item_cols = [q for q in blueprint.items if q in self.columns]
+        self.value_cols = [c for c in self.columns if c.endswith('_score') or c.endswith('_rate')]
+        self._results = {}
+
+    def _memo(self, key, compute):
+        if key not in self._results:
+            self._results[key] = compute()
+        return self._results[key]
+
+    def _where_sql(self, where, extra=()):
+        """条件のWHERE句とパラメータ（extra は追加の条件式）"""
+        clauses = list(extra)
+        params = []
+        for dim, values in where.items():
+            if dim not in self.dims:
+                raise KeyError(f'データベースの表に次元 {dim} がありません')
+            clauses.append(f'{_quote(dim)} IN ({", ".join("?" * len(values))})')
+            params += list(values)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def _select(self, select, where=None, extra=(), group_by=()):
+        where_sql, params = self._where_sql(combine_where(self.where, where), extra)
+        sql = f'SELECT {select} FROM {_quote(self.table)}{where_sql}'
+        if group_by:
+            sql += ' GROUP BY ' + ', '.join(map(_quote, group_by))
+        return self.backend._fetch(sql, params)
+
+    @property
+    def n_rows(self):
+        """条件に該当する行数"""
+        return self._memo('n_rows', lambda: self._select('COUNT(*)')[0][0])
+
+    def values(self, dim):
+        """次元の値の一覧（昇順）"""
+        if dim not in self.dims:
+            return []
+        rows = self._memo(('values', dim), lambda: self._select(
+            f'DISTINCT {_quote(dim)}', extra=[f'{_quote(dim)} IS NOT NULL']))
+        return sorted(row[0] for row in rows)
+
+    def subset(self, where=None):
+        """条件（{次元: 値のリスト}）をさらに重ねた集計"""
+        if not where:
+            return self
+        return SqlDataset(self.backend, self.table, self.columns, self.blueprint, combine_where(self.where, where))
+
+    @property
+    def cube(self):
+        """学年×クラス×教科のセルごとの集計値から作った集計キューブ"""
+        return self._memo('cube', self._build_cube)
+
+    def _build_cube(self):
+        stats = AggregateCube.STATS
+        exprs = [_STAT_EXPRS[stat].format(_quote(col)) for col in self.value_cols for stat in stats]
+        rows = self._select(', '.join(list(map(_quote, self.dims)) + exprs), group_by=self.dims)
+        n_dims = len(self.dims)
+        values = np.array([row[n_dims:] for row in rows], dtype=np.float64)
+        values = values.reshape(len(rows), len(self.value_cols), len(stats))
+        if self.dims:
+            index = pd.MultiIndex.from_arrays([[row[i] for row in rows] for i in range(n_dims)], names=self.dims)
+        else:
+            index = pd.RangeIndex(len(rows))
+        cells = {stat: pd.DataFrame(values[:, :, k], index=index, columns=self.value_cols)
+                 for k, stat in enumerate(stats)}
+        cells['n'] = cells['n'].astype(np.int64)
+        return AggregateCube(self.dims, self.value_cols, cells)
+
+    def summary(self, where=None):
+        """全体の統計量（行: 対象列, 列: 統計量）"""
+        return self.cube.summary(where)
+
+    def sketch(self, col, where=None):
+        """条件に該当する行の列の分布（ValueDistribution）"""
+        combined = combine_where(self.where, where)
+        return self._memo(('distribution', col, _where_key(combined)), lambda: self._distribution(col, combined))
+
+    def _distribution(self, col, where):
+        rows = self.backend._fetch(*self._distribution_sql(col, where))
+        return ValueDistribution([row[0] for row in rows], [row[1] for row in rows])
+
+    def _distribution_sql(self, col, where, by=()):
+        where_sql, params = self._where_sql(where, [f'{_quote(col)} IS NOT NULL'])
+        keys = ', '.join(list(map(_quote, by)) + [_quote(col)])
+        return f'SELECT {keys}, COUNT(*) FROM {_quote(self.table)}{where_sql} GROUP BY {keys}', params
+
+    def _prefetch_distributions(self, col, by):
+        """グループ（by の値）ごとの分布を1回の問い合わせで求めて保持"""
+        rows = self.backend._fetch(*self._distribution_sql(col, self.where, [by]))
+        groups = {}
+        for group, value, count in rows:
+            groups.setdefault(group, ([], []))
+            groups[group][0].append(value)
+            groups[group][1].append(count)
+        for group in self.values(by):
+            values, counts = groups.get(group, ([], []))
+            key = ('distribution', col, _where_key(combine_where(self.where, {by: [group]})))
+            self._results.setdefault(key, ValueDistribution(values, counts))
+
+    def group_aggregates(self, by='subject', median_cols=GROUP_MEDIAN_COLS):
+        """compute_group_aggregates と同じ形式のグループ別統計量
+
+        中央値は値ごとの件数から正確に求める。列ごとに表を走査するため、median_cols の列だけ求める
+        （None の場合は全列、それ以外の列の中央値は欠損）。
+        """
+        if by not in self.dims:
+            return pd.DataFrame()
+
+        def compute():
+            value_cols = get_aggregate_value_cols(pd.DataFrame(columns=self.value_cols))
+            for col in value_cols:
+                if median_cols is None or col in median_cols:
+                    self._prefetch_distributions(col, by)
+            return rollup_group_aggregates(self.cube, self, by, median_cols=median_cols)
+        return self._memo(('group_aggregates', by, median_cols), compute)
+
+    def _item_totals(self):
+        """小問ごとの得点の合計と解答数（欠損を除いた件数）"""
+        def compute():
+            exprs = [f'TOTAL({_quote(q)}), COUNT({_quote(q)})' for q in self.item_cols]
+            row = self._select(', '.join(exprs))[0] if exprs else ()
+            sums = pd.Series(row[0::2], index=self.item_cols, dtype=np.float64)
+            counts = pd.Series(row[1::2], index=self.item_cols, dtype=np.int64)
+            return sums, counts
+        return self._memo('item_totals', compute)
+
+    def item_correct_counts(self):
+        """小問ごとの正答者数（配点がある場合は得点の合計、小数の得点を含む場合は小数）"""
+        sums = self._item_totals()[0]
+        if np.array_equal(sums, sums.round()):
+            return sums.astype(np.int64)
+        return sums
+
+    def item_response_counts(self):
+        """小問ごとの解答者数（欠損（無回答）を除いた件数）"""
+        return self._item_totals()[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='成績ファイルを採点してSQLiteのデータセットに追加')
+    parser.add_argument('database', help='SQLiteのデータベースファイル（なければ作成）')
+    parser.add_argument('dataset', help='データセットの名前（例: 2024年度全校）')
+    parser.add_argument('files', nargs='+', help='追加する成績ファイル（CSV・Parquet・Arrow IPC）')
+    parser.add_argument('--blueprint', help='テスト設計ファイル（YAML・JSON・CSV、既定: 能力・領域パラメータ）')
+    args = parser.parse_args(argv)
+
+    blueprint = DEFAULT_BLUEPRINT
+    blueprint_hash = ''
+    if args.blueprint:
+        blueprint = load_blueprint(args.blueprint)
+        # ダッシュボードでテスト設計ファイルを指定したときと同じ識別子
+        blueprint_hash = compute_source_hash(args.blueprint)
+    backend = SqlBackend(args.database)
+    for path in args.files:
+        n_rows = backend.load_file(args.dataset, path, blueprint, blueprint_hash)
+        print(f'{path}: {n_rows:,}行を追加')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,131 @@
+import numpy as np
+
+# ヒストグラムの階級数（得点率 0〜100% を等幅に分割）
+HISTOGRAM_BINS = 20
+# 箱ひげ図に描く外れ値の最大点数
+MAX_OUTLIER_POINTS = 100
+
+
+def summarize_distribution(values, bins=HISTOGRAM_BINS, value_range=(0, 100),
+                           max_outliers=MAX_OUTLIER_POINTS, seed=0):
+    """箱ひげ図とヒストグラムの要約統計量を計算
+
+    四分位数・ひげ（1.5×IQR の範囲内の最小・最大値）・外れ値の抽出と、
+    固定階級のヒストグラムの度数を返す。結果の大きさは人数によらない。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    edges = np.linspace(value_range[0], value_range[1], bins + 1)
+    if len(values) == 0:
+        return {'n': 0, 'hist_counts': np.zeros(bins, dtype=np.int64), 'hist_edges': edges}
+
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    outliers = values[(values < q1 - 1.5 * iqr) | (values > q3 + 1.5 * iqr)]
+    if len(outliers) > max_outliers:
+        # 最小・最大の外れ値は必ず残し、残りは無作為に抽出
+        rng = np.random.default_rng(seed)
+        sampled = rng.choice(outliers, max_outliers - 2, replace=False)
+        outliers = np.concatenate([[outliers.min(), outliers.max()], sampled])
+
+    counts, _ = np.histogram(np.clip(values, edges[0], edges[-1]), bins=edges)
+    return {
+        'n': len(values),
+        'mean': values.mean(),
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'lowerfence': inside.min(),
+        'upperfence': inside.max(),
+        'outliers': outliers,
+        'hist_counts': counts,
+        'hist_edges': edges,
+    }
+
+
+def summarize_sketch(sketch, mean, bins=HISTOGRAM_BINS, value_range=(0, 100)):
+    """分位点スケッチ（QuantileSketch）から summarize_distribution と同じ形式の要約を作成
+
+    四分位数はスケッチによる近似値。ひげは 1.5×IQR の範囲を最小・最大値で切り詰めたもので、
+    外れ値は範囲外にある最小・最大値だけを描く。度数は階級の境界の順位から求める。
+    """
+    edges = np.linspace(value_range[0], value_range[1], bins + 1)
+    if sketch.n == 0:
+        return {'n': 0, 'hist_counts': np.zeros(bins, dtype=np.int64), 'hist_edges': edges}
+
+    q1, median, q3 = sketch.quantile([0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    lower, upper = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+    outliers = np.unique([v for v in (sketch.min, sketch.max) if v < lower or v > upper])
+
+    # 範囲外の値は両端の階級に含める（summarize_distribution の切り詰めと同じ扱い）
+    below = np.round(sketch.rank(edges, inclusive=False) * sketch.n)
+    below[0] = 0
+    below[-1] = sketch.n
+    return {
+        'n': sketch.n,
+        'mean': mean,
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'lowerfence': max(sketch.min, lower),
+        'upperfence': min(sketch.max, upper),
+        'outliers': outliers,
+        'hist_counts': np.diff(below).astype(np.int64),
+        'hist_edges': edges,
+    }
+
+
+def fit_line(x, y):
+    """最小二乗法による回帰直線と相関係数を閉形式で計算（欠損を含む組は除く）"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x = x[valid]
+    y = y[valid]
+    n = len(x)
+    if n < 2:
+        return {'n': n, 'slope': np.nan, 'intercept': np.nan, 'r': np.nan,
+                'x_min': np.nan, 'x_max': np.nan}
+
+    mean_x = x.mean()
+    mean_y = y.mean()
+    dx = x - mean_x
+    dy = y - mean_y
+    sxx = dx @ dx
+    syy = dy @ dy
+    sxy = dx @ dy
+    slope = sxy / sxx if sxx > 0 else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = sxy / np.sqrt(sxx * syy)
+    return {
+        'n': n,
+        'slope': slope,
+        'intercept': mean_y - slope * mean_x,
+        'r': r,
+        'x_min': x.min(),
+        'x_max': x.max(),
+    }
+
+
+def compute_correlation_matrix(values):
+    """列間の相関行列を行列積でまとめて計算（列の組ごとに欠損を含む行は除く）
+
+    values は (行, 列) の配列。欠損がなければ np.corrcoef と同じ値になる。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    # 数値誤差を抑えるため、列の平均を引いてから積和を求める
+    centered = np.where(present, values - np.nanmean(values, axis=0), 0)
+    mask = present.astype(np.float64)
+    n = mask.T @ mask
+    sums = centered.T @ mask
+    squares = (centered * centered).T @ mask
+    products = centered.T @ centered
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = n * products - sums * sums.T
+        var = n * squares - sums * sums
+        corr = cov / np.sqrt(var * var.T)
+    corr[n < 2] = np.nan
+    return np.clip(corr, -1, 1)
@@ -0,0 +1,122 @@
+import numpy as np
+import pyarrow as pa
+
+from aggregation import AggregateCube, get_aggregate_value_cols, get_score_columns, rollup_group_aggregates
+from ingest import STREAM_BLOCK_BYTES, iter_frames
+from scoring import DEFAULT_BLUEPRINT, calculate_scores
+from sketches import DEFAULT_SKETCH_K, GroupSketches
+
+
+class StreamingAggregates:
+    """ファイルを分割して読み、チャンクごとの集計を畳み込んだ結果
+
+    学年×クラス×教科のセルごとに、集計キューブ（件数・合計・二乗和・最小・最大）と
+    得点率の分位点スケッチを持つ。小問の列もキューブに含めるため、合計が正答者数になる。
+    生徒の行は保持しないので、メモリ使用量はファイルの行数によらない。
+    """
+
+    def __init__(self, cube=None, sketches=None, item_cols=(), sketch_k=DEFAULT_SKETCH_K,
+                 blueprint=DEFAULT_BLUEPRINT):
+        self.cube = cube
+        # セルごとの得点率の分位点スケッチ（GroupSketches）
+        self.sketches = sketches
+        self.item_cols = list(item_cols)
+        self.sketch_k = sketch_k
+        # チャンクの採点に使うテスト設計
+        self.blueprint = blueprint
+
+    @classmethod
+    def from_source(cls, source, block_bytes=STREAM_BLOCK_BYTES, sketch_k=DEFAULT_SKETCH_K,
+                    blueprint=DEFAULT_BLUEPRINT):
+        """ファイル（バイト列・パス・ファイルオブジェクト）を分割して読み込み・集計
+
+        小問に小数を含むCSVで型が合わない場合は、小問を小数として最初から読み直す。
+        """
+        try:
+            return cls._fold(iter_frames(source, block_bytes, items=blueprint.items), sketch_k, blueprint)
+        except pa.ArrowInvalid:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            return cls._fold(iter_frames(source, block_bytes, typed=False, items=blueprint.items),
+                             sketch_k, blueprint)
+
+    @classmethod
+    def _fold(cls, frames, sketch_k, blueprint=DEFAULT_BLUEPRINT):
+        aggregates = cls(sketch_k=sketch_k, blueprint=blueprint)
+        for frame in frames:
+            aggregates.add_chunk(frame)
+        return aggregates
+
+    @property
+    def dims(self):
+        return self.cube.dims if self.cube is not None else []
+
+    @property
+    def n_rows(self):
+        """集計した行数"""
+        if self.cube is None or 'total_score' not in self.cube.value_cols:
+            return 0
+        return int(self.cube.cells['n']['total_score'].sum())
+
+    @property
+    def value_cols(self):
+        return self.cube.value_cols if self.cube is not None else []
+
+    def add_chunk(self, df):
+        """チャンク（未採点のDataFrame）を採点して集計に加える"""
+        df = calculate_scores(df, blueprint=self.blueprint)
+        item_cols = [q for q in self.blueprint.items if q in df.columns]
+        self.item_cols += [q for q in item_cols if q not in self.item_cols]
+        chunk_cube = AggregateCube.from_frame(df, value_cols=get_score_columns(df) + item_cols)
+        self.cube = chunk_cube if self.cube is None else self.cube.merge(chunk_cube)
+
+        # セルごとに得点率の値をスケッチへ追加
+        if self.sketches is None:
+            self.sketches = GroupSketches(chunk_cube.dims, self.sketch_k)
+        self.sketches.update(df, get_aggregate_value_cols(df))
+        return self
+
+    def merge(self, other):
+        """別の集計結果をこの集計に結合（自身を返す）"""
+        if other.cube is None:
+            return self
+        self.cube = other.cube if self.cube is None else self.cube.merge(other.cube)
+        self.item_cols += [q for q in other.item_cols if q not in self.item_cols]
+        self.sketches = other.sketches if self.sketches is None else self.sketches.merge(other.sketches)
+        return self
+
+    def values(self, dim):
+        """次元の値の一覧（昇順）"""
+        if dim not in self.dims:
+            return []
+        return list(self.cube.cells['n'].index.unique(dim).sort_values())
+
+    def subset(self, where=None):
+        """条件（{次元: 値のリスト}）に該当するセルだけの集計結果"""
+        if not where or self.cube is None:
+            return self
+        return StreamingAggregates(self.cube.subset(where), self.sketches.subset(where),
+                                   self.item_cols, self.sketch_k, self.blueprint)
+
+    def sketch(self, col, where=None):
+        """条件に該当するセルを合算した列のスケッチ"""
+        return self.sketches.sketch(col, where)
+
+    def summary(self, where=None):
+        """全体の統計量（行: 対象列, 列: 統計量）"""
+        return self.cube.summary(where)
+
+    def item_correct_counts(self):
+        """小問ごとの正答者数（配点がある場合は得点の合計、小数の得点を含む場合は小数）"""
+        sums = self.cube.cells['sum'][self.item_cols].sum()
+        if np.array_equal(sums, sums.round()):
+            return sums.astype(np.int64)
+        return sums
+
+    def item_response_counts(self):
+        """小問ごとの解答者数（欠損（無回答）を除いた件数）"""
+        return self.cube.cells['n'][self.item_cols].sum().astype(np.int64)
+
+    def group_aggregates(self, by='subject'):
+        """compute_group_aggregates と同じ形式のグループ別統計量（中央値はスケッチから求める）"""
+        return rollup_group_aggregates(self.cube, self.sketches, by)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+
+class StudentIndex:
+    """生徒IDから行位置を引く索引
+
+    IDごとの行位置を連続した配列にまとめ、ID → 行位置、ID＋教科 → 行位置の
+    参照を表全体の走査なしで行う。行位置は作成元のDataFrameでの位置（iloc用）。
+    """
+
+    def __init__(self, df):
+        codes, ids = pd.factorize(df['ID'], sort=True)
+        valid = codes >= 0
+        positions = np.flatnonzero(valid)
+        order = np.argsort(codes[valid], kind='stable')
+        counts = np.bincount(codes[valid], minlength=len(ids))
+
+        # ID（コード）ごとの行位置: _rows[_offsets[i]:_offsets[i + 1]]
+        self.ids = pd.Index(ids, name='ID')
+        self._rows = positions[order]
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        if 'subject' in df.columns:
+            self._subject_codes, subjects = pd.factorize(df['subject'])
+            self.subjects = pd.Index(subjects)
+        else:
+            self._subject_codes = None
+            self.subjects = pd.Index([])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, student_id):
+        return student_id in self.ids
+
+    def rows(self, student_id):
+        """生徒の行位置（該当なしの場合は空配列）"""
+        if student_id not in self.ids:
+            return np.array([], dtype=np.int64)
+        code = self.ids.get_loc(student_id)
+        return self._rows[self._offsets[code]:self._offsets[code + 1]]
+
+    def row(self, student_id, subject):
+        """生徒・教科の行位置（該当なしの場合はNone）"""
+        if self._subject_codes is None or subject not in self.subjects:
+            return None
+        rows = self.rows(student_id)
+        matched = rows[self._subject_codes[rows] == self.subjects.get_loc(subject)]
+        return int(matched[0]) if len(matched) else None
@@ -0,0 +1,285 @@
+"""生徒別の診断票の一括作成
+
+成績ファイル全体の比較用平均とパーセンタイル順位を先に計算し、生徒ごとの診断票
+（能力別・領域別のレーダーチャート、比較用平均との比較表、教科別パフォーマンス）を
+プロセスプールで並列に静的なHTMLファイルとして書き出す。
+--blueprint でテスト設計ファイルを指定すると、その軸ごと（能力・領域の代わり）のプロファイルを載せる。
+
+    python student_reports.py scores.csv --output student_reports/ --workers 8
+"""
+import argparse
+import functools
+import html
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from plotly.offline import get_plotlyjs
+from plotly.utils import PlotlyJSONEncoder
+
+from aggregation import AggregateCube
+from analysis import get_category_comparison, get_category_profile, get_comparison_means, get_subject_performance
+from blueprint import load_blueprint
+from charts import make_profile_radar_figure
+from ingest import read_score_file
+from scoring import DEFAULT_BLUEPRINT, calculate_scores
+from student_index import StudentIndex
+
+# 診断票から参照する plotly.js のファイル名（出力先に1つだけ書き出す）
+PLOTLY_JS_NAME = 'plotly.min.js'
+# 1タスクで作成する診断票の数
+STUDENTS_PER_TASK = 200
+# グラフの高さ
+FIGURE_HEIGHT = '380px'
+# テスト設計の軸ごとのレーダーチャートの色（軸の順）
+AXIS_RADAR_COLORS = ['blue', 'green', 'orange', 'red', 'brown']
+
+_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+{scripts}
+<style>
+body {{ font-family: sans-serif; margin: 24px; color: #222; }}
+table {{ border-collapse: collapse; margin: 8px 0 16px; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 10px; text-align: right; }}
+th {{ background: #f3f3f3; }}
+.row {{ display: flex; gap: 16px; }}
+.row > div {{ flex: 1; min-width: 0; }}
+@media print {{ body {{ margin: 0; }} }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+_FIGURE_SCRIPT = """<div id="{div_id}" style="height:{height}"></div>
+<script>Plotly.newPlot("{div_id}", {data}, Object.assign({{template: plotTemplate}}, {layout}),
+{{displayModeBar: false, responsive: true}});</script>"""
+
+# ワーカーごとに共有する計算済みのデータ（_init_worker で設定）
+_shared = {}
+
+
+def get_report_columns(df):
+    """診断票に使う列"""
+    rate_cols = [col for col in df.columns if col.endswith('_rate')]
+    return [col for col in ['ID', 'grade', 'class', 'subject'] if col in df.columns] + rate_cols
+
+
+def get_report_subject(df):
+    """診断票の対象（教科が複数ある場合は '全教科'、1教科のみの場合はその教科）"""
+    if 'subject' in df.columns and df['subject'].nunique() == 1:
+        return df['subject'].iloc[0]
+    return '全教科'
+
+
+def get_total_rate_percentiles(df):
+    """生徒ごとの総合得点率のパーセンタイル順位（全行の総合得点率のうち生徒以下の割合）"""
+    rates = np.sort(df['total_rate'].dropna().to_numpy(dtype=np.float64))
+    student_rates = df.groupby('ID', sort=True)['total_rate'].mean()
+    if len(rates) == 0:
+        return pd.Series(np.nan, index=student_rates.index)
+    positions = np.searchsorted(rates, student_rates.to_numpy(), side='right')
+    return pd.Series(positions / len(rates) * 100, index=student_rates.index)
+
+
+def get_report_file_name(student_id):
+    """生徒IDから診断票のファイル名を作成（ファイル名に使えない文字は _ に置換）"""
+    return re.sub(r'[^\w\-.]', '_', str(student_id)) + '.html'
+
+
+def _format_cell(value):
+    if isinstance(value, (float, np.floating)):
+        return '-' if np.isnan(value) else f'{value:.2f}'
+    return html.escape(str(value))
+
+
+def _table_html(df):
+    """DataFrameをHTMLの表に変換（小数は2桁）"""
+    header = ''.join(f'<th>{html.escape(str(col))}</th>' for col in df.columns)
+    rows = ''.join('<tr>' + ''.join(f'<td>{_format_cell(value)}</td>' for value in row) + '</tr>'
+                   for row in df.itertuples(index=False))
+    return f'<table><thead><tr>{header}</tr></thead><tbody>{rows}</tbody></table>'
+
+
+def _script_json(value):
+    """<script> に埋め込むJSON（ID などに含まれる </script> で途切れないようにする）"""
+    return json.dumps(value, cls=PlotlyJSONEncoder).replace('</', '<\\/')
+
+
+@functools.lru_cache(maxsize=None)
+def _radar_base(color, title=None):
+    """レーダーチャートの図の定義（系列の値は空）
+
+    make_profile_radar_figure で1回だけ作成し、生徒ごとには系列の値と名前だけを差し替える。
+    """
+    return make_profile_radar_figure([], [], [], '', '', color, title).to_dict()
+
+
+def _radar_html(div_id, labels, student_scores, comparison_scores, student_name, comparison_name,
+                color, title=None):
+    """レーダーチャートを描画するHTML（テンプレートはページ共通の plotTemplate を使う）"""
+    base = _radar_base(color, title)
+    data = [
+        {**base['data'][0], 'r': list(student_scores), 'theta': list(labels), 'name': student_name},
+        {**base['data'][1], 'r': list(comparison_scores), 'theta': list(labels), 'name': comparison_name},
+    ]
+    layout = {key: value for key, value in base['layout'].items() if key != 'template'}
+    return _FIGURE_SCRIPT.format(div_id=div_id, height=FIGURE_HEIGHT,
+                                 data=_script_json(data), layout=_script_json(layout))
+
+
+@functools.lru_cache(maxsize=None)
+def _plot_template_json():
+    """ページ共通の plotly のテンプレート（JSON）"""
+    return _script_json(_radar_base('blue')['layout']['template'])
+
+
+def render_student_report(student_id, student_rows, comparison_means, subject, percentile,
+                          plotly_js=PLOTLY_JS_NAME, blueprint=DEFAULT_BLUEPRINT):
+    """生徒1人の診断票のHTMLを作成
+
+    student_rows は生徒の行（教科ごと）、comparison_means は get_comparison_means の結果、
+    subject は比較に使う教科（'全教科' の場合は教科の平均を全体の平均と比べる）。
+    プロファイルと比較表は blueprint（テスト設計）の軸ごとに作る。
+    """
+    if len(student_rows) > 1:
+        student_data = student_rows.mean(numeric_only=True)
+    else:
+        student_data = student_rows.iloc[0]
+    comparison = comparison_means.loc[subject]
+    name = html.escape(str(student_id))
+    subject_label = html.escape(str(subject))
+
+    rate_label = '総合得点率（全教科平均）' if subject == '全教科' else f'総合得点率（{subject}）'
+    info = pd.DataFrame([{
+        'ID': student_id,
+        '学年': student_rows['grade'].iloc[0] if 'grade' in student_rows.columns else '-',
+        'クラス': student_rows['class'].iloc[0] if 'class' in student_rows.columns else '-',
+        rate_label: f"{student_data['total_rate']:.1f}%",
+        'パーセンタイル順位': f'{percentile:.0f}' if pd.notna(percentile) else '-',
+    }])
+    body = ['<h1>個別診断票</h1>', _table_html(info)]
+
+    if subject == '全教科' and len(student_rows) > 1:
+        subject_scores = student_rows[['subject', 'total_rate']].copy()
+        subject_scores.columns = ['教科', '総合得点率(%)']
+        body += ['<h2>教科別総合得点率</h2>', _table_html(subject_scores)]
+
+    figures = []
+    for i, (axis, axis_label) in enumerate(blueprint.axes.items()):
+        names, student_scores, comparison_scores = get_category_profile(student_data, comparison,
+                                                                        blueprint.labels(axis))
+        radar = _radar_html(f'axis{i}', names, student_scores, comparison_scores,
+                            f'{student_id} ({subject})', f'クラス平均 ({subject})',
+                            AXIS_RADAR_COLORS[i % len(AXIS_RADAR_COLORS)])
+        figures.append(f'<div><h2>{html.escape(axis_label)}別プロファイル</h2>{radar}</div>')
+    body.append(f'<div class="row">{"".join(figures)}</div>')
+
+    body.append('<h2>強み・弱みの分析</h2>')
+    for axis, axis_label in blueprint.axes.items():
+        body += [f'<h3>{html.escape(axis_label)}別比較（{subject_label}）</h3>',
+                 _table_html(get_category_comparison(student_data, comparison, blueprint.labels(axis)))]
+
+    if subject == '全教科' and 'subject' in student_rows.columns and student_rows['subject'].nunique() > 1:
+        performance = get_subject_performance(student_rows, comparison_means)
+        radar = _radar_html('subject', performance['教科'], performance['生徒得点率(%)'],
+                            performance['クラス平均(%)'], str(student_id), 'クラス平均', 'purple',
+                            title='教科別総合得点率')
+        body += ['<h2>教科別パフォーマンス</h2>', _table_html(performance), radar]
+
+    scripts = f'<script src="{plotly_js}"></script>\n<script>const plotTemplate = {_plot_template_json()};</script>'
+    return _PAGE_TEMPLATE.format(title=f'個別診断票 {name}', scripts=scripts, body='\n'.join(body))
+
+
+def _init_worker(df, comparison_means, percentiles, subject, output_dir, blueprint=DEFAULT_BLUEPRINT):
+    """ワーカーの起動時に計算済みのデータを受け取る"""
+    _shared.update(df=df, comparison_means=comparison_means, percentiles=percentiles, subject=subject,
+                   output_dir=Path(output_dir), index=StudentIndex(df), blueprint=blueprint)
+
+
+def _write_reports(student_ids):
+    """生徒IDのリストの診断票を書き出し、書き出した数を返す"""
+    df = _shared['df']
+    index = _shared['index']
+    for student_id in student_ids:
+        student_rows = df.iloc[index.rows(student_id)]
+        if _shared['subject'] != '全教科':
+            student_rows = student_rows[student_rows['subject'] == _shared['subject']]
+        report = render_student_report(student_id, student_rows, _shared['comparison_means'],
+                                       _shared['subject'], _shared['percentiles'].get(student_id),
+                                       blueprint=_shared['blueprint'])
+        path = _shared['output_dir'] / get_report_file_name(student_id)
+        path.write_text(report, encoding='utf-8')
+    return len(student_ids)
+
+
+def write_index(df, output_dir):
+    """診断票の一覧ページ（学年・クラス・ID順）を書き出す"""
+    cols = [col for col in ['grade', 'class', 'ID'] if col in df.columns]
+    students = df[cols].drop_duplicates('ID').sort_values(cols)
+    students['ID'] = [f'<a href="{get_report_file_name(student_id)}">{html.escape(str(student_id))}</a>'
+                      for student_id in students['ID']]
+    students = students.rename(columns={'grade': '学年', 'class': 'クラス'})
+    body = ['<h1>個別診断票 一覧</h1>', students.to_html(index=False, border=0, escape=False)]
+    page = _PAGE_TEMPLATE.format(title='個別診断票 一覧', scripts='', body='\n'.join(body))
+    (Path(output_dir) / 'index.html').write_text(page, encoding='utf-8')
+
+
+def write_student_reports(df, output_dir, workers=1, students_per_task=STUDENTS_PER_TASK,
+                          blueprint=DEFAULT_BLUEPRINT):
+    """得点計算済みのDataFrameから全生徒の診断票を書き出し、書き出した数を返す
+
+    比較用平均とパーセンタイル順位は全体で1回だけ計算し、ワーカーに共有する。
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / PLOTLY_JS_NAME).write_text(get_plotlyjs(), encoding='utf-8')
+    write_index(df, output_dir)
+
+    df = df[get_report_columns(df)].reset_index(drop=True)
+    subject = get_report_subject(df)
+    comparison_means = get_comparison_means(AggregateCube.from_frame(df))
+    percentiles = get_total_rate_percentiles(df)
+    student_ids = list(pd.unique(df['ID']))
+    tasks = [student_ids[i:i + students_per_task] for i in range(0, len(student_ids), students_per_task)]
+    initargs = (df, comparison_means, percentiles, subject, output_dir, blueprint)
+
+    if workers == 1:
+        # 1プロセスの場合はプールを作らずに順に処理
+        _init_worker(*initargs)
+        return sum(_write_reports(task) for task in tasks)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as pool:
+        return sum(pool.map(_write_reports, tasks))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生徒別の診断票（HTML）を一括作成')
+    parser.add_argument('input_file', help='成績ファイル（CSV・Parquet・Arrow）')
+    parser.add_argument('--output', default='student_reports', help='診断票の出力先（既定: student_reports）')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='並列に処理するプロセス数（既定: CPUコア数）')
+    parser.add_argument('--blueprint', help='テスト設計ファイル（YAML・JSON・CSV、既定: 能力・領域パラメータ）')
+    args = parser.parse_args(argv)
+
+    blueprint = load_blueprint(args.blueprint) if args.blueprint else DEFAULT_BLUEPRINT
+    start = time.perf_counter()
+    df = calculate_scores(read_score_file(Path(args.input_file).read_bytes(), blueprint.items), blueprint=blueprint)
+    n_reports = write_student_reports(df, args.output, max(args.workers, 1), blueprint=blueprint)
+    elapsed = time.perf_counter() - start
+    print(f'{n_reports:,}人の診断票を{elapsed:.2f}秒で作成 '
+          f'（{n_reports / elapsed:,.0f} 人/秒、{args.workers}プロセス）: {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())